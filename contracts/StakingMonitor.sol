@@ -5,6 +5,7 @@ pragma abicoder v2;
 import "@chainlink/contracts/src/v0.8/interfaces/AggregatorV3Interface.sol";
 import "@chainlink/contracts/src/v0.8/interfaces/KeeperCompatibleInterface.sol";
 import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
+import "@openzeppelin/contracts/utils/math/SafeCast.sol";
 import "../interfaces/IUniswapV2.sol";
 import "./ABDKMath64x64.sol";
 
@@ -14,16 +15,52 @@ error StakingMonitor__UserHasntDepositedETH();
 error StakingMonitor__NotEnoughETHInUsersBalance();
 error StakingMonitor_NotEnoughDAIInUsersBalance();
 error StakingMonitor_UserDoesntHaveAccount();
+error StakingMonitor__InvalidUpkeepRange();
 
+// packed into 3 storage slots:
+// slot 0: created, enoughDepositForSwap, depositBalance, DAIBalance
+// slot 1: priceLimit, percentageToSwap, balanceToSwap
+// slot 2: previousBalance, swapCheckpoint
+// priceLimit and DAIBalance get 128 bits, as they hold 18 decimals DAI amounts and prices scaled by 8 more decimals
+// swapCheckpoint is 0 unless the balanceToSwap is in the swap pool of the user's price bucket. It is then the number of swaps
+// of that pool when the balanceToSwap joined it, plus one: once the pool has been swapped that many times, the balanceToSwap
+// has been swapped and the user is waiting to be credited, see _settleSwap
 struct userData {
     bool created;
     bool enoughDepositForSwap;
-    uint256 depositBalance;
-    uint256 DAIBalance;
-    uint256 priceLimit;
-    uint256 percentageToSwap;
-    uint256 balanceToSwap;
-    uint256 previousBalance;
+    uint96 depositBalance;
+    uint128 DAIBalance;
+    uint128 priceLimit;
+    uint8 percentageToSwap;
+    uint96 balanceToSwap;
+    uint96 previousBalance;
+    uint32 swapCheckpoint;
+}
+
+// totals, price and timestamp of a swap, which are also emitted once in its SwapBatch event
+struct swapRoundData {
+    uint128 totalAmountToSwap;
+    uint128 totalDAIFromSwap;
+    uint128 ETHPrice;
+    uint64 timestamp;
+}
+
+// a swap of the pool of a price bucket: the DAI-per-ETH index of the bucket after the swap, scaled by DAI_PER_ETH_PRECISION,
+// and the swap round the pool was swapped in
+struct priceBucketSwap {
+    uint224 cumulativeDAIPerETH;
+    uint32 swapRound;
+}
+
+// what an upkeep did, counted while it runs and emitted in its UpkeepPerformed event
+struct upkeepSummary {
+    uint256 usersScanned;
+    uint256 usersRewarded;
+    uint256 usersWithoutEnoughDeposit;
+    uint256 swapParticipants;
+    uint256 totalETHSwapped;
+    uint256 DAIReceived;
+    uint256 ETHPrice;
 }
 
 /**
@@ -41,18 +78,41 @@ contract StakingMonitor is KeeperCompatibleInterface {
     event OrderSet(address indexed user);
     event WithdrawnETH(address indexed user, uint256 _amount);
     event WithdrawnDAI(address indexed user, uint256 _amount);
-    event Swapped(
-        address indexed _address,
+    // one event per swap round, with the round's timestamp, price and totals, and the ETH swapped from the pool of each price bucket,
+    // packed as bucket << 128 | ETH swapped. It doesn't list the participants: the pools are swapped without visiting their users.
+    // Their records are deferred to their SwapSettled events, and can be rebuilt from the SwapBatch event, s_priceBucketSwaps
+    // and the state at the block of the swap, see scripts/swap_batches.py
+    event SwapBatch(
+        uint256 indexed _swapRound,
         uint256 _timestamp,
+        uint256 _ETHPrice,
+        uint256 _totalETHSwapped,
+        uint256 _DAIReceived,
+        uint256[] _priceBuckets
+    );
+    // one event per participant of a swap, emitted when they are credited with their share, see _creditSwap.
+    // The timestamp and price of the swap are the ones of the SwapBatch event of _swapRound
+    event SwapSettled(
+        address indexed _address,
+        uint256 indexed _swapRound,
         uint256 _totalReward,
         uint256 _setPriceLimit,
-        uint256 _DAIReceived,
-        uint256 _ETHPrice
+        uint256 _DAIReceived
     );
     event NotEnoughDepositedEthForSwap(
         address indexed _address,
         uint256 _requiredDepositAmount
     );
+    event RemovedFromWatchList(address indexed user);
+    event UpkeepPerformed(
+        uint256 _usersScanned,
+        uint256 _usersRewarded,
+        uint256 _usersWithoutEnoughDeposit,
+        uint256 _swapParticipants,
+        uint256 _totalETHSwapped,
+        uint256 _DAIReceived,
+        uint256 _ETHPrice
+    );
 
     AggregatorV3Interface public priceFeed;
     IERC20 public immutable DAIToken;
@@ -61,8 +121,51 @@ contract StakingMonitor is KeeperCompatibleInterface {
     uint256 public lastTimeStamp;
     uint256 public immutable interval;
 
+    // the data of the users before the settlement of their last swap, see getSettledUserData
     mapping(address => userData) public s_users;
     address[] public s_watchList;
+    // index of each user in s_watchList, only meaningful for the users whose data is created
+    mapping(address => uint256) public s_watchListIndex;
+    // index in s_watchList where the next compaction pass should start, see _compactWatchList
+    uint256 public s_compactionCursor;
+    // maximum number of watchlist entries checked by a compaction pass, so that it doesn't add more than a bounded cost to an upkeep
+    uint256 public constant COMPACTION_BATCH_SIZE = 20;
+
+    // the users who have set an order are indexed by the bucket of their priceLimit, see getPriceBucket. Since the buckets under
+    // the price are swapped as whole pools, a swap only reads the users of the bucket of the price, and getLowestPendingPriceLimit
+    // only the users of the lowest bucket with pending swaps: the buckets are found through s_pendingPriceBuckets
+    uint256 public constant PRICE_BUCKET_COUNT = 7872;
+    // (PRICE_BUCKET_COUNT + 255) / 256
+    uint256 constant PRICE_BUCKET_WORDS = 31;
+    mapping(uint256 => address[]) public s_priceBuckets;
+    // index of each user in their price bucket, plus one, so that 0 means the user isn't indexed
+    mapping(address => uint256) public s_priceBucketIndex;
+    // the balanceToSwap of a user with enough deposit for it is pending until it is swapped. It is then in the swap pool
+    // of the user's price bucket, see _joinSwapPool: the pools are swapped as a whole, without visiting their users.
+    // The pending swaps are counted per price bucket, so that checkUpkeep can tell if an order can be executed without
+    // visiting every user, see checkLowestLimitUnderCurrentPrice
+    uint256 public s_pendingSwapCount;
+    mapping(uint256 => uint256) public s_pendingSwapsPerPriceBucket;
+    // the ETH of the pending swaps of each price bucket
+    mapping(uint256 => uint256) public s_pendingETHPerPriceBucket;
+    // bit (bucket % 256) of word (bucket / 256) is set when the bucket has pending swaps
+    uint256[PRICE_BUCKET_WORDS] public s_pendingPriceBuckets;
+    // the swaps of the pool of each price bucket, in order, see _getSwapShare
+    mapping(uint256 => priceBucketSwap[]) public s_priceBucketSwaps;
+    // the DAI-per-ETH indices are scaled by this factor, so that a share is at most 1 wei under an exact pro rata share per ETH swapped
+    uint256 public constant DAI_PER_ETH_PRECISION = 1e18;
+    // index in s_watchList where the next paginated upkeep should start (0 when no round is in progress)
+    uint256 public s_watchListCursor;
+    // swap rounds are numbered from 1
+    mapping(uint256 => swapRoundData) public s_swapRounds;
+    uint32 public s_swapRoundCount;
+
+    // how performUpkeep should process the watchlist, see checkUpkeep
+    enum UpkeepMode {
+        Paginated,
+        UsersToUpdate,
+        ChangedUsers
+    }
 
     constructor(
         address _priceFeed,
@@ -92,17 +195,22 @@ contract StakingMonitor is KeeperCompatibleInterface {
      * Finally, it adds the amount deposited to the contract's user's balance.
      */
     function deposit() external payable {
+        userData storage user = s_users[msg.sender];
         // we check if we already have user data for this user
-        if (!s_users[msg.sender].created) {
+        if (!user.created) {
+            s_watchListIndex[msg.sender] = s_watchList.length;
             s_watchList.push(msg.sender);
         }
-        s_users[msg.sender].created = true;
-        s_users[msg.sender].depositBalance =
-            s_users[msg.sender].depositBalance +
-            msg.value;
+        _settleSwap(msg.sender);
+        user.created = true;
+        user.depositBalance = SafeCast.toUint96(
+            user.depositBalance + msg.value
+        );
         // we update previousBalance for the user.
-        s_users[msg.sender].previousBalance = msg.sender.balance;
-        s_users[msg.sender].enoughDepositForSwap = true;
+        user.previousBalance = SafeCast.toUint96(msg.sender.balance);
+        user.enoughDepositForSwap = user.balanceToSwap <= user.depositBalance;
+        // the deposit can be what the balanceToSwap was waiting for
+        _joinSwapPool(user);
         emit Deposited(msg.sender, msg.value);
     }
 
@@ -111,20 +219,27 @@ contract StakingMonitor is KeeperCompatibleInterface {
      * @dev  _amount is removed from their internal contract balance.
      */
     function withdrawETH(uint256 _amount) external {
-        if (!s_users[msg.sender].created) {
+        userData storage user = s_users[msg.sender];
+        if (!user.created) {
             revert StakingMonitor_UserDoesntHaveAccount();
         }
+        _settleSwap(msg.sender);
 
-        if (_amount > s_users[msg.sender].depositBalance) {
+        if (_amount > user.depositBalance) {
             revert StakingMonitor__NotEnoughETHInUsersBalance();
         }
-        s_users[msg.sender].depositBalance =
-            s_users[msg.sender].depositBalance -
-            _amount;
+        // cannot overflow, _amount is not larger than depositBalance
+        user.depositBalance -= uint96(_amount);
+        if (user.balanceToSwap > user.depositBalance) {
+            // the pending swap waits for a new deposit, like after a reward larger than the deposit
+            _leaveSwapPool(user);
+            user.enoughDepositForSwap = false;
+        }
         payable(msg.sender).transfer(_amount);
         // we update previousBalance for the user.
-        s_users[msg.sender].previousBalance = msg.sender.balance;
+        user.previousBalance = SafeCast.toUint96(msg.sender.balance);
         emit WithdrawnETH(msg.sender, _amount);
+        _removeFromWatchListIfEmpty(msg.sender);
     }
 
     /**
@@ -132,36 +247,145 @@ contract StakingMonitor is KeeperCompatibleInterface {
      * @dev  _amount is removed from their internal contract balance.
      */
     function withdrawDAI(uint256 _amount) external {
-        if (!s_users[msg.sender].created) {
+        userData storage user = s_users[msg.sender];
+        if (!user.created) {
             revert StakingMonitor_UserDoesntHaveAccount();
         }
+        _settleSwap(msg.sender);
 
-        if (_amount > s_users[msg.sender].DAIBalance) {
+        if (_amount > user.DAIBalance) {
             revert StakingMonitor_NotEnoughDAIInUsersBalance();
         }
 
-        s_users[msg.sender].DAIBalance -= _amount;
+        // cannot overflow, _amount is not larger than DAIBalance
+        user.DAIBalance -= uint128(_amount);
         DAIToken.transfer(msg.sender, _amount);
         emit WithdrawnDAI(msg.sender, _amount);
+        _removeFromWatchListIfEmpty(msg.sender);
     }
 
     /**
      * @notice Gets the calling user's main network currency balance
      */
     function getDepositBalance() external view returns (uint256) {
-        return s_users[msg.sender].depositBalance;
+        return _getSettledUserData(msg.sender).depositBalance;
     }
 
     /**
      * @notice Gets the calling user's DAI balance
      */
     function getDAIBalance() external view returns (uint256) {
-        return s_users[msg.sender].DAIBalance;
+        return _getSettledUserData(msg.sender).DAIBalance;
     }
 
     /// @notice Gets the calling user's data
     function getUserData() external view returns (userData memory) {
-        return s_users[msg.sender];
+        return _getSettledUserData(msg.sender);
+    }
+
+    /**
+     * @notice Gets the data of any user, including the share of their last swap.
+     * @dev A swap doesn't write to the data of its participants: they are only credited by _settleSwap, the next time they
+     * interact with the contract or receive a reward. Until then, the public s_users getter returns their data before the swap:
+     * a depositBalance that still includes the balanceToSwap, and a DAIBalance without its share. Off-chain readers should use
+     * this function, getUserData or getUsersData instead.
+     */
+    function getSettledUserData(address userAddress)
+        external
+        view
+        returns (userData memory)
+    {
+        return _getSettledUserData(userAddress);
+    }
+
+    /// @notice Gets the number of addresses in the watchlist
+    function getWatchListLength() external view returns (uint256) {
+        return s_watchList.length;
+    }
+
+    /**
+     * @notice Gets the addresses and data of up to limit users of the watchlist, starting at index offset.
+     * @dev Lets off-chain clients read the whole state in a few calls instead of one s_watchList and one s_users call per user.
+     * Like getUserData, the data includes the share of the users' pending swaps.
+     */
+    function getUsersData(uint256 offset, uint256 limit)
+        external
+        view
+        returns (address[] memory addresses, userData[] memory usersData)
+    {
+        uint256 end = s_watchList.length;
+        if (offset > end) {
+            offset = end;
+        }
+        if (limit < end - offset) {
+            end = offset + limit;
+        }
+        addresses = new address[](end - offset);
+        usersData = new userData[](end - offset);
+        for (uint256 idx = offset; idx < end; idx++) {
+            addresses[idx - offset] = s_watchList[idx];
+            usersData[idx - offset] = _getSettledUserData(s_watchList[idx]);
+        }
+    }
+
+    /**
+     * @dev Removes a user from the watchlist if their account is empty: nothing deposited, no DAI and no balance waiting to be swapped.
+     * While a paginated round is in progress, moving the last entry would make it skip a user, so the user is left for a later compaction pass.
+     */
+    function _removeFromWatchListIfEmpty(address userAddress) internal {
+        if (s_watchListCursor == 0 && _isEmpty(s_users[userAddress])) {
+            _removeFromWatchList(userAddress);
+        }
+    }
+
+    function _isEmpty(userData storage user) internal view returns (bool) {
+        return
+            user.depositBalance == 0 &&
+            user.DAIBalance == 0 &&
+            user.balanceToSwap == 0 &&
+            user.swapCheckpoint == 0;
+    }
+
+    /**
+     * @dev Removes a user from the watchlist in O(1), by moving the last entry to their index, and deletes their data,
+     * so that a later deposit adds them back like a new user.
+     */
+    function _removeFromWatchList(address userAddress) internal {
+        uint256 idx = s_watchListIndex[userAddress];
+        address lastUserAddress = s_watchList[s_watchList.length - 1];
+        s_watchList[idx] = lastUserAddress;
+        s_watchListIndex[lastUserAddress] = idx;
+        s_watchList.pop();
+        delete s_watchListIndex[userAddress];
+        _removeFromPriceBucket(userAddress, s_users[userAddress].priceLimit);
+        delete s_users[userAddress];
+        emit RemovedFromWatchList(userAddress);
+    }
+
+    /**
+     * @dev Checks up to COMPACTION_BATCH_SIZE watchlist entries from s_compactionCursor and removes the empty accounts,
+     * wrapping around at the end of the watchlist. Called at the end of each upkeep, except during a paginated round, for the
+     * same reason as in _removeFromWatchListIfEmpty.
+     */
+    function _compactWatchList() internal {
+        if (s_watchListCursor != 0) {
+            return;
+        }
+        uint256 idx = s_compactionCursor;
+        for (
+            uint256 checks = 0;
+            checks < COMPACTION_BATCH_SIZE && idx < s_watchList.length;
+            checks++
+        ) {
+            address userAddress = s_watchList[idx];
+            if (_isEmpty(s_users[userAddress])) {
+                // the last entry is moved to idx, so it is checked next
+                _removeFromWatchList(userAddress);
+            } else {
+                idx++;
+            }
+        }
+        s_compactionCursor = idx < s_watchList.length ? idx : 0;
     }
 
     /**
@@ -170,16 +394,230 @@ contract StakingMonitor is KeeperCompatibleInterface {
      * @dev We add 8 decimals to the priceLimit they enter, to match the decimals returned by getPrice.
      */
     function setOrder(uint256 _priceLimit, uint256 _percentageToSwap) external {
+        userData storage user = s_users[msg.sender];
         // a user cannot set a price limit if they haven't deposited some eth
-        if (s_users[msg.sender].depositBalance == 0) {
+        if (user.depositBalance == 0) {
             revert StakingMonitor__UserHasntDepositedETH();
         }
-        s_users[msg.sender].percentageToSwap = _percentageToSwap;
+        // a balance swapped with the previous order is credited with it
+        _settleSwap(msg.sender);
+        user.percentageToSwap = SafeCast.toUint8(_percentageToSwap);
         // priceLimit needs to have same units as what is returned by getPrice
-        s_users[msg.sender].priceLimit = _priceLimit * 100000000;
+        uint128 priceLimit = SafeCast.toUint128(_priceLimit * 100000000);
+        uint256 previousBucket = getPriceBucket(user.priceLimit);
+        uint256 bucket = getPriceBucket(priceLimit);
+        if (s_priceBucketIndex[msg.sender] == 0 || bucket != previousBucket) {
+            _removeFromPriceBucket(msg.sender, user.priceLimit);
+            _addToPriceBucket(msg.sender, priceLimit);
+        }
+        if (bucket != previousBucket) {
+            // a pending swap moves to the swap pool of the new bucket
+            _leaveSwapPool(user);
+            user.priceLimit = priceLimit;
+            _joinSwapPool(user);
+        } else {
+            user.priceLimit = priceLimit;
+        }
         emit OrderSet(msg.sender);
     }
 
+    /**
+     * @notice Utility pure function that returns the bucket a price limit is indexed in.
+     * @dev Buckets are log-linear: prices under 128 get their own bucket, and each power of two above them is split into 64 buckets,
+     * so that a bucket spans less than 1.6% of its prices. Buckets are ordered like prices: every price limit of a bucket
+     * is lower than every price limit of the next ones. The largest priceLimit, 2**128 - 1, falls in the last bucket.
+     */
+    function getPriceBucket(uint256 price) public pure returns (uint256) {
+        if (price < 128) {
+            return price;
+        }
+        uint256 msb = _mostSignificantBit(price);
+        return (msb - 5) * 64 + ((price >> (msb - 6)) & 63);
+    }
+
+    /// @dev Returns the index of the most significant bit of x, which must not be 0.
+    function _mostSignificantBit(uint256 x) internal pure returns (uint256 msb) {
+        for (uint256 bits = 128; bits > 0; bits /= 2) {
+            if (x >= uint256(1) << bits) {
+                x >>= bits;
+                msb += bits;
+            }
+        }
+    }
+
+    function _addToPriceBucket(address userAddress, uint256 priceLimit)
+        internal
+    {
+        uint256 bucket = getPriceBucket(priceLimit);
+        s_priceBuckets[bucket].push(userAddress);
+        s_priceBucketIndex[userAddress] = s_priceBuckets[bucket].length;
+    }
+
+    /// @dev Removes a user from their price bucket in O(1), by moving the last user of the bucket to their index.
+    function _removeFromPriceBucket(address userAddress, uint256 priceLimit)
+        internal
+    {
+        uint256 position = s_priceBucketIndex[userAddress];
+        if (position == 0) {
+            return;
+        }
+        uint256 bucket = getPriceBucket(priceLimit);
+        address[] storage bucketUsers = s_priceBuckets[bucket];
+        address lastUserAddress = bucketUsers[bucketUsers.length - 1];
+        bucketUsers[position - 1] = lastUserAddress;
+        s_priceBucketIndex[lastUserAddress] = position;
+        bucketUsers.pop();
+        delete s_priceBucketIndex[userAddress];
+    }
+
+    /**
+     * @dev A user's swap is pending when their balanceToSwap is in the swap pool of their price bucket, and the pool hasn't been
+     * swapped since it joined.
+     */
+    function _isSwapPending(userData storage user, uint256 bucket)
+        internal
+        view
+        returns (bool)
+    {
+        return
+            user.swapCheckpoint != 0 &&
+            s_priceBucketSwaps[bucket].length < user.swapCheckpoint;
+    }
+
+    /**
+     * @dev Adds the balanceToSwap of a user to the swap pool of their price bucket, if there is enough deposit for it and it isn't
+     * in a pool yet. The user's checkpoint is the number of swaps of the pool, so that the next one is the swap of their balanceToSwap.
+     */
+    function _joinSwapPool(userData storage user) internal {
+        if (
+            user.swapCheckpoint != 0 ||
+            user.balanceToSwap == 0 ||
+            !user.enoughDepositForSwap
+        ) {
+            return;
+        }
+        uint256 bucket = getPriceBucket(user.priceLimit);
+        user.swapCheckpoint = SafeCast.toUint32(
+            s_priceBucketSwaps[bucket].length + 1
+        );
+        s_pendingETHPerPriceBucket[bucket] += user.balanceToSwap;
+        _addPendingSwap(bucket);
+    }
+
+    /**
+     * @dev Removes the balanceToSwap of a user from the swap pool of their price bucket, if its swap is pending.
+     * A balanceToSwap that has already been swapped stays in the pool until it is settled.
+     */
+    function _leaveSwapPool(userData storage user) internal {
+        if (user.swapCheckpoint == 0) {
+            return;
+        }
+        uint256 bucket = getPriceBucket(user.priceLimit);
+        if (!_isSwapPending(user, bucket)) {
+            return;
+        }
+        s_pendingETHPerPriceBucket[bucket] -= user.balanceToSwap;
+        _removePendingSwap(bucket);
+        user.swapCheckpoint = 0;
+    }
+
+    function _addPendingSwap(uint256 bucket) internal {
+        s_pendingSwapCount++;
+        s_pendingSwapsPerPriceBucket[bucket]++;
+        if (s_pendingSwapsPerPriceBucket[bucket] == 1) {
+            _setBucketBit(s_pendingPriceBuckets, bucket, true);
+        }
+    }
+
+    function _removePendingSwap(uint256 bucket) internal {
+        s_pendingSwapCount--;
+        s_pendingSwapsPerPriceBucket[bucket]--;
+        if (s_pendingSwapsPerPriceBucket[bucket] == 0) {
+            _setBucketBit(s_pendingPriceBuckets, bucket, false);
+        }
+    }
+
+    function _setBucketBit(
+        uint256[PRICE_BUCKET_WORDS] storage bitmap,
+        uint256 bucket,
+        bool value
+    ) internal {
+        if (value) {
+            bitmap[bucket / 256] |= uint256(1) << (bucket % 256);
+        } else {
+            bitmap[bucket / 256] &= ~(uint256(1) << (bucket % 256));
+        }
+    }
+
+    /// @dev Returns the first bucket from bucket from onwards whose bit is set in bitmap, or PRICE_BUCKET_COUNT if there is none.
+    function _getNextSetBucket(
+        uint256[PRICE_BUCKET_WORDS] storage bitmap,
+        uint256 from
+    ) internal view returns (uint256) {
+        for (uint256 word = from / 256; word < PRICE_BUCKET_WORDS; word++) {
+            uint256 bits = bitmap[word];
+            if (word == from / 256) {
+                // clears the bits of the buckets under from
+                bits = (bits >> (from % 256)) << (from % 256);
+            }
+            if (bits != 0) {
+                // bits & (~bits + 1) only keeps the lowest set bit
+                return word * 256 + _mostSignificantBit(bits & (~bits + 1));
+            }
+        }
+        return PRICE_BUCKET_COUNT;
+    }
+
+    /**
+     * @notice Gets the lowest price limit of the users with a pending swap, or the largest uint256 if there is none.
+     * @dev Only the users of the lowest price bucket with pending swaps are visited.
+     */
+    function getLowestPendingPriceLimit()
+        public
+        view
+        returns (uint256 lowestPriceLimit)
+    {
+        lowestPriceLimit = type(uint256).max;
+        uint256 bucket = _getNextSetBucket(s_pendingPriceBuckets, 0);
+        if (bucket == PRICE_BUCKET_COUNT) {
+            return lowestPriceLimit;
+        }
+        address[] storage bucketUsers = s_priceBuckets[bucket];
+        for (uint256 idx = 0; idx < bucketUsers.length; idx++) {
+            userData storage user = s_users[bucketUsers[idx]];
+            if (
+                _isSwapPending(user, bucket) &&
+                user.priceLimit < lowestPriceLimit
+            ) {
+                lowestPriceLimit = user.priceLimit;
+            }
+        }
+    }
+
+    /**
+     * @notice Returns true if the current price is above the price limit of at least one user with a pending swap.
+     * @dev Only the balances to swap with enough deposit for them are pending, so the next swap pass is sure to swap.
+     */
+    function checkLowestLimitUnderCurrentPrice() public view returns (bool) {
+        return
+            s_pendingSwapCount > 0 && getPrice() > getLowestPendingPriceLimit();
+    }
+
+    /**
+     * @dev Returns true if the address balance of any user changed since the last upkeep, i.e. if setBalancesToSwap has work to do.
+     * Decreases, e.g. a user paying gas, count too: a reward is the increase over previousBalance, so until a decrease is recorded,
+     * the next rewards are hidden under the old, higher previousBalance, up to the amount of the decrease.
+     */
+    function _anyBalanceChanged() internal view returns (bool) {
+        for (uint256 idx = 0; idx < s_watchList.length; idx++) {
+            address userAddress = s_watchList[idx];
+            if (userAddress.balance != s_users[userAddress].previousBalance) {
+                return true;
+            }
+        }
+        return false;
+    }
+
     /**
      * @notice Utility pure function that calculates the balance we should swap for a user
      * @dev makes use of the ABDKMath64x64 library
@@ -227,40 +665,68 @@ contract StakingMonitor is KeeperCompatibleInterface {
      * set in their order. This is a workaround until we get the actual staking reward distribution event.
      */
     function setBalancesToSwap() public {
-        for (uint256 idx = 0; idx < s_watchList.length; idx++) {
-            if (
-                s_watchList[idx].balance >
-                s_users[s_watchList[idx]].previousBalance
-            ) {
-                s_users[s_watchList[idx]]
-                    .balanceToSwap += calculateUserBalanceToSwap(
-                    s_watchList[idx].balance,
-                    s_users[s_watchList[idx]].previousBalance,
-                    s_users[s_watchList[idx]].percentageToSwap
-                );
-                // if a user's balanceToSwap is larger than their depositBalance, we need to emit
-                // an event that warns them that they have to deposit more eth into
-                // the contract for their swap to take place.
-                // otherwise, we set the flag "enoughDepositForSwap" to true
-            }
-            if (
-                s_users[s_watchList[idx]].balanceToSwap >
-                s_users[s_watchList[idx]].depositBalance
-            ) {
-                s_users[s_watchList[idx]].enoughDepositForSwap = false;
-                emit NotEnoughDepositedEthForSwap(
-                    s_watchList[idx],
-                    s_users[s_watchList[idx]].balanceToSwap -
-                        s_users[s_watchList[idx]].depositBalance
-                );
-            } else {
-                s_users[s_watchList[idx]].enoughDepositForSwap = true;
-            }
+        upkeepSummary memory summary;
+        _setBalancesToSwap(0, s_watchList.length, summary);
+    }
+
+    /**
+     * @dev Same as setBalancesToSwap, restricted to the watchlist entries in [start, end).
+     */
+    function _setBalancesToSwap(
+        uint256 start,
+        uint256 end,
+        upkeepSummary memory summary
+    ) internal {
+        for (uint256 idx = start; idx < end; idx++) {
+            _setBalanceToSwap(s_watchList[idx], summary);
+        }
+    }
 
-            // we set previousBalance to the current balance
-            s_users[s_watchList[idx]].previousBalance = s_watchList[idx]
-                .balance;
+    /**
+     * @dev Updates the balanceToSwap, enoughDepositForSwap and previousBalance of a single user, see setBalancesToSwap,
+     * and counts them in summary.
+     */
+    function _setBalanceToSwap(
+        address userAddress,
+        upkeepSummary memory summary
+    ) internal {
+        userData storage user = s_users[userAddress];
+        uint256 currentBalance = userAddress.balance;
+        summary.usersScanned++;
+        if (currentBalance > user.previousBalance) {
+            summary.usersRewarded++;
+            // the new reward can only be added to balanceToSwap once the swapped balance is credited,
+            // and a pending balance leaves its swap pool until it is updated
+            _settleSwap(userAddress);
+            _leaveSwapPool(user);
+            user.balanceToSwap = SafeCast.toUint96(
+                user.balanceToSwap +
+                    calculateUserBalanceToSwap(
+                        currentBalance,
+                        user.previousBalance,
+                        user.percentageToSwap
+                    )
+            );
+            // if a user's balanceToSwap is larger than their depositBalance, we need to emit
+            // an event that warns them that they have to deposit more eth into
+            // the contract for their swap to take place.
+            // otherwise, we set the flag "enoughDepositForSwap" to true
+        }
+        if (user.balanceToSwap > user.depositBalance) {
+            summary.usersWithoutEnoughDeposit++;
+            _leaveSwapPool(user);
+            user.enoughDepositForSwap = false;
+            emit NotEnoughDepositedEthForSwap(
+                userAddress,
+                user.balanceToSwap - user.depositBalance
+            );
+        } else {
+            user.enoughDepositForSwap = true;
         }
+
+        // we set previousBalance to the current balance
+        user.previousBalance = SafeCast.toUint96(currentBalance);
+        _joinSwapPool(user);
     }
 
     /**
@@ -286,90 +752,387 @@ contract StakingMonitor is KeeperCompatibleInterface {
     }
 
     /**
-     * @notice The second function called by the upkeep, which checks which users have required balances,
-     * as well as an order where the conditions for a swap are met.
+     * @notice The second function called by the upkeep, which swaps the balances of the users whose order conditions are met:
+     * enough deposit for their balanceToSwap, and a price limit under the current price.
      *
-     * @dev emits a "Swapped" event for each user, which is used in the dapp frontend to display the history for each user
+     * @dev The pending balances to swap are pooled per price bucket, see _joinSwapPool. The pools of the buckets under the bucket of the price,
+     * whose price limits are all under it, are swapped as a whole: each of them only gets a new DAI-per-ETH index, from which its users are
+     * credited by _settleSwap the next time they interact with the contract or receive a reward. The users of the bucket of the price, whose
+     * price limits still have to be compared with it, are visited, and the ones under the price are credited immediately.
+     * Emits a "SwapBatch" event with the ETH swapped from each bucket, and each participant gets a "SwapSettled" event when they are credited,
+     * which is used in the dapp frontend to display the history for each user. The history of a participant who hasn't been credited yet
+     * can be rebuilt off-chain, see scripts/swap_batches.py.
      */
     function checkConditionsAndPerformSwap() public {
+        upkeepSummary memory summary;
+        _performSwapForPriceBuckets(summary);
+    }
+
+    /**
+     * @dev Same as checkConditionsAndPerformSwap, counting the swap in summary. The cost of a swap grows with the number of price buckets
+     * it swaps and with the number of users in the bucket of the price, not with the number of participants.
+     */
+    function _performSwapForPriceBuckets(upkeepSummary memory summary)
+        internal
+    {
+        // like in checkLowestLimitUnderCurrentPrice, an upkeep without pending swaps doesn't read the price or scan the pending buckets
+        if (s_pendingSwapCount == 0) {
+            return;
+        }
         uint256 currentPrice = getPrice();
+        uint256 priceBucket = getPriceBucket(currentPrice);
+        (
+            uint256 totalAmountToSwap,
+            uint256 priceBucketAmountToSwap,
+            uint256 poolCount
+        ) = _getAmountToSwap(priceBucket, currentPrice, summary);
+        if (totalAmountToSwap == 0) {
+            return;
+        }
 
-        address[] memory addressesForSwap = new address[](s_watchList.length);
-        uint256[] memory totalAmountToSwap_TotalDAIFromSwap = new uint256[](2);
-        uint256[] memory totalDAIFromSwap = new uint256[](1);
+        uint256 DAIPerETH = _startSwapRound(
+            totalAmountToSwap,
+            currentPrice,
+            summary
+        );
+        uint256[] memory priceBuckets = _swapPools(
+            priceBucket,
+            DAIPerETH,
+            poolCount,
+            priceBucketAmountToSwap
+        );
+        emit SwapBatch(
+            s_swapRoundCount,
+            block.timestamp,
+            currentPrice,
+            totalAmountToSwap,
+            summary.DAIReceived,
+            priceBuckets
+        );
+        if (priceBucketAmountToSwap > 0) {
+            _swapPriceBucketUsers(priceBucket, currentPrice, DAIPerETH);
+        }
+    }
 
-        // we build a list of the addresses that will be part of the swap
-        // (the ones where conditions for swap are satisfied). We store that list in the array below.
-        for (uint256 idx = 0; idx < s_watchList.length; idx++) {
-            // check the order conditions for each user in watchlist and trigger a swap if conditions are satisfied
+    /**
+     * @dev Returns the ETH to swap at currentPrice: the total, the part of it from the users of priceBucket, the bucket of the price,
+     * and the number of pools of the buckets under it. The participants are counted in summary.
+     */
+    function _getAmountToSwap(
+        uint256 priceBucket,
+        uint256 currentPrice,
+        upkeepSummary memory summary
+    )
+        internal
+        view
+        returns (
+            uint256 totalAmountToSwap,
+            uint256 priceBucketAmountToSwap,
+            uint256 poolCount
+        )
+    {
+        for (
+            uint256 bucket = _getNextSetBucket(s_pendingPriceBuckets, 0);
+            bucket < priceBucket && bucket < PRICE_BUCKET_COUNT;
+            bucket = _getNextSetBucket(s_pendingPriceBuckets, bucket + 1)
+        ) {
+            totalAmountToSwap += s_pendingETHPerPriceBucket[bucket];
+            summary.swapParticipants += s_pendingSwapsPerPriceBucket[bucket];
+            poolCount++;
+        }
+        if (
+            priceBucket < PRICE_BUCKET_COUNT &&
+            s_pendingSwapsPerPriceBucket[priceBucket] > 0
+        ) {
+            address[] storage bucketUsers = s_priceBuckets[priceBucket];
+            for (uint256 idx = 0; idx < bucketUsers.length; idx++) {
+                userData storage user = s_users[bucketUsers[idx]];
+                if (
+                    _isSwapPending(user, priceBucket) &&
+                    currentPrice > user.priceLimit
+                ) {
+                    priceBucketAmountToSwap += user.balanceToSwap;
+                    summary.swapParticipants++;
+                }
+            }
+        }
+        totalAmountToSwap += priceBucketAmountToSwap;
+    }
+
+    /**
+     * @dev Swaps totalAmountToSwap for DAI, records the swap in a new swap round, and returns the DAI received per ETH swapped,
+     * scaled by DAI_PER_ETH_PRECISION. The price and totals of the swap are counted in summary.
+     */
+    function _startSwapRound(
+        uint256 totalAmountToSwap,
+        uint256 currentPrice,
+        upkeepSummary memory summary
+    ) internal returns (uint256) {
+        uint256 totalDAIFromSwap = swapEthForDAI(totalAmountToSwap);
+        s_swapRoundCount++;
+        s_swapRounds[s_swapRoundCount] = swapRoundData(
+            SafeCast.toUint128(totalAmountToSwap),
+            SafeCast.toUint128(totalDAIFromSwap),
+            SafeCast.toUint128(currentPrice),
+            SafeCast.toUint64(block.timestamp)
+        );
+        summary.ETHPrice = currentPrice;
+        summary.totalETHSwapped += totalAmountToSwap;
+        summary.DAIReceived += totalDAIFromSwap;
+        return (totalDAIFromSwap * DAI_PER_ETH_PRECISION) / totalAmountToSwap;
+    }
+
+    /**
+     * @dev Swaps the pools of the poolCount buckets with pending swaps under priceBucket: each of them gets a new DAI-per-ETH index,
+     * and has no pending swap anymore. Returns the bucket << 128 | ETH swapped of each of them, and of priceBucket if priceBucketAmountToSwap
+     * isn't 0, for the SwapBatch event.
+     */
+    function _swapPools(
+        uint256 priceBucket,
+        uint256 DAIPerETH,
+        uint256 poolCount,
+        uint256 priceBucketAmountToSwap
+    ) internal returns (uint256[] memory priceBuckets) {
+        priceBuckets = new uint256[](
+            priceBucketAmountToSwap > 0 ? poolCount + 1 : poolCount
+        );
+        uint256 idx = 0;
+        // the bit of each bucket is cleared once it is swapped, so the next bucket is searched from the following one
+        for (
+            uint256 bucket = _getNextSetBucket(s_pendingPriceBuckets, 0);
+            bucket < priceBucket && bucket < PRICE_BUCKET_COUNT;
+            bucket = _getNextSetBucket(s_pendingPriceBuckets, bucket + 1)
+        ) {
+            priceBuckets[idx] =
+                (bucket << 128) |
+                s_pendingETHPerPriceBucket[bucket];
+            idx++;
+            priceBucketSwap[] storage swaps = s_priceBucketSwaps[bucket];
+            uint256 cumulativeDAIPerETH = DAIPerETH;
+            if (swaps.length > 0) {
+                cumulativeDAIPerETH += swaps[swaps.length - 1]
+                    .cumulativeDAIPerETH;
+            }
+            swaps.push(
+                priceBucketSwap(
+                    SafeCast.toUint224(cumulativeDAIPerETH),
+                    s_swapRoundCount
+                )
+            );
+            s_pendingSwapCount -= s_pendingSwapsPerPriceBucket[bucket];
+            delete s_pendingSwapsPerPriceBucket[bucket];
+            delete s_pendingETHPerPriceBucket[bucket];
+            _setBucketBit(s_pendingPriceBuckets, bucket, false);
+        }
+        if (priceBucketAmountToSwap > 0) {
+            priceBuckets[idx] = (priceBucket << 128) | priceBucketAmountToSwap;
+        }
+    }
+
+    /**
+     * @dev Credits the users of priceBucket, the bucket of the price, whose swap is pending and whose price limit is under currentPrice,
+     * with the share of the last swap round their balanceToSwap gets at DAIPerETH.
+     */
+    function _swapPriceBucketUsers(
+        uint256 priceBucket,
+        uint256 currentPrice,
+        uint256 DAIPerETH
+    ) internal {
+        address[] storage bucketUsers = s_priceBuckets[priceBucket];
+        for (uint256 idx = 0; idx < bucketUsers.length; idx++) {
+            address userAddress = bucketUsers[idx];
+            userData storage user = s_users[userAddress];
             if (
-                s_users[s_watchList[idx]].enoughDepositForSwap &&
-                s_users[s_watchList[idx]].balanceToSwap > 0 &&
-                currentPrice > s_users[s_watchList[idx]].priceLimit
+                _isSwapPending(user, priceBucket) &&
+                currentPrice > user.priceLimit
             ) {
-                //we count that user in for this swap
-                addressesForSwap[idx] = (payable(s_watchList[idx]));
-                totalAmountToSwap_TotalDAIFromSwap[0] += s_users[
-                    s_watchList[idx]
-                ].balanceToSwap;
-            } else {
-                // if the address can't swap, we set it to the null address in addressesForSwap
-                addressesForSwap[
-                    idx
-                ] = 0x000000000000000000000000000000000000dEaD;
+                _leaveSwapPool(user);
+                _creditSwap(
+                    userAddress,
+                    (user.balanceToSwap * DAIPerETH) / DAI_PER_ETH_PRECISION,
+                    s_swapRoundCount
+                );
             }
         }
+    }
 
-        uint[] memory receivedDAIFromSwapPerUser = new uint[](
-            addressesForSwap.length
+    /**
+     * @dev Returns whether the balanceToSwap of a user has been swapped, and if so the DAI it received and its swap round.
+     * The pool of the user's bucket has been swapped since their checkpoint c, and their balanceToSwap was swapped in the first of these swaps,
+     * at the difference between the DAI-per-ETH indices after the swaps c and c - 1 of the pool.
+     */
+    function _getSwapShare(userData storage user)
+        internal
+        view
+        returns (
+            bool swapped,
+            uint256 share,
+            uint256 swapRound
+        )
+    {
+        if (user.swapCheckpoint == 0) {
+            return (false, 0, 0);
+        }
+        priceBucketSwap[] storage swaps = s_priceBucketSwaps[
+            getPriceBucket(user.priceLimit)
+        ];
+        if (swaps.length < user.swapCheckpoint) {
+            return (false, 0, 0);
+        }
+        priceBucketSwap storage swap = swaps[user.swapCheckpoint - 1];
+        uint256 DAIPerETH = swap.cumulativeDAIPerETH;
+        if (user.swapCheckpoint > 1) {
+            DAIPerETH -= swaps[user.swapCheckpoint - 2].cumulativeDAIPerETH;
+        }
+        return (
+            true,
+            (user.balanceToSwap * DAIPerETH) / DAI_PER_ETH_PRECISION,
+            swap.swapRound
         );
+    }
+
+    /**
+     * @dev Credits a user with the share of a swap their balanceToSwap has been swapped in: the share is added to their DAIBalance,
+     * and their balanceToSwap, which has already been swapped, is removed from their depositBalance.
+     */
+    function _creditSwap(
+        address userAddress,
+        uint256 share,
+        uint256 swapRound
+    ) internal {
+        userData storage user = s_users[userAddress];
+        user.DAIBalance = SafeCast.toUint128(user.DAIBalance + share);
+        // cannot overflow, the balanceToSwap was not larger than depositBalance when it was swapped, and
+        // withdrawETH settles the swap before withdrawing
+        user.depositBalance -= user.balanceToSwap;
+        emit SwapSettled(
+            userAddress,
+            swapRound,
+            user.balanceToSwap,
+            user.priceLimit,
+            share
+        );
+        user.balanceToSwap = 0;
+        user.swapCheckpoint = 0;
+    }
+
+    /// @dev Credits a user with their last swap, if their balanceToSwap has been swapped since they were last credited, see _getSwapShare.
+    function _settleSwap(address userAddress) internal {
+        (bool swapped, uint256 share, uint256 swapRound) = _getSwapShare(
+            s_users[userAddress]
+        );
+        if (swapped) {
+            _creditSwap(userAddress, share, swapRound);
+        }
+    }
 
-        if (totalAmountToSwap_TotalDAIFromSwap[0] > 0) {
-            // we perform the swap
-            totalAmountToSwap_TotalDAIFromSwap[1] = swapEthForDAI(
-                totalAmountToSwap_TotalDAIFromSwap[0]
+    /// @dev Returns the data of a user as if their last swap had been settled, see _settleSwap.
+    function _getSettledUserData(address userAddress)
+        internal
+        view
+        returns (userData memory settledUser)
+    {
+        userData storage user = s_users[userAddress];
+        settledUser = user;
+        (bool swapped, uint256 share, ) = _getSwapShare(user);
+        if (swapped) {
+            settledUser.DAIBalance = SafeCast.toUint128(
+                user.DAIBalance + share
             );
-            // we distribute the DAI balances among participants
-            for (uint256 idx = 0; idx < addressesForSwap.length; idx++) {
-                if (
-                    addressesForSwap[idx] !=
-                    0x000000000000000000000000000000000000dEaD
-                ) {
-                    // the new DAIBalance of each swap participant
-                    // increases by their share of the totalAmountToSwap
-                    receivedDAIFromSwapPerUser[idx] = calculateUserSwapShare(
-                        totalAmountToSwap_TotalDAIFromSwap[1],
-                        s_users[addressesForSwap[idx]].balanceToSwap,
-                        totalAmountToSwap_TotalDAIFromSwap[0]
-                    );
-                    s_users[addressesForSwap[idx]]
-                        .DAIBalance += receivedDAIFromSwapPerUser[idx];
-                    emit Swapped(
-                        addressesForSwap[idx],
-                        block.timestamp,
-                        s_users[addressesForSwap[idx]].balanceToSwap,
-                        s_users[addressesForSwap[idx]].priceLimit,
-                        receivedDAIFromSwapPerUser[idx],
-                        currentPrice
-                    );
-                    // we substract the balanceToSwap from the user's
-                    // depositBalance
-                    s_users[addressesForSwap[idx]].depositBalance -= s_users[
-                        addressesForSwap[idx]
-                    ].balanceToSwap;
-
-                    // we reinitialise the balanceToSwap for the user
-                    s_users[addressesForSwap[idx]].balanceToSwap = 0;
+            settledUser.depositBalance -= user.balanceToSwap;
+            settledUser.balanceToSwap = 0;
+            settledUser.swapCheckpoint = 0;
+        }
+    }
+
+    /**
+     * @dev Returns a bitmap of the watchlist indices that performUpkeep needs to touch: the users whose address balance changed since
+     * the last upkeep. The users with a pending swap don't need to be touched, their swap pools are swapped by price bucket.
+     * Bit (idx % 256) of word (idx / 256) is set for the watchlist entry idx.
+     */
+    function _getUsersToUpdateBitmap()
+        internal
+        view
+        returns (uint256[] memory bitmap, bool anyUserToUpdate)
+    {
+        bitmap = new uint256[]((s_watchList.length + 255) / 256);
+        for (uint256 idx = 0; idx < s_watchList.length; idx++) {
+            address userAddress = s_watchList[idx];
+            if (userAddress.balance != s_users[userAddress].previousBalance) {
+                bitmap[idx / 256] |= uint256(1) << (idx % 256);
+                anyUserToUpdate = true;
+            }
+        }
+    }
+
+    /**
+     * @dev Returns the watchlist addresses whose bits are set in bitmap, see _getUsersToUpdateBitmap.
+     * The bits set for indices outside of the watchlist are skipped: the watchlist can shrink between checkUpkeep and performUpkeep,
+     * when users empty their account, like in the ChangedUsers mode.
+     */
+    function _getUsersFromBitmap(uint256[] memory bitmap)
+        internal
+        view
+        returns (address[] memory users)
+    {
+        uint256 watchListLength = s_watchList.length;
+        uint256 wordCount = (watchListLength + 255) / 256;
+        if (bitmap.length < wordCount) {
+            wordCount = bitmap.length;
+        }
+        uint256 userCount = 0;
+        for (uint256 word = 0; word < wordCount; word++) {
+            // clears the lowest set bit on each iteration
+            for (
+                uint256 bits = _getWatchListBits(bitmap, word, watchListLength);
+                bits != 0;
+                bits &= bits - 1
+            ) {
+                userCount++;
+            }
+        }
+
+        users = new address[](userCount);
+        userCount = 0;
+        for (uint256 word = 0; word < wordCount; word++) {
+            uint256 bits = _getWatchListBits(bitmap, word, watchListLength);
+            for (uint256 bit = 0; bits != 0; bit++) {
+                if ((bits & 1) == 1) {
+                    users[userCount] = s_watchList[word * 256 + bit];
+                    userCount++;
                 }
+                bits >>= 1;
             }
         }
     }
 
+    /// @dev Returns word of bitmap without the bits of the indices that are past the end of a watchlist of watchListLength users.
+    function _getWatchListBits(
+        uint256[] memory bitmap,
+        uint256 word,
+        uint256 watchListLength
+    ) internal pure returns (uint256 bits) {
+        bits = bitmap[word];
+        if (word == watchListLength / 256) {
+            bits &= (uint256(1) << (watchListLength % 256)) - 1;
+        }
+    }
+
     /**
      * @notice This function is used by the upkeep network to check if performUpkeep should be executed.
-     * Pretty simple at the moment, it just triggers at regular intervals. Once we can listen to the staking reward distribution events, we will
-     * be able to implement a more efficient and gas-effective condition that will only trigger when reward distribution events take place for the addresses
-     * in s_watchlist
+     * It triggers at regular intervals, but only if there is work to do: a user's address balance changed since the last upkeep,
+     * or the price is above the price limit of a user with a pending swap (see checkLowestLimitUnderCurrentPrice).
+     * Once we can listen to the staking reward distribution events, we will be able to replace the balance checks with a condition
+     * that will only trigger when reward distribution events take place for the addresses in s_watchlist
+     * @dev With an empty checkData, the whole watchlist is processed in a single performUpkeep. Otherwise, checkData holds an
+     * abi-encoded (UpkeepMode, batchSize) and performData is returned as an abi-encoded (UpkeepMode, payload):
+     * - Paginated: the watchlist is processed in slices of batchSize users, and the payload holds the abi-encoded (start, end) range
+     * of the next slice, starting at s_watchListCursor. While a round is in progress, the upkeep stays needed until the last slice has been processed.
+     * The round's swap is performed with its last slice.
+     * - UsersToUpdate: the payload holds the abi-encoded bitmap of the users that need to be touched (see _getUsersToUpdateBitmap),
+     * and the upkeep is only needed if there is at least one of them or a swap is possible. batchSize is not used.
+     * - ChangedUsers: same as UsersToUpdate, but the payload holds the abi-encoded list of the addresses of these users, sorted in ascending order.
+     * It is smaller than the bitmap when few users need to be touched, and can also be built off-chain by the keeper.
      */
     function checkUpkeep(bytes calldata checkData)
         external
@@ -377,21 +1140,178 @@ contract StakingMonitor is KeeperCompatibleInterface {
         returns (bool upkeepNeeded, bytes memory performData)
     {
         upkeepNeeded = (block.timestamp - lastTimeStamp) > interval;
-        //upkeepNeeded = checkLowestLimitUnderCurrentPrice();
+        bool anySwapPossible = checkLowestLimitUnderCurrentPrice();
+
+        if (checkData.length == 0) {
+            upkeepNeeded =
+                upkeepNeeded &&
+                (anySwapPossible || _anyBalanceChanged());
+            performData = checkData;
+            return (upkeepNeeded, performData);
+        }
 
-        // We don't use the checkData in this example
-        // checkData was defined when the Upkeep was registered
-        performData = checkData;
+        (UpkeepMode mode, uint256 batchSize) = abi.decode(
+            checkData,
+            (UpkeepMode, uint256)
+        );
+        if (mode == UpkeepMode.Paginated) {
+            uint256 start = s_watchListCursor;
+            uint256 end = start + batchSize;
+            if (end > s_watchList.length) {
+                end = s_watchList.length;
+            }
+            upkeepNeeded =
+                (upkeepNeeded && (anySwapPossible || _anyBalanceChanged())) ||
+                start > 0;
+            performData = abi.encode(mode, abi.encode(start, end));
+        } else {
+            (
+                uint256[] memory bitmap,
+                bool anyUserToUpdate
+            ) = _getUsersToUpdateBitmap();
+            upkeepNeeded = upkeepNeeded && (anyUserToUpdate || anySwapPossible);
+            if (mode == UpkeepMode.UsersToUpdate) {
+                performData = abi.encode(mode, abi.encode(bitmap));
+            } else {
+                performData = abi.encode(
+                    mode,
+                    abi.encode(_sortAddresses(_getUsersFromBitmap(bitmap)))
+                );
+            }
+        }
+    }
+
+    /// @dev Sorts addresses in ascending order, in place. Only used off-chain, by checkUpkeep.
+    function _sortAddresses(address[] memory addresses)
+        internal
+        pure
+        returns (address[] memory)
+    {
+        for (uint256 idx = 1; idx < addresses.length; idx++) {
+            address current = addresses[idx];
+            uint256 position = idx;
+            while (position > 0 && addresses[position - 1] > current) {
+                addresses[position] = addresses[position - 1];
+                position--;
+            }
+            addresses[position] = current;
+        }
+        return addresses;
     }
 
     /**
      * @notice On each upkeep, we check if each user in the watchlist has received a staking reward, set the balances that should be swapped,
      * and perform the swap.
+     * @dev performData is either empty (whole watchlist) or built by checkUpkeep for one of the UpkeepModes.
+     * Each upkeep emits an UpkeepPerformed event summarizing what it did.
      */
     function performUpkeep(bytes calldata performData) external override {
+        upkeepSummary memory summary;
+        if (performData.length == 0) {
+            lastTimeStamp = block.timestamp;
+            _setBalancesToSwap(0, s_watchList.length, summary);
+            _performSwapForPriceBuckets(summary);
+        } else {
+            (UpkeepMode mode, bytes memory payload) = abi.decode(
+                performData,
+                (UpkeepMode, bytes)
+            );
+            if (mode == UpkeepMode.Paginated) {
+                _performPaginatedUpkeep(payload, summary);
+            } else if (mode == UpkeepMode.UsersToUpdate) {
+                _performUpkeepForUsers(
+                    _getUsersFromBitmap(abi.decode(payload, (uint256[]))),
+                    summary
+                );
+            } else {
+                _performChangedUsersUpkeep(payload, summary);
+            }
+        }
+        _compactWatchList();
+
+        emit UpkeepPerformed(
+            summary.usersScanned,
+            summary.usersRewarded,
+            summary.usersWithoutEnoughDeposit,
+            summary.swapParticipants,
+            summary.totalETHSwapped,
+            summary.DAIReceived,
+            summary.ETHPrice
+        );
+    }
+
+    /**
+     * @dev Processes the (start, end) slice of the watchlist held in payload. The cursor then moves to end,
+     * or back to 0 once the end of the watchlist is reached. A new round can only start once the interval has elapsed.
+     * A slice must hold at least one user, unless the watchlist is empty: an empty slice would reset lastTimeStamp without processing anyone.
+     * The balances to swap of a round's slices are pooled by price bucket (see _joinSwapPool) and swapped together, once per round,
+     * with the last slice: the swap doesn't depend on the slice, and a single swap costs less than one per slice.
+     */
+    function _performPaginatedUpkeep(
+        bytes memory payload,
+        upkeepSummary memory summary
+    ) internal {
+        (uint256 start, uint256 end) = abi.decode(payload, (uint256, uint256));
+        if (
+            start != s_watchListCursor ||
+            end > s_watchList.length ||
+            (end <= start && s_watchList.length != 0)
+        ) {
+            revert StakingMonitor__InvalidUpkeepRange();
+        }
+        if (start == 0) {
+            if ((block.timestamp - lastTimeStamp) <= interval) {
+                revert StakingMonitor__UpkeepNotNeeded();
+            }
+            lastTimeStamp = block.timestamp;
+        }
+
+        _setBalancesToSwap(start, end, summary);
+        if (end == s_watchList.length) {
+            _performSwapForPriceBuckets(summary);
+        }
+
+        s_watchListCursor = end < s_watchList.length ? end : 0;
+    }
+
+    /**
+     * @dev Only touches the users whose addresses are listed in payload. The list must be sorted in strictly ascending order,
+     * so that no user can be counted twice in the swap. The addresses without a user, e.g. users removed from the watchlist
+     * since checkUpkeep, are skipped, see _performUpkeepForUsers.
+     */
+    function _performChangedUsersUpkeep(
+        bytes memory payload,
+        upkeepSummary memory summary
+    ) internal {
+        address[] memory users = abi.decode(payload, (address[]));
+        for (uint256 idx = 1; idx < users.length; idx++) {
+            if (users[idx] <= users[idx - 1]) {
+                revert StakingMonitor__InvalidUpkeepRange();
+            }
+        }
+        _performUpkeepForUsers(users, summary);
+    }
+
+    /**
+     * @dev Only updates the balances to swap of the given users (see the UsersToUpdate and ChangedUsers modes), then swaps the pools of all the
+     * price buckets under the price. Their conditions are checked again, so a stale list, e.g. a bitmap computed before some users were removed
+     * from the watchlist, can't make a user swap more than with a full upkeep.
+     */
+    function _performUpkeepForUsers(
+        address[] memory users,
+        upkeepSummary memory summary
+    ) internal {
+        if ((block.timestamp - lastTimeStamp) <= interval) {
+            revert StakingMonitor__UpkeepNotNeeded();
+        }
         lastTimeStamp = block.timestamp;
-        setBalancesToSwap();
-        checkConditionsAndPerformSwap();
-        performData;
+
+        for (uint256 idx = 0; idx < users.length; idx++) {
+            // the user may have been removed from the watchlist since the list was built
+            if (s_users[users[idx]].created) {
+                _setBalanceToSwap(users[idx], summary);
+            }
+        }
+        _performSwapForPriceBuckets(summary);
     }
 }
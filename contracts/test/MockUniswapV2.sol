@@ -10,6 +10,7 @@ contract MockUniswapV2 is IUniswapV2 {
         address to,
         uint deadline
     ) external payable override returns (uint[] memory amounts) {
+        amounts = new uint[](path.length);
         amounts[0] = amountOutMin;
         amounts[1] = 2000000000000000000000000000;
         return amounts;
@@ -0,0 +1,145 @@
+from brownie import web3
+from eth_abi import encode_abi
+import requests
+import time
+from web3 import HTTPProvider
+
+from scripts.gas_strategy import get_gas_strategy
+from scripts.snapshot import get_snapshot
+
+# StakingMonitor.UpkeepMode.ChangedUsers
+CHANGED_USERS_MODE = 2
+# the number of eth_getBalance calls sent in a single JSON-RPC batch request
+DEFAULT_BATCH_SIZE = 500
+RPC_TIMEOUT = 30
+
+
+def get_balances(addresses, block_identifier, batch_size=DEFAULT_BATCH_SIZE):
+    """Reads the balances of many addresses at a single block, with batched
+    eth_getBalance JSON-RPC requests instead of one request per address.
+
+        Args:
+            addresses (list): The addresses to read.
+
+            block_identifier (int): The block the balances are read at.
+
+            batch_size (int, optional): The number of calls per batch request.
+
+        Returns:
+            dict: The balance of each address, in wei.
+    """
+    if not isinstance(web3.provider, HTTPProvider):
+        # batches are only sent over HTTP, websocket and IPC providers get one request per address
+        return {
+            address: web3.eth.get_balance(address, block_identifier)
+            for address in addresses
+        }
+
+    block = hex(block_identifier)
+    balances = {}
+    for offset in range(0, len(addresses), batch_size):
+        batch = addresses[offset : offset + batch_size]
+        response = requests.post(
+            web3.provider.endpoint_uri,
+            json=[
+                {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "method": "eth_getBalance",
+                    "params": [address, block],
+                }
+                for request_id, address in enumerate(batch)
+            ],
+            timeout=RPC_TIMEOUT,
+        )
+        response.raise_for_status()
+        for result in response.json():
+            if "error" in result:
+                raise ValueError(result["error"])
+            balances[batch[result["id"]]] = int(result["result"], 16)
+    return balances
+
+
+def get_changed_users(snapshot, balances):
+    """Returns the users that a full upkeep would update: the users whose balance changed since
+    the last upkeep. The pending swaps don't need to be listed, they are swapped by price bucket.
+    Decreases are listed too, like in StakingMonitor._anyBalanceChanged: the next rewards are
+    measured from the previousBalance they record.
+    They are sorted in ascending order, as expected by the ChangedUsers upkeep mode.
+    """
+    changed_users = [
+        address
+        for address, user in snapshot["users"].items()
+        if balances[address] != user["previousBalance"]
+    ]
+    return sorted(changed_users, key=lambda address: int(address, 16))
+
+
+def get_perform_data(changed_users):
+    """Returns the performData of a ChangedUsers upkeep for the given users."""
+    return encode_abi(
+        ["uint8", "bytes"],
+        [CHANGED_USERS_MODE, encode_abi(["address[]"], [changed_users])],
+    )
+
+
+def scan_balances(
+    staking_monitor, block_identifier=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Reads the state of every user and their balances at a single block, and finds the users
+    whose balance changed since the last upkeep.
+
+        Args:
+            staking_monitor (brownie.network.contract.ProjectContract): The StakingMonitor to scan.
+
+            block_identifier (int, optional): The block the scan is pinned to. Defaults to the latest block.
+
+            batch_size (int, optional): The number of eth_getBalance calls per batch request.
+
+        Returns:
+            dict: The scanned block, the sorted list of changed users, whether a pending swap can be
+            performed at the price, and the performData of the ChangedUsers upkeep updating them.
+    """
+    if block_identifier is None:
+        block_identifier = web3.eth.block_number
+    snapshot = get_snapshot(staking_monitor, block_identifier)
+    balances = get_balances(list(snapshot["users"]), block_identifier, batch_size)
+    changed_users = get_changed_users(snapshot, balances)
+    return {
+        "block": block_identifier,
+        "changed_users": changed_users,
+        "swap_possible": staking_monitor.checkLowestLimitUnderCurrentPrice(
+            block_identifier=block_identifier
+        ),
+        "perform_data": get_perform_data(changed_users),
+    }
+
+
+def scan_and_perform_upkeep(staking_monitor, account, batch_size=DEFAULT_BATCH_SIZE):
+    """Scans the balances, and calls performUpkeep with the changed users if there are any
+    or if a swap is possible, and the interval has elapsed.
+
+    Returns:
+        The performUpkeep transaction, or None if no upkeep was needed.
+    """
+    block = web3.eth.get_block("latest")
+    if (
+        block["timestamp"] - staking_monitor.lastTimeStamp()
+        <= staking_monitor.interval()
+    ):
+        return None
+    scan = scan_balances(staking_monitor, block["number"], batch_size)
+    if not scan["changed_users"] and not scan["swap_possible"]:
+        return None
+    print(
+        f"{len(scan['changed_users'])} users changed at block {scan['block']}, performing upkeep"
+    )
+    start_time = time.perf_counter()
+    tx = staking_monitor.performUpkeep(
+        scan["perform_data"], {"from": account, "gas_price": get_gas_strategy()}
+    )
+    tx.wait(1)
+    print(
+        f"Upkeep performed in {time.perf_counter() - start_time:.3f}s, {tx.gas_used} gas"
+    )
+    return tx
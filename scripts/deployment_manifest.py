@@ -0,0 +1,89 @@
+from brownie import network, web3
+from eth_utils import keccak
+import json
+import os
+
+DEFAULT_MANIFEST_DIRECTORY = "deployments"
+
+
+def get_abi_hash(abi):
+    """Returns a hash of a contract ABI, which doesn't depend on the order of its entries and keys."""
+    canonical_abi = sorted(json.dumps(entry, sort_keys=True) for entry in abi)
+    return keccak(text=json.dumps(canonical_abi)).hex()
+
+
+def get_code_hash(address):
+    """Returns the hash of the code deployed at an address, or None if there is none."""
+    code = web3.eth.get_code(address)
+    return keccak(bytes(code)).hex() if code else None
+
+
+class DeploymentManifest:
+    """The contracts deployed on a network, persisted to <directory>/<network>.json, so that the
+    scripts can find them again in a later run instead of deploying them again.
+
+    Each entry, keyed by the name get_contract uses, records the contract type, its address, the hash of
+    the ABI it was deployed with, and on local chains the hash of its code, to detect a restarted chain.
+
+        Args:
+            network_name (string, optional): The network. Defaults to the active one.
+
+            directory (string, optional): The directory of the manifest files.
+    """
+
+    def __init__(self, network_name=None, directory=DEFAULT_MANIFEST_DIRECTORY):
+        self.network_name = network_name or network.show_active()
+        self.path = os.path.join(directory, f"{self.network_name}.json")
+        self.contracts = {}
+        if os.path.exists(self.path):
+            with open(self.path) as manifest_file:
+                self.contracts = json.load(manifest_file)["contracts"]
+
+    def get(self, name):
+        return self.contracts.get(name)
+
+    def get_address(self, name, contract_type, check_code=False):
+        """Returns the recorded address of a contract, or None if there is none or if it is stale: recorded with
+        another ABI than the one contract_type has now, or, with check_code, without the recorded code at the address.
+        """
+        entry = self.get(name)
+        if entry is None or entry["abi_hash"] != get_abi_hash(contract_type.abi):
+            return None
+        if check_code and get_code_hash(entry["address"]) != entry.get("code_hash"):
+            return None
+        return entry["address"]
+
+    def record(self, name, contract_type, address, code_hash=None):
+        """Records the address of a contract and saves the manifest."""
+        self.contracts[name] = {
+            "contract_type": contract_type._name,
+            "address": address,
+            "abi_hash": get_abi_hash(contract_type.abi),
+        }
+        if code_hash:
+            self.contracts[name]["code_hash"] = code_hash
+        self.save()
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # written to a temporary file first, so that an interrupted script can't leave a truncated manifest
+        with open(f"{self.path}.tmp", "w") as manifest_file:
+            json.dump(
+                {"network": self.network_name, "contracts": self.contracts},
+                manifest_file,
+                indent=2,
+                sort_keys=True,
+            )
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+_manifests = {}
+
+
+def get_manifest(network_name=None):
+    """Returns the manifest of a network, only read from its file the first time it is needed in the process."""
+    network_name = network_name or network.show_active()
+    if network_name not in _manifests:
+        _manifests[network_name] = DeploymentManifest(network_name)
+    return _manifests[network_name]
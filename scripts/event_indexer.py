@@ -0,0 +1,236 @@
+from brownie import web3
+from eth_utils import event_abi_to_log_topic
+from web3._utils.events import get_event_data
+import json
+import os
+import sqlite3
+import time
+
+from scripts.swap_batches import get_swapped_records_from_logs
+
+# every one of these events has the user it concerns as its first argument. SwapSettled, which
+# is emitted when a participant of a swap is credited, is stored as a Swapped row
+INDEXED_EVENTS = [
+    "Deposited",
+    "OrderSet",
+    "SwapSettled",
+    "WithdrawnETH",
+    "WithdrawnDAI",
+    "RemovedFromWatchList",
+    "NotEnoughDepositedEthForSwap",
+]
+
+DEFAULT_DATABASE_PATH = "reports/events.db"
+# eth_getLogs block ranges are halved when a node rejects a range, and doubled when it
+# returns less than TARGET_LOGS_PER_RANGE logs, within these bounds
+INITIAL_BLOCK_RANGE = 2000
+MIN_BLOCK_RANGE = 1
+MAX_BLOCK_RANGE = 100000
+TARGET_LOGS_PER_RANGE = 5000
+# blocks are only indexed once they have this many confirmations, so that reorgs don't leave stale events
+DEFAULT_CONFIRMATIONS = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    contract TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    event TEXT NOT NULL,
+    user TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (contract, block_number, log_index, user)
+);
+CREATE INDEX IF NOT EXISTS events_by_user ON events (contract, user, event, block_number);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    contract TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL
+);
+"""
+
+
+class EventIndexer:
+    """Indexes the StakingMonitor events in a local SQLite database.
+
+    The history is backfilled with adaptively sized eth_getLogs ranges, then new blocks are tailed.
+    The last indexed block is checkpointed in the same database transaction as the events of each range,
+    so an interrupted indexer resumes where it stopped without missing or duplicating events.
+
+        Args:
+            brownie_contract (brownie.network.contract.ProjectContract): The StakingMonitor to index.
+
+            database_path (string, optional): The SQLite database file.
+
+            start_block (int, optional): The first block to index, when there is no checkpoint yet.
+            Defaults to the deployment block if brownie knows it, 0 otherwise.
+
+            confirmations (int, optional): The number of confirmations a block needs to be indexed.
+    """
+
+    def __init__(
+        self,
+        brownie_contract,
+        database_path=DEFAULT_DATABASE_PATH,
+        start_block=None,
+        confirmations=DEFAULT_CONFIRMATIONS,
+    ):
+        self.address = brownie_contract.address
+        self.confirmations = confirmations
+        self.block_range = INITIAL_BLOCK_RANGE
+        if start_block is None:
+            deployment_tx = getattr(brownie_contract, "tx", None)
+            start_block = deployment_tx.block_number if deployment_tx else 0
+        self.start_block = start_block
+
+        event_abis = [
+            abi
+            for abi in brownie_contract.abi
+            if abi["type"] == "event" and abi["name"] in INDEXED_EVENTS
+        ]
+        self._event_abis_by_topic = {
+            event_abi_to_log_topic(abi): abi for abi in event_abis
+        }
+
+        if os.path.dirname(database_path):
+            os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(SCHEMA)
+
+    def get_checkpoint(self):
+        """Returns the last indexed block, or None if nothing has been indexed yet."""
+        row = self.connection.execute(
+            "SELECT block_number FROM checkpoints WHERE contract = ?", (self.address,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _get_logs(self, from_block, to_block):
+        return web3.eth.get_logs(
+            {
+                "address": self.address,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [list(self._event_abis_by_topic)],
+            }
+        )
+
+    def _decode_logs(self, logs):
+        rows = []
+        for log in logs:
+            if (
+                self._event_abis_by_topic[bytes(log["topics"][0])]["name"]
+                == "SwapSettled"
+            ):
+                rows += [
+                    (
+                        self.address,
+                        record["blockNumber"],
+                        record["logIndex"],
+                        record["transactionHash"],
+                        "Swapped",
+                        record["_address"],
+                        json.dumps(
+                            {
+                                key: value
+                                for key, value in record.items()
+                                if key.startswith("_")
+                            }
+                        ),
+                    )
+                    for record in get_swapped_records_from_logs([log])
+                ]
+                continue
+            event = get_event_data(
+                web3.codec, self._event_abis_by_topic[bytes(log["topics"][0])], log
+            )
+            args = dict(event["args"])
+            rows.append(
+                (
+                    self.address,
+                    event["blockNumber"],
+                    event["logIndex"],
+                    event["transactionHash"].hex(),
+                    event["event"],
+                    next(iter(args.values())),
+                    json.dumps(args),
+                )
+            )
+        return rows
+
+    def _store(self, rows, to_block):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?)",
+                (self.address, to_block),
+            )
+
+    def index_until(self, last_block):
+        """Indexes every block from the checkpoint up to last_block, and returns the number of events stored."""
+        checkpoint = self.get_checkpoint()
+        from_block = self.start_block if checkpoint is None else checkpoint + 1
+        stored = 0
+        while from_block <= last_block:
+            to_block = min(from_block + self.block_range - 1, last_block)
+            try:
+                logs = self._get_logs(from_block, to_block)
+            except ValueError:
+                # most nodes reject ranges with too many results, we retry with a smaller one
+                if self.block_range == MIN_BLOCK_RANGE:
+                    raise
+                self.block_range = max(self.block_range // 2, MIN_BLOCK_RANGE)
+                continue
+            rows = self._decode_logs(logs)
+            self._store(rows, to_block)
+            stored += len(rows)
+            if len(logs) < TARGET_LOGS_PER_RANGE:
+                self.block_range = min(self.block_range * 2, MAX_BLOCK_RANGE)
+            from_block = to_block + 1
+        return stored
+
+    def backfill(self):
+        """Indexes every confirmed block up to the current one."""
+        return self.index_until(web3.eth.block_number - self.confirmations)
+
+    def tail(self, poll_interval=2, timeout=None):
+        """Backfills, then keeps indexing new blocks as they are mined.
+
+        Args:
+            poll_interval (int, optional): How often to check for new blocks, in seconds.
+
+            timeout (int, optional): Stops after that many seconds. Runs forever by default.
+        """
+        start_time = time.time()
+        while timeout is None or time.time() - start_time < timeout:
+            stored = self.backfill()
+            if stored:
+                print(f"Indexed {stored} events up to block {self.get_checkpoint()}")
+            time.sleep(poll_interval)
+
+    def get_user_history(self, user, event=None):
+        """Returns the indexed events of a user, oldest first, as dicts.
+
+        Args:
+            user (string): The address of the user.
+
+            event (string, optional): Only returns the events with that name.
+        """
+        query = "SELECT block_number, log_index, transaction_hash, event, args FROM events WHERE contract = ? AND user = ?"
+        parameters = [self.address, str(user)]
+        if event:
+            query += " AND event = ?"
+            parameters.append(event)
+        query += " ORDER BY block_number, log_index"
+        return [
+            {
+                "block_number": block_number,
+                "log_index": log_index,
+                "transaction_hash": transaction_hash,
+                "event": event_name,
+                "args": json.loads(args),
+            }
+            for block_number, log_index, transaction_hash, event_name, args in self.connection.execute(
+                query, parameters
+            )
+        ]
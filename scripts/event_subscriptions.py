@@ -0,0 +1,184 @@
+from brownie import web3
+from eth_utils import event_abi_to_log_topic
+from web3._utils.events import get_event_data
+import asyncio
+
+DEFAULT_POLL_INTERVAL = 2
+DEFAULT_QUEUE_SIZE = 100
+# on RPC errors, the poll loop waits twice as long as the previous time, up to MAX_BACKOFF seconds
+MAX_BACKOFF = 60
+
+
+class Subscription:
+    """The events of one or more event types of one contract, delivered to an async queue.
+
+    Use it as an async iterator, or read subscription.queue directly. When the queue is full,
+    the shared poll loop waits for it to be drained, so a slow subscriber slows the polling down
+    instead of growing its queue without bound.
+    """
+
+    def __init__(self, manager, address, event_names, max_queue_size):
+        self.manager = manager
+        self.address = address
+        self.event_names = event_names
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the delivery of new events. The events already queued can still be read."""
+        self.cancelled = True
+        self.manager.unsubscribe(self)
+        if not self.queue.full():
+            # wakes up a reader waiting on an empty queue
+            self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.cancelled and self.queue.empty():
+            raise StopAsyncIteration
+        event = await self.queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class EventSubscriptionManager:
+    """Polls the events of many contracts with a single eth_getLogs call per poll, and dispatches
+    the decoded events to the subscriptions that match their contract and event name.
+
+        Args:
+            poll_interval (int, optional): How often to poll for new blocks, in seconds.
+
+            from_block (int, optional): The first block to poll. Defaults to the block after
+            the current one when the manager starts, like a filter created at "latest".
+    """
+
+    def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL, from_block=None):
+        self.poll_interval = poll_interval
+        self.next_block = from_block
+        self._subscriptions = []
+        # {(address, topic): event abi}
+        self._event_abis = {}
+        self._task = None
+
+    def subscribe(
+        self, brownie_contract, event_names=None, max_queue_size=DEFAULT_QUEUE_SIZE
+    ):
+        """Subscribes to some events of a contract.
+
+        Args:
+            brownie_contract (brownie.network.contract.ProjectContract): The contract emitting the events.
+
+            event_names (list, optional): The names of the events. Defaults to all the events of the contract.
+
+            max_queue_size (int, optional): The size of the subscription's queue.
+
+        Returns:
+            Subscription: The subscription the events are delivered to.
+        """
+        event_abis = [abi for abi in brownie_contract.abi if abi["type"] == "event"]
+        if event_names is None:
+            event_names = [abi["name"] for abi in event_abis]
+        for abi in event_abis:
+            if abi["name"] in event_names:
+                self._event_abis[
+                    (brownie_contract.address, event_abi_to_log_topic(abi))
+                ] = abi
+        subscription = Subscription(
+            self, brownie_contract.address, set(event_names), max_queue_size
+        )
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    async def _call(self, function, *args):
+        # web3 is blocking, we don't want it to block the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def poll(self):
+        """Fetches the events of every subscribed contract since the last poll, and dispatches them."""
+        latest_block = await self._call(lambda: web3.eth.block_number)
+        if self.next_block is None:
+            self.next_block = latest_block + 1
+        if latest_block < self.next_block or not self._subscriptions:
+            return
+        addresses = list({subscription.address for subscription in self._subscriptions})
+        logs = await self._call(
+            web3.eth.get_logs,
+            {
+                "address": addresses,
+                "fromBlock": self.next_block,
+                "toBlock": latest_block,
+            },
+        )
+        self.next_block = latest_block + 1
+        for log in logs:
+            abi = self._event_abis.get((log["address"], bytes(log["topics"][0])))
+            if abi is None:
+                continue
+            event = get_event_data(web3.codec, abi, log)
+            for subscription in list(self._subscriptions):
+                if (
+                    subscription.address == log["address"]
+                    and event["event"] in subscription.event_names
+                ):
+                    await subscription.queue.put(event)
+
+    async def run(self):
+        """Polls until cancelled, backing off exponentially while the node returns errors."""
+        backoff = self.poll_interval
+        while True:
+            try:
+                await self.poll()
+                backoff = self.poll_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                print(f"Polling failed, retrying in {backoff} seconds: {error}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Starts the poll loop in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        """Stops the poll loop, and ends every subscription once its queue is drained."""
+        for subscription in list(self._subscriptions):
+            subscription.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def wait_for_event(
+    brownie_contract, event, timeout=200, poll_interval=DEFAULT_POLL_INTERVAL
+):
+    """Waits for the next event with the given name emitted by a contract.
+
+    Returns:
+        The decoded event, or None if the timeout is reached.
+    """
+    # like a filter created at "latest", so that the events emitted before the first poll aren't missed
+    manager = EventSubscriptionManager(poll_interval, web3.eth.block_number + 1)
+    subscription = manager.subscribe(brownie_contract, [event])
+    manager.start()
+    try:
+        return await asyncio.wait_for(subscription.queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        await manager.stop()
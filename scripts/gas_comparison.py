@@ -0,0 +1,67 @@
+import json
+
+
+def load_gas_report(path):
+    """Loads a report written by the gas benchmark suite, {user_count: {entry_point: gas_used}}."""
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def compare_gas_reports(before, after, user_counts=None, entry_points=None):
+    """Compares two gas benchmark reports, e.g. the reports of the versions of the contract
+    before and after a change.
+
+        Args:
+            before (dict): The report of the first version.
+
+            after (dict): The report of the second version.
+
+            user_counts (list, optional): Only compares these user counts. Defaults to the ones
+            of both reports.
+
+            entry_points (list, optional): Only compares these entry points. Defaults to the ones
+            of both reports.
+
+        Returns:
+            list: One (user_count, entry_point, gas before, gas after, difference in percent) row
+            per entry point measured in both reports, sorted by user count.
+    """
+    if user_counts is None:
+        user_counts = sorted(set(before) & set(after), key=int)
+    rows = []
+    for user_count in map(str, user_counts):
+        gas_before = before.get(user_count, {})
+        gas_after = after.get(user_count, {})
+        for entry_point in entry_points or sorted(set(gas_before) & set(gas_after)):
+            if entry_point not in gas_before or entry_point not in gas_after:
+                continue
+            change = 0.0
+            if gas_before[entry_point]:
+                change = (
+                    (gas_after[entry_point] - gas_before[entry_point])
+                    * 100
+                    / gas_before[entry_point]
+                )
+            rows.append(
+                (
+                    int(user_count),
+                    entry_point,
+                    gas_before[entry_point],
+                    gas_after[entry_point],
+                    change,
+                )
+            )
+    return rows
+
+
+def format_gas_comparison(rows):
+    """Formats the rows of compare_gas_reports as a markdown table, for a commit message or the README."""
+    lines = [
+        "| users | entry point | before | after | change |",
+        "| ---: | --- | ---: | ---: | ---: |",
+    ]
+    lines += [
+        f"| {user_count} | {entry_point} | {gas_before} | {gas_after} | {change:+.1f}% |"
+        for user_count, entry_point, gas_before, gas_after, change in rows
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,221 @@
+from brownie import web3
+from brownie.network.state import _find_contract
+from bisect import bisect_right
+from collections import Counter
+from eth_utils import to_checksum_address
+import os
+
+CALL_OPCODES = ["CALL", "CALLCODE", "DELEGATECALL", "STATICCALL"]
+# the struct logs are only needed with their stack, to find the targets of the calls
+TRACE_OPTIONS = {"disableMemory": True, "disableStorage": True}
+DEFAULT_TOP = 20
+DEFAULT_REPORT_DIRECTORY = "reports/gas_profiles"
+
+
+def get_struct_logs(txid, trace_options=TRACE_OPTIONS):
+    """Returns the struct logs of a transaction, from debug_traceTransaction.
+    Only local chains (ganache, hardhat, or a node with the debug API enabled) support it.
+    """
+    response = web3.provider.make_request(
+        "debug_traceTransaction", [txid, trace_options]
+    )
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["result"]["structLogs"]
+
+
+def get_memory_gas(txid):
+    """Returns the memory expansion gas of the outermost call of a transaction, which grows
+    quadratically with the largest memory size it reached: 3 * words + words ** 2 / 512.
+    """
+    struct_logs = get_struct_logs(
+        txid, {"disableMemory": False, "disableStorage": True, "disableStack": True}
+    )
+    if not struct_logs:
+        return 0
+    depth = struct_logs[0]["depth"]
+    words = max(
+        len(step.get("memory") or []) for step in struct_logs if step["depth"] == depth
+    )
+    return 3 * words + words**2 // 512
+
+
+def _get_call_target(step):
+    # the target address is the second item of the stack for every call opcode
+    address = int(step["stack"][-2], 16)
+    return to_checksum_address(f"{address:040x}"[-40:])
+
+
+class _SourceLines:
+    """Converts the source offsets of a pcMap into line numbers, reading each source file once."""
+
+    def __init__(self):
+        self._line_offsets = {}
+
+    def get_line(self, path, offset):
+        if path not in self._line_offsets:
+            line_offsets = None
+            if path and os.path.exists(path):
+                with open(path, "rb") as source_file:
+                    source = source_file.read()
+                line_offsets = [0] + [
+                    idx + 1 for idx, byte in enumerate(source) if byte == ord("\n")
+                ]
+            self._line_offsets[path] = line_offsets
+        line_offsets = self._line_offsets[path]
+        if line_offsets is None:
+            return None
+        return bisect_right(line_offsets, offset)
+
+
+class _Frame:
+    """The execution of the code of one contract, at one call depth."""
+
+    def __init__(self, address, contract_resolver):
+        contract = contract_resolver(address) if address else None
+        build = getattr(contract, "_build", None) or {}
+        self.name = contract._name if contract else address or "<create>"
+        self.pc_map = build.get("pcMap") or {}
+        self.source_paths = build.get("allSourcePaths") or {}
+        # the internal functions being executed, the first one is the external entry point
+        self.functions = [self.name]
+        self.pending_jump = None
+        self.gas_used = 0
+
+    def enter(self, pc):
+        """Updates the function stack for the step at pc, and returns its pcMap entry."""
+        info = self.pc_map.get(pc, {})
+        function = info.get("fn")
+        if self.pending_jump == "i":
+            self.functions.append(function or self.functions[-1])
+        elif self.pending_jump == "o" and len(self.functions) > 1:
+            self.functions.pop()
+        elif function and function != self.functions[-1]:
+            # the dispatcher jumps to the external functions without a jump marker
+            self.functions[-1] = function
+        self.pending_jump = info.get("jump") if info.get("op") == "JUMP" else None
+        return info
+
+
+class GasProfile:
+    """The gas used by a transaction, attributed to the opcodes, source lines and
+    function stacks that used it.
+
+    Every step of the trace is charged the gas it used itself. The gas forwarded to a call is
+    charged to the steps of the callee, so that the call opcode only keeps its own cost.
+
+        Args:
+            struct_logs (list): The struct logs returned by debug_traceTransaction.
+
+            address (string): The address of the contract the transaction was sent to.
+
+            contract_resolver (callable, optional): Returns the brownie contract deployed at an
+            address, or None if it is not known. Defaults to brownie's deployment registry.
+    """
+
+    def __init__(self, struct_logs, address, contract_resolver=_find_contract):
+        self.by_stack = Counter()
+        self.by_function = Counter()
+        self.by_line = Counter()
+        self.by_opcode = Counter()
+        self.total_gas = 0
+        self._contract_resolver = contract_resolver
+        self._source_lines = _SourceLines()
+        self._attribute(struct_logs, address)
+
+    def _charge(self, frames, step, info, gas):
+        frame = frames[-1]
+        stack = [function for caller in frames for function in caller.functions]
+        self.by_stack[";".join(stack + [step["op"]])] += gas
+        self.by_function[stack[-1]] += gas
+        self.by_opcode[step["op"]] += gas
+        if "offset" in info and "path" in info:
+            path = frame.source_paths.get(info["path"], info["path"])
+            line = self._source_lines.get_line(path, info["offset"][0])
+            if line is not None:
+                self.by_line[f"{path}:{line}"] += gas
+        frame.gas_used += gas
+        self.total_gas += gas
+
+    def _attribute(self, struct_logs, address):
+        frames = [_Frame(address, self._contract_resolver)]
+        # (step, pcMap entry, frames, gas before the call) of the calls being executed
+        calls = []
+        for idx, step in enumerate(struct_logs):
+            next_step = struct_logs[idx + 1] if idx + 1 < len(struct_logs) else None
+            info = frames[-1].enter(step["pc"])
+            if next_step is not None and next_step["depth"] > step["depth"]:
+                # the cost of the call is only known once the callee returns,
+                # the callee of a CREATE has no address yet
+                calls.append((step, info, list(frames), step["gas"]))
+                target = _get_call_target(step) if step["op"] in CALL_OPCODES else None
+                frames.append(_Frame(target, self._contract_resolver))
+                continue
+            if next_step is not None and next_step["depth"] == step["depth"]:
+                gas = step["gas"] - next_step["gas"]
+            else:
+                gas = step["gasCost"]
+            self._charge(frames, step, info, gas)
+
+            if next_step is not None and next_step["depth"] < step["depth"]:
+                callee = frames.pop()
+                call_step, call_info, call_frames, gas_before_call = calls.pop()
+                call_gas = gas_before_call - next_step["gas"] - callee.gas_used
+                self._charge(call_frames, call_step, call_info, call_gas)
+                frames[-1].gas_used += callee.gas_used
+
+    def get_top(self, counter, count=DEFAULT_TOP):
+        """Returns the count entries of a counter that used the most gas, with their share of the total."""
+        return [
+            (key, gas, gas / self.total_gas if self.total_gas else 0)
+            for key, gas in counter.most_common(count)
+        ]
+
+    def format_table(self, count=DEFAULT_TOP):
+        """Returns the top functions, source lines and opcodes, as text tables."""
+        sections = []
+        for title, counter in [
+            ("Function", self.by_function),
+            ("Source line", self.by_line),
+            ("Opcode", self.by_opcode),
+        ]:
+            rows = self.get_top(counter, count)
+            width = max([len(title)] + [len(key) for key, _, _ in rows])
+            lines = [f"{title:<{width}}  {'Gas':>10}  {'Share':>6}"]
+            lines += [
+                f"{key:<{width}}  {gas:>10}  {share:>6.1%}" for key, gas, share in rows
+            ]
+            sections.append("\n".join(lines))
+        return f"Execution gas: {self.total_gas}\n\n" + "\n\n".join(sections) + "\n"
+
+    def write_collapsed_stacks(self, path):
+        """Writes the function stacks in the collapsed format of flamegraph.pl, inferno or speedscope."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as collapsed_file:
+            for stack, gas in sorted(self.by_stack.items()):
+                collapsed_file.write(f"{stack} {gas}\n")
+
+
+def profile_transaction(tx, output_directory=DEFAULT_REPORT_DIRECTORY, top=DEFAULT_TOP):
+    """Profiles the gas used by a transaction, and writes its collapsed stacks and its top-N table
+    to output_directory, as <txid>.folded and <txid>.txt.
+
+        Args:
+            tx (brownie.network.transaction.TransactionReceipt): The transaction to profile.
+
+            output_directory (string, optional): Where the reports are written, None to not write them.
+
+            top (int, optional): The number of rows of each table.
+
+        Returns:
+            GasProfile: The profile of the transaction.
+    """
+    profile = GasProfile(get_struct_logs(tx.txid), tx.receiver)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+        base_path = os.path.join(output_directory, tx.txid)
+        profile.write_collapsed_stacks(f"{base_path}.folded")
+        with open(f"{base_path}.txt", "w") as table_file:
+            table_file.write(profile.format_table(top))
+    return profile
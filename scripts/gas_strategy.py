@@ -0,0 +1,124 @@
+from brownie import web3
+from brownie.network.gas.bases import SimpleGasStrategy
+from collections import deque
+import statistics
+import threading
+
+# the priority fee paid is the median, over the window, of this percentile of the priority fees of each block
+DEFAULT_PERCENTILE = 60
+DEFAULT_WINDOW = 20
+# the base fee can rise by 12.5% per block, the max fee leaves room for that many full blocks
+MAX_FEE_BLOCKS = 6
+BASE_FEE_MAX_CHANGE = 1.125
+
+
+def get_fee_history(block_count, newest_block, percentiles):
+    return web3.eth.fee_history(block_count, newest_block, percentiles)
+
+
+class FeeHistoryGasStrategy(SimpleGasStrategy):
+    """A gas strategy based on the priority fees paid in the last blocks, read with eth_feeHistory.
+
+    The priority fees of the last window non-empty blocks are kept in memory, and each call only reads the blocks
+    mined since the previous one, so sending many transactions doesn't send as many eth_feeHistory requests.
+    Empty blocks are skipped, as their priority fees are all 0. On nodes without eth_feeHistory, the
+    strategy falls back to eth_gasPrice.
+
+    Use it like any brownie gas strategy, e.g. {"from": account, "gas_price": strategy}, or get_max_fee and
+    get_priority_fee for EIP-1559 transactions.
+
+        Args:
+            percentile (int, optional): The percentile of the priority fees of each block that is paid.
+
+            window (int, optional): The number of blocks the priority fee is computed from.
+
+            fee_history (callable, optional): Returns the eth_feeHistory of block_count blocks up to newest_block,
+            at the given percentiles. Defaults to the node's, and can be replaced with synthetic fee histories.
+
+            max_gas_price (int, optional): The gas price, max fee and priority fee are never set above this value, in wei.
+    """
+
+    def __init__(
+        self,
+        percentile=DEFAULT_PERCENTILE,
+        window=DEFAULT_WINDOW,
+        fee_history=get_fee_history,
+        max_gas_price=None,
+    ):
+        self.percentile = percentile
+        self.window = window
+        self.fee_history = fee_history
+        self.max_gas_price = max_gas_price
+        self.last_block = None
+        self.next_base_fee = None
+        self.request_count = 0
+        # the priority fee of the last non-empty blocks, at the percentile
+        self._priority_fees = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Reads the fee history of the blocks mined since the last update, at most window blocks.
+        Returns False if the node doesn't support eth_feeHistory.
+        """
+        with self._lock:
+            newest_block = web3.eth.block_number
+            if self.last_block is not None and newest_block <= self.last_block:
+                return True
+            block_count = (
+                self.window
+                if self.last_block is None
+                else min(newest_block - self.last_block, self.window)
+            )
+            try:
+                history = self.fee_history(block_count, newest_block, [self.percentile])
+            except ValueError:
+                return False
+            self.request_count += 1
+            for gas_used_ratio, rewards in zip(
+                history["gasUsedRatio"], history["reward"]
+            ):
+                if gas_used_ratio > 0:
+                    self._priority_fees.append(int(rewards[0]))
+            # the last base fee of the history is the one of the next block
+            self.next_base_fee = int(history["baseFeePerGas"][-1])
+            self.last_block = newest_block
+            return True
+
+    def _cap(self, fee):
+        if self.max_gas_price is None:
+            return fee
+        return min(fee, self.max_gas_price)
+
+    def get_priority_fee(self):
+        self.update()
+        if not self._priority_fees:
+            return 0
+        return self._cap(int(statistics.median(self._priority_fees)))
+
+    def get_max_fee(self):
+        """Returns a max fee per gas that stays above the base fee for MAX_FEE_BLOCKS full blocks,
+        unless max_gas_price is lower."""
+        if not self.update():
+            return self._cap(web3.eth.gas_price)
+        return self._cap(
+            int(self.next_base_fee * BASE_FEE_MAX_CHANGE**MAX_FEE_BLOCKS)
+            + self.get_priority_fee()
+        )
+
+    def get_gas_price(self):
+        """Returns the legacy gas price: the base fee of the next block plus the priority fee."""
+        if self.update():
+            return self._cap(self.next_base_fee + self.get_priority_fee())
+        return self._cap(web3.eth.gas_price)
+
+
+_gas_strategy = None
+
+
+def get_gas_strategy():
+    """Returns the FeeHistoryGasStrategy shared by the scripts of the process, so that
+    they all use the same window of fees."""
+    global _gas_strategy
+    if _gas_strategy is None:
+        _gas_strategy = FeeHistoryGasStrategy()
+    return _gas_strategy
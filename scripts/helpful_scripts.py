@@ -8,10 +8,17 @@ from brownie import (
     MockOracle,
     VRFCoordinatorMock,
     MockUniswapV2,
+    StakingMonitor,
     Contract,
     web3,
 )
-import time
+from eth_utils import keccak, to_bytes, to_checksum_address
+import asyncio
+import rlp
+
+from scripts.deployment_manifest import get_code_hash, get_manifest
+from scripts.event_subscriptions import wait_for_event
+from scripts.signer_session import get_signer_session
 
 NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS = ["hardhat", "development", "ganache"]
 LOCAL_BLOCKCHAIN_ENVIRONMENTS = NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS + [
@@ -31,6 +38,11 @@ contract_to_mock = {
     "oracle": MockOracle,
 }
 
+# the contracts deployed by the scripts, keyed by the name they are recorded under in the deployment manifest
+contract_to_deploy = {
+    "staking_monitor": StakingMonitor,
+}
+
 DECIMALS = 8
 INITIAL_VALUE = web3.toWei(2000, "ether")
 
@@ -40,9 +52,72 @@ def get_account(index=None, id=None):
         return accounts[index]
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         return accounts[0]
+    # keystores are only decrypted, and keys only loaded, once per process
+    session = get_signer_session()
     if id:
-        return accounts.load(id)
-    return accounts.add(config["wallets"]["from_key"])
+        return session.get(("keystore", id), lambda: accounts.load(id))
+    return session.get(
+        ("from_key",), lambda: accounts.add(config["wallets"]["from_key"])
+    )
+
+
+def create_funded_accounts(count, amount, funder=None):
+    """Create new local accounts and fund each of them with some network currency.
+    This is mostly useful on a local chain, to get more users than the 10 unlocked accounts.
+
+        Args:
+            count (int): The number of accounts to create.
+
+            amount (int): The amount in wei sent to each account.
+
+            funder (brownie.network.account.Account, optional): The account the funds
+            are sent from. Defaults to get_account().
+
+        Returns:
+            list: The created brownie.network.account.LocalAccount objects.
+    """
+    funder = funder if funder else get_account()
+    new_accounts = []
+    for _ in range(count):
+        account = accounts.add()
+        funder.transfer(account, amount)
+        new_accounts.append(account)
+    return new_accounts
+
+
+# contract handles built by get_contract and get_deployed, keyed by (network, contract name)
+_contract_handles = {}
+# addresses of the handles whose code has been found on the local chain, keyed by network
+_addresses_with_code = {}
+
+
+def forget_contract_handles():
+    """Forgets the handles memoized by get_contract and get_deployed, e.g. after new mocks have been deployed,
+    or after reverting a local chain to before the deployment of a contract."""
+    _contract_handles.clear()
+    _addresses_with_code.clear()
+
+
+def _has_code(address):
+    # only local chains can lose a contract, e.g. when they are restarted, and the code is only checked once per address
+    if network.show_active() not in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        return True
+    addresses_with_code = _addresses_with_code.setdefault(network.show_active(), set())
+    if address not in addresses_with_code:
+        if not web3.eth.get_code(address):
+            return False
+        addresses_with_code.add(address)
+    return True
+
+
+def _get_contract_handle(contract_name, resolve):
+    key = (network.show_active(), contract_name)
+    contract = _contract_handles.get(key)
+    if contract is None or not _has_code(contract.address):
+        contract = resolve(contract_name)
+        if contract is not None:
+            _contract_handles[key] = contract
+    return contract
 
 
 def get_contract(contract_name):
@@ -50,9 +125,13 @@ def get_contract(contract_name):
     the contract that you want to be able to 'get'. Then add an entry in the variable 'contract_to_mock'.
     You'll see examples like the 'link_token'.
         This script will then either:
-            - Get a address from the config
+            - Get a address from the config, or from the deployment manifest of the network
             - Or deploy a mock to use for a network that doesn't have it
 
+    The contract is only resolved on the first call for a network, later calls return the same handle.
+    On local chains, the code of the handle is checked once per address, and the handle is resolved again
+    if there is none. deploy_mocks forgets the handles, see forget_contract_handles.
+
         Args:
             contract_name (string): This is the name that is referred to in the
             brownie config and 'contract_to_mock' variable.
@@ -62,25 +141,78 @@ def get_contract(contract_name):
             Contract of the type specificed by the dictionary. This could be either
             a mock or the 'real' contract on a live network.
     """
+    return _get_contract_handle(contract_name, _resolve_contract)
+
+
+def get_deployed(contract_name):
+    """Returns a contract deployed by the scripts, e.g. the StakingMonitor deployed by
+    scripts/staking_monitor/01_deploy_staking_monitor.py, like get_contract does for the mocks.
+
+    The contract is the last one deployed in this process, or else the one recorded in the deployment
+    manifest of the network, so that the scripts run after the deployment script find it.
+
+        Args:
+            contract_name (string): The name the contract is recorded under, see 'contract_to_deploy'.
+
+        Returns:
+            brownie.network.contract.ProjectContract: The deployed contract, or None if there is none.
+    """
+    contract_type = contract_to_deploy[contract_name]
+    if len(contract_type) > 0:
+        return contract_type[-1]
+    return _get_contract_handle(contract_name, _resolve_deployed)
+
+
+def _resolve_deployed(contract_name):
+    contract_type = contract_to_deploy[contract_name]
+    local = network.show_active() in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS
+    address = get_manifest().get_address(contract_name, contract_type, check_code=local)
+    if address is None:
+        print(
+            f"No {contract_type._name} deployed on {network.show_active()}, perhaps you should deploy it first?"
+        )
+        return None
+    return contract_type.at(address)
+
+
+def _resolve_contract(contract_name):
     contract_type = contract_to_mock[contract_name]
+    manifest = get_manifest()
     if network.show_active() in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS:
-        if len(contract_type) <= 0:
-            deploy_mocks()
-        contract = contract_type[-1]
-    else:
-        try:
-            contract_address = config["networks"][network.show_active()][contract_name]
-            contract = Contract.from_abi(
-                contract_type._name, contract_address, contract_type.abi
-            )
-        except KeyError:
-            print(
-                f"{network.show_active()} address not found, perhaps you should add it to the config or deploy mocks?"
-            )
-            print(
-                f"brownie run scripts/deploy_mocks.py --network {network.show_active()}"
-            )
-    return contract
+        if len(contract_type) > 0:
+            return contract_type[-1]
+        # mocks deployed by a previous run, on a chain that is still running
+        address = manifest.get_address(contract_name, contract_type, check_code=True)
+        if address:
+            return contract_type.at(address)
+        deploy_mocks(pipelined=True)
+        return contract_type[-1]
+
+    contract_address = config["networks"].get(network.show_active(), {}).get(
+        contract_name
+    ) or manifest.get_address(contract_name, contract_type)
+    if contract_address is None:
+        print(
+            f"{network.show_active()} address not found, perhaps you should add it to the config or deploy mocks?"
+        )
+        print(f"brownie run scripts/deploy_mocks.py --network {network.show_active()}")
+        return None
+    return Contract.from_abi(contract_type._name, contract_address, contract_type.abi)
+
+
+def record_deployment(contract_name, contract_type, address):
+    """Records a deployed contract in the deployment manifest of the network, see scripts.deployment_manifest."""
+    local = network.show_active() in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS
+    get_manifest().record(
+        contract_name, contract_type, address, get_code_hash(address) if local else None
+    )
+
+
+def record_mocks():
+    """Records the last deployed mock of each type in the deployment manifest of the network."""
+    for contract_name, contract_type in contract_to_mock.items():
+        if len(contract_type) > 0:
+            record_deployment(contract_name, contract_type, contract_type[-1].address)
 
 
 def fund_with_link(
@@ -97,13 +229,66 @@ def fund_with_link(
     return tx
 
 
-def deploy_mocks(decimals=DECIMALS, initial_value=INITIAL_VALUE):
+def get_create_address(sender, nonce):
+    """Returns the address of the contract deployed by sender with the given nonce."""
+    return to_checksum_address(
+        keccak(rlp.encode([to_bytes(hexstr=sender), nonce]))[12:]
+    )
+
+
+def deploy_mocks_pipelined(account, decimals=DECIMALS, initial_value=INITIAL_VALUE):
+    """Deploys the same mocks as deploy_mocks, without waiting for each deployment to be mined
+    before submitting the next one.
+    The nonces are assigned up front, so the address of the LinkToken is known before it is mined,
+    and the deployments that depend on it are mined after it, as they have higher nonces.
+    """
+    nonce = account.nonce
+    link_token_address = get_create_address(account.address, nonce)
+    deployments = [
+        (LinkToken, []),
+        (DAIToken, []),
+        (MockUniswapV2, []),
+        (MockV3Aggregator, [decimals, initial_value]),
+        (VRFCoordinatorMock, [link_token_address]),
+        (MockOracle, [link_token_address]),
+    ]
+    receipts = []
+    for offset, (contract_type, args) in enumerate(deployments):
+        print(f"Submitting {contract_type._name} deployment...")
+        receipts.append(
+            contract_type.deploy(
+                *args,
+                {"from": account, "nonce": nonce + offset, "required_confs": 0},
+            )
+        )
+    for (contract_type, _), receipt in zip(deployments, receipts):
+        receipt.wait(1)
+        if receipt.status != 1:
+            raise Exception(f"{contract_type._name} deployment failed")
+        # brownie adds the contract to its container in a background thread, once it is mined
+        if receipt.contract_address not in [
+            contract.address for contract in contract_type
+        ]:
+            contract_type.at(receipt.contract_address)
+        print(f"Deployed {contract_type._name} to {receipt.contract_address}")
+
+
+def deploy_mocks(decimals=DECIMALS, initial_value=INITIAL_VALUE, pipelined=False):
     """
     Use this script if you want to deploy mocks to a testnet
+    With pipelined=True, the deployments are all submitted before waiting for any of them,
+    see deploy_mocks_pipelined.
     """
     print(f"The active network is {network.show_active()}")
     print("Deploying Mocks...")
+    # get_contract resolves the new mocks instead of the handles it memoized
+    forget_contract_handles()
     account = get_account()
+    if pipelined:
+        deploy_mocks_pipelined(account, decimals, initial_value)
+        record_mocks()
+        print("Mocks Deployed!")
+        return
 
     print("Deploying Mock Link Token...")
     link_token = LinkToken.deploy({"from": account})
@@ -132,12 +317,14 @@ def deploy_mocks(decimals=DECIMALS, initial_value=INITIAL_VALUE):
     print("Deploying Mock Oracle...")
     mock_oracle = MockOracle.deploy(link_token.address, {"from": account})
     print(f"Deployed to {mock_oracle.address}")
+    record_mocks()
     print("Mocks Deployed!")
 
 
 def listen_for_event(brownie_contract, event, timeout=200, poll_interval=2):
     """Listen for an event to be fired from a contract.
     We are waiting for the event to return, so this function is blocking.
+    To watch many events or contracts at once, use scripts.event_subscriptions instead.
 
     Args:
         brownie_contract ([brownie.network.contract.ProjectContract]):
@@ -151,18 +338,11 @@ def listen_for_event(brownie_contract, event, timeout=200, poll_interval=2):
         poll_interval ([int]): How often to call your node to check for events.
         Defaults to 2 seconds.
     """
-    web3_contract = web3.eth.contract(
-        address=brownie_contract.address, abi=brownie_contract.abi
+    event_response = asyncio.run(
+        wait_for_event(brownie_contract, event, timeout, poll_interval)
     )
-    start_time = time.time()
-    current_time = time.time()
-    event_filter = web3_contract.events[event].createFilter(fromBlock="latest")
-    while current_time - start_time < timeout:
-        for event_response in event_filter.get_new_entries():
-            if event in event_response.event:
-                print("Found event!")
-                return event_response
-        time.sleep(poll_interval)
-        current_time = time.time()
-    print("Timeout reached, no event found.")
-    return {"event": None}
+    if event_response is None:
+        print("Timeout reached, no event found.")
+        return {"event": None}
+    print("Found event!")
+    return event_response
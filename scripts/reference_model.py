@@ -0,0 +1,346 @@
+import numpy as np
+
+from scripts.snapshot import USER_DATA_FIELDS
+
+# the largest signed 64.64 fixed point number of ABDKMath64x64
+MAX_64X64 = 2**127 - 1
+UINT96_MAX = 2**96 - 1
+UINT128_MAX = 2**128 - 1
+INT64_MAX = int(np.iinfo(np.int64).max)
+# the contract adds 8 decimals to the price limits entered by the users, to match getPrice
+PRICE_LIMIT_FACTOR = 10**8
+# the amount of DAI returned by every swap of MockUniswapV2
+MOCK_DAI_FROM_SWAP = 2000000000000000000000000000
+# StakingMonitor.DAI_PER_ETH_PRECISION
+DAI_PER_ETH_PRECISION = 10**18
+INITIAL_CAPACITY = 1024
+
+
+class ModelRevert(Exception):
+    """Raised by the model where the contract would revert."""
+
+
+def divu(x, y):
+    """ABDKMath64x64.divu: x / y as a 64.64 fixed point number, rounded down."""
+    if y == 0:
+        raise ModelRevert("divu: division by zero")
+    # divuu is exact for every x whose result fits in 128 bits, so the exact floor is used for every x
+    result = (x << 64) // y
+    if result > MAX_64X64:
+        raise ModelRevert("divu: overflow")
+    return result
+
+
+def to_uint(x):
+    """ABDKMath64x64.toUInt: the integer part of a 64.64 fixed point number."""
+    if x < 0:
+        raise ModelRevert("toUInt: negative value")
+    return x >> 64
+
+
+def calculate_user_balance_to_swap(current_balance, previous_balance, percentage):
+    """StakingMonitor.calculateUserBalanceToSwap, with the ABDKMath64x64 truncation."""
+    if current_balance < previous_balance:
+        raise ModelRevert("arithmetic underflow")
+    return to_uint(divu((current_balance - previous_balance) * percentage, 100))
+
+
+def calculate_user_swap_share(total_token, user_balance_to_swap, total_amount):
+    """StakingMonitor.calculateUserSwapShare."""
+    if total_amount == 0:
+        raise ModelRevert("division by zero")
+    return (total_token * user_balance_to_swap) // total_amount
+
+
+def calculate_users_balance_to_swap(current_balances, previous_balances, percentages):
+    """Vectorized calculateUserBalanceToSwap, for balances that increased.
+
+    divu rounds (x << 64) / 100 down and toUInt drops the 64 fractional bits, which
+    is the same as x // 100, so the truncation doesn't need any fixed point arithmetic.
+    The contract reverts when the 64.64 result overflows, i.e. when x >= 100 * 2**63.
+    """
+    differences = current_balances - previous_balances
+    if differences.dtype == object:
+        amounts = differences * percentages
+        if len(amounts) and amounts.max() >= 100 * 2**63:
+            raise ModelRevert("divu: overflow")
+        return amounts // 100
+
+    # d * p // 100 == (d // 100) * p + (d % 100) * p // 100, which doesn't overflow int64 like d * p
+    quotients, remainders = np.divmod(differences, 100)
+    large = quotients > (INT64_MAX - 255) // np.maximum(percentages, 1)
+    if large.any():
+        # the results are under 2**63 unless the contract reverts, so only their computation needs Python ints
+        exact = calculate_users_balance_to_swap(
+            differences[large].astype(object), 0, percentages[large]
+        )
+        quotients[large] = 0
+    amounts = quotients * percentages + remainders * percentages // 100
+    if large.any():
+        amounts[large] = exact.astype(np.int64)
+    return amounts
+
+
+def _exact_sum(values):
+    """Sums non-negative integers without the int64 overflow of ndarray.sum."""
+    if values.dtype == object:
+        return int(values.sum())
+    # the sums of the high and low 32 bits can't overflow for less than 2**31 values
+    return (int((values >> 32).sum()) << 32) + int((values & 0xFFFFFFFF).sum())
+
+
+def _check_max(values, maximum, message):
+    # the maximum can be larger than any int64, so it is compared as a Python int
+    if len(values) and int(values.max()) > maximum:
+        raise ModelRevert(message)
+
+
+class StakingMonitorModel:
+    """Reference model of the StakingMonitor state machine, for capacity planning and what-if analysis
+    without sending transactions.
+
+    The state of each user is kept in NumPy arrays indexed by watchlist position, so that setBalancesToSwap
+    and checkConditionsAndPerformSwap are vectorized over the whole watchlist. DAI balances are always
+    Python ints, as the DAI amounts of a swap don't fit in 64 bits. The model holds the settled state
+    returned by getUsersData: a swap is credited immediately, as the contract's lazy settlement doesn't
+    change the results, and the swapCheckpoint of the users isn't modelled. The watchlist compaction done
+    by performUpkeep isn't modelled either.
+
+        Args:
+            dtype (optional): The dtype of the wei amounts. np.int64 is fast, but raises an OverflowError
+            when an amount doesn't fit in it (about 9.2 ETH). object uses exact Python ints, and is slower.
+    """
+
+    def __init__(self, dtype=np.int64):
+        self.dtype = dtype
+        self.addresses = []
+        self._indices = {}
+        self._arrays = {}
+        self._allocate(INITIAL_CAPACITY)
+
+    def _allocate(self, capacity):
+        dtypes = {
+            "created": bool,
+            "enough_deposit_for_swap": bool,
+            "deposit_balance": self.dtype,
+            "dai_balance": object,
+            # priceLimit without the 8 decimals added by the contract, so that it fits in int64
+            "order_price_limit": self.dtype,
+            "percentage_to_swap": np.int64,
+            "balance_to_swap": self.dtype,
+            "previous_balance": self.dtype,
+        }
+        for name, dtype in dtypes.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if name in self._arrays:
+                array[: len(self)] = self._arrays[name][: len(self)]
+            self._arrays[name] = array
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get("_arrays", {})
+        if name in arrays:
+            return arrays[name][: len(self.addresses)]
+        raise AttributeError(name)
+
+    def _amounts(self, values):
+        """Converts wei amounts to the dtype of the model."""
+        if isinstance(values, np.ndarray) and values.dtype == self.dtype:
+            return values
+        values = np.array([int(value) for value in values], dtype=object)
+        if self.dtype == object:
+            return values
+        if len(values) and values.max() > INT64_MAX:
+            raise OverflowError(
+                "amounts too large for int64, use a model with dtype=object"
+            )
+        return values.astype(self.dtype)
+
+    def _add_users(self, addresses):
+        if len(self) + len(addresses) > len(self._arrays["created"]):
+            capacity = len(self._arrays["created"])
+            while capacity < len(self) + len(addresses):
+                capacity *= 2
+            self._allocate(capacity)
+        for address in addresses:
+            self._indices[address] = len(self.addresses)
+            self.addresses.append(address)
+
+    def deposit(self, address, value, balance):
+        """deposit(), sent by address with value wei.
+
+        Args:
+            address (string): The user.
+
+            value (int): The amount deposited, in wei.
+
+            balance (int): The balance of the user's address after the deposit.
+        """
+        self.deposit_many([address], [value], [balance])
+
+    def deposit_many(self, addresses, values, balances):
+        """Vectorized deposit, for many distinct users, see deposit."""
+        values = self._amounts(values)
+        balances = self._amounts(balances)
+        if len(set(addresses)) != len(addresses):
+            raise ValueError("deposit_many only takes distinct addresses")
+        self._add_users([address for address in addresses if address not in self])
+        indices = np.array([self._indices[address] for address in addresses], int)
+        deposit_balances = self._amounts(
+            self.deposit_balance[indices].astype(object) + values.astype(object)
+        )
+        _check_max(deposit_balances, UINT96_MAX, "SafeCast: depositBalance")
+        _check_max(balances, UINT96_MAX, "SafeCast: previousBalance")
+        self.created[indices] = True
+        self.deposit_balance[indices] = deposit_balances
+        self.previous_balance[indices] = balances
+        self.enough_deposit_for_swap[indices] = (
+            self.balance_to_swap[indices] <= deposit_balances
+        )
+
+    def __contains__(self, address):
+        return address in self._indices
+
+    def set_order(self, address, price_limit, percentage_to_swap):
+        """setOrder(), sent by address. price_limit is given without the 8 decimals, like in the contract."""
+        index = self._indices.get(address)
+        if index is None or self.deposit_balance[index] == 0:
+            raise ModelRevert("StakingMonitor__UserHasntDepositedETH")
+        if percentage_to_swap > 255:
+            raise ModelRevert("SafeCast: percentageToSwap")
+        if price_limit * PRICE_LIMIT_FACTOR > UINT128_MAX:
+            raise ModelRevert("SafeCast: priceLimit")
+        if self.dtype != object and price_limit > INT64_MAX:
+            raise OverflowError("price limit too large for int64")
+        self.percentage_to_swap[index] = percentage_to_swap
+        self.order_price_limit[index] = price_limit
+
+    def set_orders(self, price_limits, percentages_to_swap):
+        """Vectorized setOrder, for every user of the watchlist at once."""
+        price_limits = self._amounts(price_limits)
+        percentages_to_swap = np.asarray(percentages_to_swap, dtype=np.int64)
+        if (self.deposit_balance == 0).any():
+            raise ModelRevert("StakingMonitor__UserHasntDepositedETH")
+        _check_max(percentages_to_swap, 255, "SafeCast: percentageToSwap")
+        _check_max(
+            price_limits, UINT128_MAX // PRICE_LIMIT_FACTOR, "SafeCast: priceLimit"
+        )
+        self.order_price_limit[:] = price_limits
+        self.percentage_to_swap[:] = percentages_to_swap
+
+    def set_balances_to_swap(self, balances):
+        """setBalancesToSwap().
+
+        Args:
+            balances (list): The balance of each user's address, in watchlist order.
+
+        Returns:
+            numpy.ndarray: The watchlist indices of the users for whom a NotEnoughDepositedEthForSwap event is emitted.
+        """
+        balances = self._amounts(balances)
+        _check_max(balances, UINT96_MAX, "SafeCast: previousBalance")
+        increased = np.flatnonzero(balances > self.previous_balance)
+        added = calculate_users_balance_to_swap(
+            balances[increased],
+            self.previous_balance[increased],
+            self.percentage_to_swap[increased],
+        )
+        if (
+            self.dtype != object
+            and (self.balance_to_swap[increased] > INT64_MAX - added).any()
+        ):
+            raise OverflowError(
+                "balances to swap too large for int64, use a model with dtype=object"
+            )
+        balances_to_swap = self.balance_to_swap[increased] + added
+        _check_max(balances_to_swap, UINT96_MAX, "SafeCast: balanceToSwap")
+        self.balance_to_swap[increased] = balances_to_swap
+        self.enough_deposit_for_swap[:] = self.balance_to_swap <= self.deposit_balance
+        self.previous_balance[:] = balances
+        return np.flatnonzero(~self.enough_deposit_for_swap)
+
+    def _is_under_price(self, price):
+        # price > priceLimit * 10**8 is the same as the entered price limit being under ceil(price / 10**8)
+        threshold = -(-price // PRICE_LIMIT_FACTOR)
+        if self.dtype != object and threshold > INT64_MAX:
+            return np.ones(len(self), dtype=bool)
+        return self.order_price_limit < threshold
+
+    def check_conditions_and_perform_swap(self, price, swap_eth_for_dai=None):
+        """checkConditionsAndPerformSwap().
+
+        Args:
+            price (int): The price returned by getPrice.
+
+            swap_eth_for_dai (function, optional): Returns the DAI received for a swap of the given amount of wei.
+            Defaults to the amount returned by MockUniswapV2.
+
+        Returns:
+            dict: The watchlist indices of the participants, the DAI each of them received (the _DAIReceived of
+            their SwapSettled event), and the totals of the swap.
+        """
+        participants = np.flatnonzero(
+            self.enough_deposit_for_swap
+            & (self.balance_to_swap > 0)
+            & self._is_under_price(price)
+        )
+        balances_to_swap = self.balance_to_swap[participants]
+        total_amount_to_swap = _exact_sum(balances_to_swap)
+        swap = {
+            "participants": participants,
+            "dai_received": np.zeros(len(participants), dtype=object),
+            "total_amount_to_swap": total_amount_to_swap,
+            "total_dai_from_swap": 0,
+        }
+        if total_amount_to_swap == 0:
+            return swap
+
+        if swap_eth_for_dai is None:
+            total_dai_from_swap = MOCK_DAI_FROM_SWAP
+        else:
+            total_dai_from_swap = swap_eth_for_dai(total_amount_to_swap)
+        if max(total_amount_to_swap, total_dai_from_swap) > UINT128_MAX:
+            raise ModelRevert("SafeCast: swap round totals")
+        # the shares are computed from the DAI received per ETH swapped, like the swap pools of the contract,
+        # with Python ints as the products don't fit in 64 bits. This is the slowest step of an upkeep, about
+        # half a second for 1M participants
+        dai_per_eth = (
+            total_dai_from_swap * DAI_PER_ETH_PRECISION // total_amount_to_swap
+        )
+        dai_received = (
+            balances_to_swap.astype(object) * dai_per_eth
+        ) // DAI_PER_ETH_PRECISION
+        dai_balances = self.dai_balance[participants] + dai_received
+        _check_max(dai_balances, UINT128_MAX, "SafeCast: DAIBalance")
+        self.dai_balance[participants] = dai_balances
+        self.deposit_balance[participants] -= balances_to_swap
+        self.balance_to_swap[participants] = 0
+        swap.update(
+            {"dai_received": dai_received, "total_dai_from_swap": total_dai_from_swap}
+        )
+        return swap
+
+    def perform_upkeep(self, balances, price, swap_eth_for_dai=None):
+        """performUpkeep() with an empty performData: setBalancesToSwap, then checkConditionsAndPerformSwap."""
+        self.set_balances_to_swap(balances)
+        return self.check_conditions_and_perform_swap(price, swap_eth_for_dai)
+
+    def get_users(self):
+        """Returns the data of each user keyed by address, like scripts.snapshot.get_snapshot, without their swapCheckpoint."""
+        columns = [
+            self.created.astype(object),
+            self.enough_deposit_for_swap.astype(object),
+            self.deposit_balance.astype(object),
+            self.dai_balance,
+            self.order_price_limit.astype(object) * PRICE_LIMIT_FACTOR,
+            self.percentage_to_swap.astype(object),
+            self.balance_to_swap.astype(object),
+            self.previous_balance.astype(object),
+        ]
+        fields = [field for field in USER_DATA_FIELDS if field != "swapCheckpoint"]
+        return {
+            address: {field: column[index] for field, column in zip(fields, columns)}
+            for index, address in enumerate(self.addresses)
+        }
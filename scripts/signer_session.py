@@ -0,0 +1,82 @@
+from brownie import accounts, config
+import threading
+import time
+
+
+class SignerSession:
+    """Keeps the unlocked signers of the process in memory, so that a keystore is only
+    decrypted, or a private key only loaded, once instead of on every get_account call.
+
+    A signer that hasn't been used for idle_timeout seconds is locked again: it is dropped from
+    the session and from brownie's accounts, and unlocked again the next time it is needed.
+
+        Args:
+            idle_timeout (float, optional): Seconds after which an unused signer is locked.
+            Signers stay unlocked for the life of the process by default.
+    """
+
+    def __init__(self, idle_timeout=None):
+        self.idle_timeout = idle_timeout
+        self.unlock_count = 0
+        # key: (signer, time it was last used)
+        self._signers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, unlock):
+        """Returns the signer cached under key, or unlocks it with unlock() and caches it.
+
+        Args:
+            key (tuple): Identifies the signer, e.g. ("keystore", id).
+
+            unlock (callable): Returns the unlocked brownie account.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._lock_idle_signers(now)
+            if key in self._signers:
+                signer, _ = self._signers[key]
+            else:
+                signer = unlock()
+                self.unlock_count += 1
+            self._signers[key] = (signer, now)
+            return signer
+
+    def _lock_idle_signers(self, now):
+        if self.idle_timeout is None:
+            return
+        for key, (signer, last_used) in list(self._signers.items()):
+            if now - last_used > self.idle_timeout:
+                self._forget(key, signer)
+
+    def _forget(self, key, signer):
+        del self._signers[key]
+        # brownie keeps the accounts it unlocked, with their private key
+        if signer.address in accounts:
+            accounts.remove(signer)
+
+    def lock(self):
+        """Locks every signer of the session."""
+        with self._lock:
+            for key, (signer, _) in list(self._signers.items()):
+                self._forget(key, signer)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_signer_session(idle_timeout=None):
+    """Returns the session shared by the whole process and all the helpers,
+    created on the first call.
+
+        Args:
+            idle_timeout (float, optional): The idle timeout of the session, when it is created
+            by this call. Defaults to the wallets.idle_timeout setting of the brownie config.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            if idle_timeout is None:
+                idle_timeout = config["wallets"].get("idle_timeout")
+            _session = SignerSession(idle_timeout)
+        return _session
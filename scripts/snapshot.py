@@ -0,0 +1,52 @@
+from brownie import web3
+
+# field names of the userData struct, in the order they are returned by the contract
+USER_DATA_FIELDS = [
+    "created",
+    "enoughDepositForSwap",
+    "depositBalance",
+    "DAIBalance",
+    "priceLimit",
+    "percentageToSwap",
+    "balanceToSwap",
+    "previousBalance",
+    "swapCheckpoint",
+]
+
+DEFAULT_PAGE_SIZE = 500
+
+
+def get_snapshot(staking_monitor, block_identifier=None, page_size=DEFAULT_PAGE_SIZE):
+    """Reads the state of every user of a StakingMonitor at a single block, using
+    getUsersData pages instead of one s_watchList and one s_users call per user.
+
+        Args:
+            staking_monitor (brownie.network.contract.ProjectContract): The StakingMonitor to read.
+
+            block_identifier (int, optional): The block the state is read at.
+            Defaults to the latest block when the snapshot starts, so that every page
+            is read at the same block.
+
+            page_size (int, optional): The number of users read per call.
+
+        Returns:
+            dict: The block number, the price, and the data of each user keyed by
+            address, in watchlist order.
+    """
+    if block_identifier is None:
+        block_identifier = web3.eth.block_number
+    watch_list_length = staking_monitor.getWatchListLength(
+        block_identifier=block_identifier
+    )
+    users = {}
+    for offset in range(0, watch_list_length, page_size):
+        addresses, users_data = staking_monitor.getUsersData(
+            offset, page_size, block_identifier=block_identifier
+        )
+        for address, user_data in zip(addresses, users_data):
+            users[address] = dict(zip(USER_DATA_FIELDS, user_data))
+    return {
+        "block": block_identifier,
+        "price": staking_monitor.getPrice(block_identifier=block_identifier),
+        "users": users,
+    }
@@ -1,25 +1,27 @@
 #!/usr/bin/python3
-from scripts.helpful_scripts import get_account, get_contract
+from scripts.helpful_scripts import get_account, get_contract, record_deployment
 from brownie import StakingMonitor, config, network
-from brownie.network.gas.strategies import GasNowStrategy
+from scripts.gas_strategy import get_gas_strategy
 
 
 def deploy_staking_monitor():
-    gas_strategy = GasNowStrategy("fast")
+    gas_strategy = get_gas_strategy()
     account = get_account()
     eth_usd_price_feed_address = get_contract("eth_usd_price_feed").address
     dai_token = get_contract("dai_token").address
     uniswap_v2 = get_contract("uniswap_v2").address
     # 5 minutes interval
     interval = 15 * 60
-    return StakingMonitor.deploy(
+    staking_monitor = StakingMonitor.deploy(
         eth_usd_price_feed_address,
         dai_token,
         uniswap_v2,
         interval,
-        {"from": account},
+        {"from": account, "gas_price": gas_strategy},
         publish_source=config["networks"][network.show_active()].get("verify", False),
     )
+    record_deployment("staking_monitor", StakingMonitor, staking_monitor.address)
+    return staking_monitor
 
 
 def main():
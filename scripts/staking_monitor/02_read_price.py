@@ -1,8 +1,8 @@
 #!/usr/bin/python3
-from brownie import StakingMonitor
+from scripts.helpful_scripts import get_deployed
 
 
 def main():
-    staking_monitor = StakingMonitor[-1]
+    staking_monitor = get_deployed("staking_monitor")
     print(f"Reading data from {staking_monitor.address}")
     print(staking_monitor.getPrice())
@@ -1,19 +1,19 @@
-from brownie import StakingMonitor, Wei
-from scripts.helpful_scripts import get_account
+from brownie import Wei
+from scripts.helpful_scripts import get_account, get_deployed
 
 
 def deposit():
-    staking_monitor = StakingMonitor[-1]
+    staking_monitor = get_deployed("staking_monitor")
     account = get_account()
     deposit_value = Wei("0.01 ether")
     staking_monitor.deposit({"from": account, "value": deposit_value})
 
 
 def read_user_info():
-    staking_monitor = StakingMonitor[-1]
+    staking_monitor = get_deployed("staking_monitor")
     account = get_account()
-    userInfos = staking_monitor.s_userInfos({"from": account})
-    print(userInfos)
+    user_data = staking_monitor.getUserData({"from": account})
+    print(user_data)
 
 
 def main():
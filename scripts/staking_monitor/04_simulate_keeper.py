@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""Simulates a Chainlink keeper driving a StakingMonitor deployment with a synthetic user population.
+
+Only runs on a local development chain, as it moves the chain time forward and updates the mock price feed:
+    brownie run scripts/staking_monitor/04_simulate_keeper.py
+    brownie run scripts/staking_monitor/04_simulate_keeper.py main 2000 20 users_to_update
+    brownie run scripts/staking_monitor/04_simulate_keeper.py main 2000 20 full 100 "0.05,2" 1.0 0.1 "10,50" 0.5 0.002 0.05
+The population distributions follow the mode and batch size, in the order of the arguments of main: ranges are comma separated.
+"""
+
+from brownie import chain, network, Wei
+from eth_abi import encode_abi
+import importlib
+import json
+import os
+import random
+import time
+
+from scripts.helpful_scripts import (
+    NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    create_funded_accounts,
+    deploy_mocks,
+    get_account,
+    get_contract,
+)
+from scripts.gas_strategy import get_gas_strategy
+from scripts.tx_pipeline import TransactionPipeline
+
+# the deployment script name starts with a digit, so it can't be imported with an import statement
+deploy_staking_monitor = importlib.import_module(
+    "scripts.staking_monitor.01_deploy_staking_monitor"
+).deploy_staking_monitor
+
+# keeper modes and their StakingMonitor.UpkeepMode value, see StakingMonitor.checkUpkeep
+# the full mode uses an empty checkData
+UPKEEP_MODES = {
+    "full": None,
+    "paginated": 0,
+    "users_to_update": 1,
+    "changed_users": 2,
+}
+
+DEFAULT_USER_COUNT = 1000
+DEFAULT_UPKEEP_COUNT = 10
+DEFAULT_BATCH_SIZE = 100
+
+# default distributions of the synthetic population, amounts in ether
+DEPOSIT_RANGE = (0.01, 1)
+# price limits are drawn around the starting price, as a ratio of it
+PRICE_LIMIT_MEAN = 1.0
+PRICE_LIMIT_STDDEV = 0.05
+PERCENTAGE_TO_SWAP_RANGE = (1, 100)
+# probability that a user receives a staking reward during an interval, and mean reward
+REWARD_PROBABILITY = 0.3
+REWARD_MEAN = 0.001
+# standard deviation of the relative price change between two upkeeps
+PRICE_VOLATILITY = 0.02
+# each user sends a deposit and an order through the pipeline
+CALLS_PER_USER = 2
+# each user is funded with their deposit, the upfront gas cost of their calls, and this margin
+FUNDING_MARGIN = 0.001
+
+
+def create_population(
+    staking_monitor,
+    user_count,
+    rng,
+    deposit_range=DEPOSIT_RANGE,
+    price_limit_mean=PRICE_LIMIT_MEAN,
+    price_limit_stddev=PRICE_LIMIT_STDDEV,
+    percentage_to_swap_range=PERCENTAGE_TO_SWAP_RANGE,
+):
+    """Creates user_count funded accounts, each depositing and setting an order
+    drawn from the given distributions, see simulate.
+
+    Each user is funded with their deposit, plus the gas_limit * gas_price of the pipeline for each of
+    their calls, which the node requires upfront, see TransactionPipeline.get_required_funds.
+
+    Returns:
+        list: The accounts of the synthetic users.
+    """
+    print(f"Creating {user_count} synthetic users...")
+    pipeline = TransactionPipeline()
+    upfront_gas_cost = pipeline.gas_limit * pipeline.gas_price * CALLS_PER_USER
+    deposits = [
+        Wei(f"{rng.uniform(*deposit_range):.6f} ether") for _ in range(user_count)
+    ]
+    users = [
+        create_funded_accounts(
+            1, deposit + upfront_gas_cost + Wei(f"{FUNDING_MARGIN} ether")
+        )[0]
+        for deposit in deposits
+    ]
+    start_price = staking_monitor.getPrice()
+    calls = []
+    for user, deposit in zip(users, deposits):
+        calls.append((staking_monitor.deposit, [], {"from": user, "value": deposit}))
+        # priceLimit is given without the 8 decimals added by the contract
+        price_limit = int(
+            start_price * rng.gauss(price_limit_mean, price_limit_stddev) / 10**8
+        )
+        calls.append(
+            (
+                staking_monitor.setOrder,
+                [max(price_limit, 0), rng.randint(*percentage_to_swap_range)],
+                {"from": user},
+            )
+        )
+    # the order of each user is mined after their deposit, as it has the next nonce
+    result = pipeline.send(calls)
+    print(result)
+    if result.failed:
+        raise Exception(f"{result.failed} calls of the population failed")
+    return users
+
+
+def distribute_rewards(
+    users, rng, reward_probability=REWARD_PROBABILITY, reward_mean=REWARD_MEAN
+):
+    """Sends a reward to each user with probability reward_probability, and returns the number of rewarded users."""
+    rewards_distributor = get_account(1)
+    rewarded = 0
+    for user in users:
+        if rng.random() < reward_probability:
+            reward = Wei(f"{rng.expovariate(1 / reward_mean):.9f} ether")
+            rewards_distributor.transfer(user, reward)
+            rewarded += 1
+    return rewarded
+
+
+def move_price(price_feed, rng, price_volatility=PRICE_VOLATILITY):
+    price = price_feed.latestRoundData()[1]
+    new_price = int(price * (1 + rng.gauss(0, price_volatility)))
+    price_feed.updateAnswer(new_price, {"from": get_account()})
+    return new_price
+
+
+def get_check_data(mode, batch_size):
+    """Returns the checkData a keeper registered in the given mode would use."""
+    if UPKEEP_MODES[mode] is None:
+        return b""
+    return encode_abi(["uint8", "uint256"], [UPKEEP_MODES[mode], batch_size])
+
+
+def run_keeper(staking_monitor, check_data):
+    """Calls checkUpkeep and performUpkeep like a Chainlink keeper would, until no upkeep is needed.
+
+    Returns:
+        list: One dict per performUpkeep transaction, with its gas, latency, swaps and DAI distributed.
+    """
+    keeper = get_account()
+    results = []
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": keeper}
+    )
+    while upkeep_needed:
+        start_time = time.perf_counter()
+        tx = staking_monitor.performUpkeep(
+            perform_data, {"from": keeper, "gas_price": get_gas_strategy()}
+        )
+        tx.wait(1)
+        latency = time.perf_counter() - start_time
+        # the participants of a swap are only credited when they are settled, so the totals are read from the summary of the upkeep
+        summary = tx.events["UpkeepPerformed"]
+        results.append(
+            {
+                "block": tx.block_number,
+                "gas_used": tx.gas_used,
+                "latency": latency,
+                "swaps": summary["_swapParticipants"],
+                "dai_distributed": summary["_DAIReceived"],
+            }
+        )
+        # the upkeep stays needed until the last slice of a paginated round
+        upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+            check_data, {"from": keeper}
+        )
+    return results
+
+
+def simulate(
+    user_count=DEFAULT_USER_COUNT,
+    upkeep_count=DEFAULT_UPKEEP_COUNT,
+    mode="full",
+    batch_size=DEFAULT_BATCH_SIZE,
+    seed=0,
+    report_path=None,
+    deposit_range=DEPOSIT_RANGE,
+    price_limit_mean=PRICE_LIMIT_MEAN,
+    price_limit_stddev=PRICE_LIMIT_STDDEV,
+    percentage_to_swap_range=PERCENTAGE_TO_SWAP_RANGE,
+    reward_probability=REWARD_PROBABILITY,
+    reward_mean=REWARD_MEAN,
+    price_volatility=PRICE_VOLATILITY,
+):
+    """Deploys fresh mocks and a StakingMonitor, creates a synthetic population, then runs upkeep_count
+    keeper intervals with rewards and price moves between each of them.
+
+        Args:
+            user_count (int): Number of synthetic users.
+
+            upkeep_count (int): Number of intervals to simulate.
+
+            mode (string): Keeper mode, one of UPKEEP_MODES.
+
+            batch_size (int): Users per slice in paginated mode.
+
+            seed (int): Seed of the random generator, so that runs can be reproduced.
+
+            report_path (string, optional): Where to write the JSON report.
+
+            deposit_range (tuple): Range of the uniform deposits, in ether.
+
+            price_limit_mean (float): Mean of the normal price limits, as a ratio of the starting price.
+
+            price_limit_stddev (float): Standard deviation of the price limits, as a ratio of the starting price.
+
+            percentage_to_swap_range (tuple): Range of the uniform percentages to swap.
+
+            reward_probability (float): Probability that a user receives a reward during an interval.
+
+            reward_mean (float): Mean of the exponential rewards, in ether.
+
+            price_volatility (float): Standard deviation of the relative price change between two intervals.
+
+        Returns:
+            list: One dict per performUpkeep transaction.
+    """
+    if network.show_active() not in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        raise Exception("The keeper simulation can only run on a local chain")
+    rng = random.Random(seed)
+    check_data = get_check_data(mode, batch_size)
+
+    deploy_mocks()
+    staking_monitor = deploy_staking_monitor()
+    price_feed = get_contract("eth_usd_price_feed")
+    users = create_population(
+        staking_monitor,
+        user_count,
+        rng,
+        deposit_range,
+        price_limit_mean,
+        price_limit_stddev,
+        percentage_to_swap_range,
+    )
+
+    results = []
+    for interval_number in range(upkeep_count):
+        rewarded = distribute_rewards(users, rng, reward_probability, reward_mean)
+        price = move_price(price_feed, rng, price_volatility)
+        chain.sleep(staking_monitor.interval() + 1)
+        chain.mine(1)
+        for result in run_keeper(staking_monitor, check_data):
+            result.update(
+                {
+                    "interval": interval_number,
+                    "rewarded_users": rewarded,
+                    "price": price,
+                }
+            )
+            results.append(result)
+            print(
+                f"interval {interval_number}: gas {result['gas_used']}, "
+                f"latency {result['latency']:.3f}s, swaps {result['swaps']}, "
+                f"DAI {result['dai_distributed']}"
+            )
+
+    print(
+        f"{len(results)} upkeeps, {sum(r['gas_used'] for r in results)} gas, "
+        f"{sum(r['swaps'] for r in results)} swaps, "
+        f"{sum(r['dai_distributed'] for r in results)} DAI distributed"
+    )
+    if report_path:
+        if os.path.dirname(report_path):
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, "w") as report_file:
+            json.dump(results, report_file, indent=2)
+    return results
+
+
+def _parse_range(value, parse):
+    if isinstance(value, str):
+        return tuple(parse(bound) for bound in value.split(","))
+    return value
+
+
+def main(
+    user_count=DEFAULT_USER_COUNT,
+    upkeep_count=DEFAULT_UPKEEP_COUNT,
+    mode="full",
+    batch_size=DEFAULT_BATCH_SIZE,
+    deposit_range=DEPOSIT_RANGE,
+    price_limit_mean=PRICE_LIMIT_MEAN,
+    price_limit_stddev=PRICE_LIMIT_STDDEV,
+    percentage_to_swap_range=PERCENTAGE_TO_SWAP_RANGE,
+    reward_probability=REWARD_PROBABILITY,
+    reward_mean=REWARD_MEAN,
+    price_volatility=PRICE_VOLATILITY,
+):
+    simulate(
+        int(user_count),
+        int(upkeep_count),
+        mode,
+        int(batch_size),
+        report_path="reports/keeper_simulation.json",
+        deposit_range=_parse_range(deposit_range, float),
+        price_limit_mean=float(price_limit_mean),
+        price_limit_stddev=float(price_limit_stddev),
+        percentage_to_swap_range=_parse_range(percentage_to_swap_range, int),
+        reward_probability=float(reward_probability),
+        reward_mean=float(reward_mean),
+        price_volatility=float(price_volatility),
+    )
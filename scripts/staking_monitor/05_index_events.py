@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+from scripts.event_indexer import EventIndexer
+from scripts.helpful_scripts import get_deployed
+
+
+def main():
+    staking_monitor = get_deployed("staking_monitor")
+    indexer = EventIndexer(staking_monitor)
+    print(f"Indexing events of {staking_monitor.address}")
+    indexer.tail()
@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+from scripts.balance_scanner import scan_and_perform_upkeep
+from scripts.helpful_scripts import get_account, get_deployed
+
+
+def main():
+    staking_monitor = get_deployed("staking_monitor")
+    print(f"Scanning the balances of the users of {staking_monitor.address}")
+    if scan_and_perform_upkeep(staking_monitor, get_account()) is None:
+        print("No upkeep needed")
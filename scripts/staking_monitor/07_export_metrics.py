@@ -0,0 +1,8 @@
+#!/usr/bin/python3
+from scripts.helpful_scripts import get_deployed
+from scripts.upkeep_metrics import UpkeepMetrics
+
+
+def main():
+    staking_monitor = get_deployed("staking_monitor")
+    UpkeepMetrics(staking_monitor).serve()
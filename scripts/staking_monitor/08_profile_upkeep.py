@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+"""Profiles the gas used by a transaction, opcode by opcode, with debug_traceTransaction.
+
+Profiles the given transaction, or performs an upkeep for a few synthetic users and profiles it:
+    brownie run scripts/staking_monitor/08_profile_upkeep.py
+    brownie run scripts/staking_monitor/08_profile_upkeep.py main 0x<txid>
+The collapsed stacks can be rendered with flamegraph.pl, inferno-flamegraph or speedscope.
+"""
+
+from brownie import chain, network
+from scripts.gas_profiler import DEFAULT_REPORT_DIRECTORY, profile_transaction
+from scripts.helpful_scripts import (
+    NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    create_funded_accounts,
+    get_account,
+    get_deployed,
+)
+from web3 import Web3
+
+DEFAULT_USER_COUNT = 20
+
+
+def perform_upkeep(staking_monitor, user_count):
+    users = create_funded_accounts(user_count, Web3.toWei(1, "ether"))
+    # the price limits are under the current price, so that every user takes part in the swap
+    price_limit = staking_monitor.getPrice() / 10**8 - 1
+    for user in users:
+        staking_monitor.deposit({"from": user, "value": Web3.toWei(0.1, "ether")})
+        staking_monitor.setOrder(price_limit, 40, {"from": user})
+    rewards_distributor = get_account(1)
+    for user in users:
+        rewards_distributor.transfer(user, Web3.toWei(0.001, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    tx = staking_monitor.performUpkeep(b"", {"from": get_account()})
+    tx.wait(1)
+    return tx
+
+
+def main(txid=None, user_count=DEFAULT_USER_COUNT):
+    if txid is None:
+        if network.show_active() not in NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+            raise Exception("Pass a txid to profile a transaction on this network")
+        tx = perform_upkeep(get_deployed("staking_monitor"), int(user_count))
+    else:
+        tx = chain.get_transaction(txid)
+    profile = profile_transaction(tx)
+    print(profile.format_table())
+    print(f"Collapsed stacks written to {DEFAULT_REPORT_DIRECTORY}/{tx.txid}.folded")
@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+"""Compares two reports of the gas benchmark suite, e.g. before and after a change of the contract:
+    brownie run scripts/staking_monitor/09_compare_gas.py main reports/gas_before.json reports/gas_after.json
+    brownie run scripts/staking_monitor/09_compare_gas.py main reports/gas_before.json reports/gas_after.json "10,100,500" "deposit,setOrder,performUpkeep"
+The user counts and entry points are comma separated, and default to the ones of both reports.
+"""
+
+from scripts.gas_comparison import (
+    compare_gas_reports,
+    format_gas_comparison,
+    load_gas_report,
+)
+
+
+def main(before_path, after_path, user_counts=None, entry_points=None):
+    rows = compare_gas_reports(
+        load_gas_report(before_path),
+        load_gas_report(after_path),
+        user_counts.split(",") if user_counts else None,
+        entry_points.split(",") if entry_points else None,
+    )
+    print(format_gas_comparison(rows))
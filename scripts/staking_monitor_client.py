@@ -0,0 +1,111 @@
+from brownie import web3
+from collections import OrderedDict
+import time
+
+DEFAULT_CACHE_SIZE = 1024
+# how often, in seconds, the client checks for a new block
+DEFAULT_REFRESH_INTERVAL = 1
+
+
+class StakingMonitorClient:
+    """Wraps a StakingMonitor and caches the results of its view functions, keyed by
+    (block_number, function, args, caller).
+
+    Calls are pinned to the block seen at the last refresh, so that all the results served
+    between two refreshes are consistent with each other. The cache is a bounded LRU, emptied
+    when a new block is seen: the state can only change in a new block, so a refresh costs a
+    single eth_blockNumber request, without polling event filters.
+
+        Args:
+            staking_monitor (brownie.network.contract.ProjectContract): The StakingMonitor to read.
+
+            max_size (int, optional): The maximum number of cached results.
+
+            refresh_interval (float, optional): The minimum number of seconds between two
+            checks for a new block. Use 0 to check before every call.
+    """
+
+    def __init__(
+        self,
+        staking_monitor,
+        max_size=DEFAULT_CACHE_SIZE,
+        refresh_interval=DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.staking_monitor = staking_monitor
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self.block_number = None
+        self._cache = OrderedDict()
+        self._last_refresh = None
+
+    def refresh(self):
+        """Checks for a new block, and empties the cache if there is one."""
+        self._last_refresh = time.monotonic()
+        block_number = web3.eth.block_number
+        if block_number != self.block_number:
+            self.invalidate()
+        self.block_number = block_number
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def call(self, function_name, *args, caller=None):
+        """Calls a view function of the contract, or returns its cached result.
+
+        Args:
+            function_name (string): The name of the view function, or public variable.
+
+            args: The arguments of the function.
+
+            caller (string, optional): The msg.sender of the call, for the functions
+            that read the data of the calling user.
+        """
+        if (
+            self._last_refresh is None
+            or time.monotonic() - self._last_refresh >= self.refresh_interval
+        ):
+            self.refresh()
+        key = (self.block_number, function_name, args, caller)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        self.misses += 1
+        call_args = args + ({"from": caller},) if caller else args
+        result = getattr(self.staking_monitor, function_name)(
+            *call_args, block_identifier=self.block_number
+        )
+        self._cache[key] = result
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def get_price(self):
+        return self.call("getPrice")
+
+    def get_user(self, address):
+        # the s_users getter doesn't include the share of a swap the user hasn't been credited with yet
+        return self.call("getSettledUserData", address)
+
+    def get_user_data(self, address):
+        return self.call("getUserData", caller=address)
+
+    def get_deposit_balance(self, address):
+        return self.call("getDepositBalance", caller=address)
+
+    def get_dai_balance(self, address):
+        return self.call("getDAIBalance", caller=address)
+
+    def get_stats(self):
+        """Returns the hit and miss counters, to help sizing the cache."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+            "size": len(self._cache),
+            "max_size": self.max_size,
+        }
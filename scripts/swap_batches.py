@@ -0,0 +1,240 @@
+from brownie import web3
+from eth_abi import decode_abi
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+
+from scripts.snapshot import USER_DATA_FIELDS, get_snapshot
+
+# the non-indexed arguments of SwapBatch and SwapSettled, in the order they are ABI encoded in the log data
+SWAP_BATCH_DATA_TYPES = ["uint256", "uint256", "uint256", "uint256", "uint256[]"]
+SWAP_BATCH_ARGUMENTS = [
+    "_timestamp",
+    "_ETHPrice",
+    "_totalETHSwapped",
+    "_DAIReceived",
+    "_priceBuckets",
+]
+SWAP_SETTLED_DATA_TYPES = ["uint256", "uint256", "uint256"]
+SWAP_SETTLED_ARGUMENTS = ["_totalReward", "_setPriceLimit", "_DAIReceived"]
+ETH_SWAPPED_BITS = 128
+
+
+def _to_bytes(value):
+    # web3 returns the log data as a hex string, and the topics as HexBytes
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+
+def _get_log_position(log):
+    return {
+        "blockNumber": log["blockNumber"],
+        "transactionHash": "0x" + _to_bytes(log["transactionHash"]).hex(),
+        "logIndex": log["logIndex"],
+    }
+
+
+def get_price_bucket(price):
+    """Returns the bucket a price limit is indexed in, like StakingMonitor.getPriceBucket."""
+    if price < 128:
+        return price
+    msb = price.bit_length() - 1
+    return (msb - 5) * 64 + ((price >> (msb - 6)) & 63)
+
+
+def expand_swap_batch(price_buckets):
+    """Unpacks the _priceBuckets of a SwapBatch event into one record per price bucket whose
+    balances were swapped.
+
+        Args:
+            price_buckets (list): The _priceBuckets of the batch, bucket << 128 | ETH swapped.
+
+        Returns:
+            list: The priceBucket and ETHSwapped of each bucket, in ascending bucket order.
+    """
+    eth_swapped_mask = (1 << ETH_SWAPPED_BITS) - 1
+    return [
+        {
+            "priceBucket": price_bucket >> ETH_SWAPPED_BITS,
+            "ETHSwapped": price_bucket & eth_swapped_mask,
+        }
+        for price_bucket in price_buckets
+    ]
+
+
+def get_swap_batches_from_logs(logs):
+    """Decodes raw SwapBatch logs, as returned by eth_getLogs, into one record per swap round, with
+    its _timestamp, _ETHPrice, _totalETHSwapped, _DAIReceived and _priceBuckets, its swap round, and
+    the block number, transaction hash and log index of its log.
+    """
+    return [
+        {
+            **dict(
+                zip(
+                    SWAP_BATCH_ARGUMENTS,
+                    decode_abi(SWAP_BATCH_DATA_TYPES, _to_bytes(log["data"])),
+                )
+            ),
+            "swapRound": int.from_bytes(_to_bytes(log["topics"][1]), "big"),
+            **_get_log_position(log),
+        }
+        for log in logs
+    ]
+
+
+def get_swapped_records_from_events(events):
+    """Turns the SwapSettled events of a transaction, e.g. tx.events["SwapSettled"], into records with the
+    _address, _totalReward, _setPriceLimit and _DAIReceived of each participant.
+
+    A participant's SwapSettled event is emitted when they are credited with their share, which can be
+    after the transaction of the swap, see StakingMonitor._settleSwap. The swap round of each record tells
+    which swap it belongs to, and its SwapBatch event has the timestamp and price of the swap.
+    """
+    return [
+        {
+            "_address": event["_address"],
+            **{argument: event[argument] for argument in SWAP_SETTLED_ARGUMENTS},
+            "swapRound": event["_swapRound"],
+        }
+        for event in events
+    ]
+
+
+def get_swapped_records_from_logs(logs):
+    """Decodes raw SwapSettled logs, as returned by eth_getLogs, into per-participant records.
+
+    The log data is decoded with a single ABI decoding per log, without building the event objects of web3,
+    which is what makes decoding large histories fast. Each record also gets the swap round, block number,
+    transaction hash and log index of its log.
+    """
+    records = []
+    for log in logs:
+        values = decode_abi(SWAP_SETTLED_DATA_TYPES, _to_bytes(log["data"]))
+        records.append(
+            {
+                "_address": to_checksum_address(_to_bytes(log["topics"][1])[-20:]),
+                **dict(zip(SWAP_SETTLED_ARGUMENTS, values)),
+                "swapRound": int.from_bytes(_to_bytes(log["topics"][2]), "big"),
+                **_get_log_position(log),
+            }
+        )
+    return records
+
+
+def get_event_topic(brownie_contract, event_name):
+    return event_abi_to_log_topic(
+        next(
+            abi
+            for abi in brownie_contract.abi
+            if abi["type"] == "event" and abi["name"] == event_name
+        )
+    )
+
+
+def _get_logs(brownie_contract, topics, from_block, to_block):
+    return web3.eth.get_logs(
+        {
+            "address": brownie_contract.address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": topics,
+        }
+    )
+
+
+def get_swap_batches(brownie_contract, from_block=0, to_block="latest"):
+    """Returns the records of the swap rounds of a StakingMonitor between two blocks, read with a single
+    eth_getLogs request, see get_swap_batches_from_logs.
+    """
+    logs = _get_logs(
+        brownie_contract,
+        [get_event_topic(brownie_contract, "SwapBatch")],
+        from_block,
+        to_block,
+    )
+    return get_swap_batches_from_logs(logs)
+
+
+def get_swapped_records(
+    brownie_contract, from_block=0, to_block="latest", swap_round=None
+):
+    """Returns the per-participant records of every swap of a StakingMonitor settled between two blocks,
+    read with a single eth_getLogs request.
+
+        Args:
+            brownie_contract (brownie.network.contract.ProjectContract): The StakingMonitor.
+
+            from_block (int, optional): The first block to read.
+
+            to_block (int, optional): The last block to read. Defaults to the latest block.
+
+            swap_round (int, optional): Only returns the records of this swap round.
+    """
+    topics = [get_event_topic(brownie_contract, "SwapSettled")]
+    if swap_round is not None:
+        topics += [None, "0x" + swap_round.to_bytes(32, "big").hex()]
+    logs = _get_logs(brownie_contract, topics, from_block, to_block)
+    return get_swapped_records_from_logs(logs)
+
+
+def get_swap_round_participants(brownie_contract, swap_batch):
+    """Rebuilds the per-participant records of a swap round, including the participants who haven't been
+    credited yet, so who have no SwapSettled event.
+
+    A participant is either credited by the end of the block of the swap, e.g. the users of the bucket of the
+    price, which the swap credits itself, and then has a SwapSettled event in that block. Or their balanceToSwap
+    is still waiting in the swap pool of their price bucket at the end of the block: their checkpoint then points
+    to the entry of s_priceBucketSwaps of the round, and their share is the difference between their settled
+    and stored DAIBalance. The state is read at the block of the swap, which needs an archive node for old blocks.
+
+        Args:
+            brownie_contract (brownie.network.contract.ProjectContract): The StakingMonitor.
+
+            swap_batch (dict): The record of the round's SwapBatch event, see get_swap_batches_from_logs.
+
+        Returns:
+            list: The _address, _totalReward, _setPriceLimit, _DAIReceived and swapRound of each participant,
+            like get_swapped_records_from_events. The timestamp and price of the swap are the ones of swap_batch.
+    """
+    block_number = swap_batch["blockNumber"]
+    swap_round = swap_batch["swapRound"]
+    participants = {
+        record["_address"]: {
+            key: value
+            for key, value in record.items()
+            if key.startswith("_") or key == "swapRound"
+        }
+        for record in get_swapped_records(
+            brownie_contract, block_number, block_number, swap_round
+        )
+    }
+    price_buckets = {
+        price_bucket["priceBucket"]
+        for price_bucket in expand_swap_batch(swap_batch["_priceBuckets"])
+    }
+    snapshot = get_snapshot(brownie_contract, block_identifier=block_number)
+    for address, settled_user in snapshot["users"].items():
+        price_bucket = get_price_bucket(settled_user["priceLimit"])
+        if address in participants or price_bucket not in price_buckets:
+            continue
+        user = dict(
+            zip(
+                USER_DATA_FIELDS,
+                brownie_contract.s_users(address, block_identifier=block_number),
+            )
+        )
+        # the settled data only clears the checkpoint of a balanceToSwap that has been swapped
+        if user["swapCheckpoint"] == 0 or settled_user["swapCheckpoint"] != 0:
+            continue
+        price_bucket_swap = brownie_contract.s_priceBucketSwaps(
+            price_bucket, user["swapCheckpoint"] - 1, block_identifier=block_number
+        )
+        if price_bucket_swap["swapRound"] != swap_round:
+            continue
+        participants[address] = {
+            "_address": address,
+            "_totalReward": user["balanceToSwap"],
+            "_setPriceLimit": user["priceLimit"],
+            "_DAIReceived": settled_user["DAIBalance"] - user["DAIBalance"],
+            "swapRound": swap_round,
+        }
+    return list(participants.values())
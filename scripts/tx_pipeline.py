@@ -0,0 +1,230 @@
+from brownie import web3
+from concurrent.futures import ThreadPoolExecutor
+from web3.exceptions import TimeExhausted, TransactionNotFound
+import threading
+import time
+
+# the number of transactions submitted but not mined yet, across all senders
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_WORKERS = 8
+# the calls of a pipeline can depend on each other, so their gas can't be estimated before
+# the previous ones are mined: they get a fixed gas limit instead
+DEFAULT_GAS_LIMIT = 500000
+# a transaction without a receipt after RECEIPT_TIMEOUT seconds, that the node doesn't know
+# anymore, is broadcast again, at most DEFAULT_MAX_RETRIES times
+RECEIPT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+RECEIPT_POLL_LATENCY = 0.1
+
+
+class PipelineResult:
+    """The outcome of the calls sent by a TransactionPipeline, in the order they were given."""
+
+    def __init__(self, call_count):
+        self.receipts = [None] * call_count
+        self.errors = [None] * call_count
+        self.retries = 0
+        self.elapsed = 0
+
+    @property
+    def confirmed(self):
+        return sum(1 for receipt in self.receipts if receipt and receipt["status"] == 1)
+
+    @property
+    def failed(self):
+        return len(self.receipts) - self.confirmed
+
+    @property
+    def tx_per_second(self):
+        return self.confirmed / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return (
+            f"{self.confirmed} transactions confirmed, {self.failed} failed, {self.retries} retries "
+            f"in {self.elapsed:.2f}s ({self.tx_per_second:.1f} tx/s)"
+        )
+
+
+class TransactionPipeline:
+    """Sends many contract calls without waiting for each one to be mined before sending the next one.
+
+    The nonce of each sender is read once, then assigned locally, so the calls of a sender are mined
+    in the order they were given, and a call can depend on a previous call of the same sender.
+    At most max_in_flight transactions are pending at any time, while a thread pool collects their receipts.
+
+    The gas of the calls isn't estimated, see DEFAULT_GAS_LIMIT: each call that doesn't set its own gets
+    gas_limit and gas_price. A node only accepts a transaction if its sender can pay its value plus
+    gas * gasPrice upfront, even though only the gas used is charged. With the defaults and a 20 gwei node,
+    that is 0.01 ether per call on top of its value, see get_required_funds.
+
+        Args:
+            max_in_flight (int, optional): The maximum number of pending transactions.
+
+            workers (int, optional): The number of threads waiting for receipts.
+
+            gas_limit (int, optional): The gas limit of the calls that don't set one.
+
+            gas_price (int, optional): The gas price of the calls that don't set one.
+            Defaults to the gas price of the node when the pipeline is created.
+
+            max_retries (int, optional): How many times a dropped transaction is broadcast again.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        workers=DEFAULT_WORKERS,
+        gas_limit=DEFAULT_GAS_LIMIT,
+        gas_price=None,
+        max_retries=DEFAULT_MAX_RETRIES,
+    ):
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+        self.gas_limit = gas_limit
+        self.gas_price = web3.eth.gas_price if gas_price is None else gas_price
+        self.max_retries = max_retries
+        self.chain_id = web3.eth.chain_id
+        self.result = None
+        self._nonces = {}
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    def _get_gas_cost(self, tx_params):
+        return tx_params.get("gas_limit", self.gas_limit) * tx_params.get(
+            "gas_price", self.gas_price
+        )
+
+    def get_required_funds(self, calls):
+        """Returns the funds each sender needs for its calls to be accepted: the value of its calls,
+        plus the gas_limit * gas_price each of them has to cover upfront.
+
+        Args:
+            calls (list): The calls, as given to send.
+
+        Returns:
+            dict: The wei needed by each sender, keyed by address.
+        """
+        required_funds = {}
+        for _, _, tx_params in calls:
+            address = tx_params["from"].address
+            required_funds[address] = (
+                required_funds.get(address, 0)
+                + int(tx_params.get("value", 0))
+                + self._get_gas_cost(tx_params)
+            )
+        return required_funds
+
+    def _get_nonce(self, sender):
+        if sender.address not in self._nonces:
+            self._nonces[sender.address] = web3.eth.get_transaction_count(
+                sender.address, "pending"
+            )
+        nonce = self._nonces[sender.address]
+        self._nonces[sender.address] += 1
+        return nonce
+
+    def _build_transaction(self, contract_function, args, tx_params):
+        sender = tx_params["from"]
+        transaction = {
+            "from": sender.address,
+            "value": int(tx_params.get("value", 0)),
+            "gas": tx_params.get("gas_limit", self.gas_limit),
+            "gasPrice": tx_params.get("gas_price", self.gas_price),
+            "nonce": self._get_nonce(sender),
+            "chainId": self.chain_id,
+        }
+        if contract_function is None:
+            transaction["to"] = str(tx_params["to"])
+        else:
+            transaction["to"] = contract_function._address
+            transaction["data"] = contract_function.encode_input(*args)
+        return sender, transaction
+
+    def _broadcast(self, transaction, raw_transaction):
+        if raw_transaction is not None:
+            return web3.eth.send_raw_transaction(raw_transaction)
+        # the accounts unlocked on the node, like the ones of a local chain, are signed by the node
+        return web3.eth.send_transaction(transaction)
+
+    def _submit(self, sender, transaction):
+        private_key = getattr(sender, "private_key", None)
+        raw_transaction = None
+        if private_key:
+            raw_transaction = web3.eth.account.sign_transaction(
+                {key: value for key, value in transaction.items() if key != "from"},
+                private_key,
+            ).rawTransaction
+        tx_hash = self._broadcast(transaction, raw_transaction)
+        return tx_hash, raw_transaction
+
+    def _wait_for_receipt(self, transaction, tx_hash, raw_transaction):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return web3.eth.wait_for_transaction_receipt(
+                        tx_hash, RECEIPT_TIMEOUT, RECEIPT_POLL_LATENCY
+                    )
+                except TimeExhausted:
+                    try:
+                        # still pending, it will be mined once the gas price allows it
+                        web3.eth.get_transaction(tx_hash)
+                        continue
+                    except TransactionNotFound:
+                        pass
+                    if attempt == self.max_retries:
+                        raise
+                    # dropped from the mempool, the same signed transaction is broadcast again
+                    with self._lock:
+                        self.result.retries += 1
+                    self._broadcast(transaction, raw_transaction)
+            raise TimeExhausted(f"Transaction {tx_hash.hex()} is still pending")
+        finally:
+            self._in_flight.release()
+
+    def send(self, calls):
+        """Sends the calls, and waits for all of their receipts.
+
+        Args:
+            calls (list): (contract_function, args, tx_params) tuples, e.g.
+            (staking_monitor.deposit, [], {"from": user, "value": value}). tx_params takes
+            "from", "value", "gas_limit" and "gas_price" like a brownie call, and "to" for
+            plain transfers, which have None as contract_function.
+
+        Returns:
+            PipelineResult: The receipts of the calls, and the errors of the calls that failed.
+        """
+        self.result = PipelineResult(len(calls))
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            for idx, (contract_function, args, tx_params) in enumerate(calls):
+                self._in_flight.acquire()
+                try:
+                    sender, transaction = self._build_transaction(
+                        contract_function, args, tx_params
+                    )
+                    tx_hash, raw_transaction = self._submit(sender, transaction)
+                except Exception as error:
+                    self._in_flight.release()
+                    self.result.errors[idx] = error
+                    # the nonce may not have been used, it is read again for the next call of the sender
+                    self._nonces.pop(tx_params["from"].address, None)
+                    continue
+                futures.append(
+                    (
+                        idx,
+                        executor.submit(
+                            self._wait_for_receipt,
+                            transaction,
+                            tx_hash,
+                            raw_transaction,
+                        ),
+                    )
+                )
+            for idx, future in futures:
+                try:
+                    self.result.receipts[idx] = future.result()
+                except Exception as error:
+                    self.result.errors[idx] = error
+        self.result.elapsed = time.perf_counter() - start_time
+        return self.result
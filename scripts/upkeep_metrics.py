@@ -0,0 +1,205 @@
+from brownie import web3
+from eth_utils import event_abi_to_log_topic
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from web3._utils.events import get_event_data
+import os
+import threading
+
+METRIC_PREFIX = "staking_monitor"
+# upper bounds of the histogram buckets, the +Inf bucket is added when rendering
+SWAP_SIZE_BUCKETS = [0.001, 0.01, 0.1, 1, 10, 100, 1000]
+PARTICIPANTS_BUCKETS = [0, 1, 5, 10, 50, 100, 500, 1000, 5000]
+USERS_SCANNED_BUCKETS = [10, 100, 500, 1000, 5000, 10000]
+DEFAULT_PORT = 8000
+
+# UpkeepPerformed argument, metric name and help of the counters
+COUNTERS = [
+    ("_usersScanned", "users_scanned_total", "Users scanned by performUpkeep."),
+    (
+        "_usersRewarded",
+        "users_rewarded_total",
+        "Users whose address balance increased since the previous upkeep.",
+    ),
+    (
+        "_usersWithoutEnoughDeposit",
+        "users_without_enough_deposit_total",
+        "Users flagged by NotEnoughDepositedEthForSwap.",
+    ),
+    ("_swapParticipants", "swap_participants_total", "Users who took part in a swap."),
+    ("_totalETHSwapped", "eth_swapped_wei_total", "ETH swapped for DAI, in wei."),
+    ("_DAIReceived", "dai_received_total", "DAI received from the swaps, in wei."),
+]
+
+
+class Histogram:
+    """A Prometheus histogram, with cumulative buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for idx, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = [
+            f'{name}_bucket{{{labels},le="{upper_bound}"}} {count}'
+            for upper_bound, count in zip(self.buckets, self.counts)
+        ]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class UpkeepMetrics:
+    """Turns the UpkeepPerformed events of a StakingMonitor into Prometheus metrics.
+
+    Every call to update reads the events emitted since the previous one, so the metrics
+    are cumulative over the life of the exporter, starting at from_block.
+
+        Args:
+            brownie_contract (brownie.network.contract.ProjectContract): The StakingMonitor to watch.
+
+            from_block (int, optional): The first block to read. Defaults to the deployment block if
+            brownie knows it, the current block otherwise.
+    """
+
+    def __init__(self, brownie_contract, from_block=None):
+        self.address = brownie_contract.address
+        if from_block is None:
+            deployment_tx = getattr(brownie_contract, "tx", None)
+            from_block = (
+                deployment_tx.block_number if deployment_tx else web3.eth.block_number
+            )
+        self.next_block = from_block
+        self._event_abi = next(
+            abi
+            for abi in brownie_contract.abi
+            if abi["type"] == "event" and abi["name"] == "UpkeepPerformed"
+        )
+        self.upkeeps = 0
+        self.counters = {argument: 0 for argument, _, _ in COUNTERS}
+        self.last_price = None
+        self.last_block = None
+        self.swap_size = Histogram(SWAP_SIZE_BUCKETS)
+        self.swap_participants = Histogram(PARTICIPANTS_BUCKETS)
+        self.users_scanned = Histogram(USERS_SCANNED_BUCKETS)
+        self._lock = threading.Lock()
+
+    def observe(self, event):
+        """Adds a decoded UpkeepPerformed event to the metrics."""
+        args = event["args"]
+        self.upkeeps += 1
+        for argument in self.counters:
+            self.counters[argument] += args[argument]
+        # the price is only read by upkeeps that reach the swap
+        if args["_ETHPrice"] > 0:
+            self.last_price = args["_ETHPrice"]
+        self.last_block = event["blockNumber"]
+        self.users_scanned.observe(args["_usersScanned"])
+        # upkeeps without a swap would hide the swap sizes in the first bucket
+        if args["_swapParticipants"] > 0:
+            self.swap_size.observe(web3.fromWei(args["_totalETHSwapped"], "ether"))
+            self.swap_participants.observe(args["_swapParticipants"])
+
+    def update(self):
+        """Reads the UpkeepPerformed events emitted since the last update, and returns how many were read."""
+        with self._lock:
+            latest_block = web3.eth.block_number
+            if latest_block < self.next_block:
+                return 0
+            logs = web3.eth.get_logs(
+                {
+                    "address": self.address,
+                    "fromBlock": self.next_block,
+                    "toBlock": latest_block,
+                    "topics": [event_abi_to_log_topic(self._event_abi)],
+                }
+            )
+            for log in logs:
+                self.observe(get_event_data(web3.codec, self._event_abi, log))
+            self.next_block = latest_block + 1
+            return len(logs)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        labels = f'contract="{self.address}"'
+        lines = [
+            f"# HELP {METRIC_PREFIX}_upkeeps_total Upkeeps performed.",
+            f"# TYPE {METRIC_PREFIX}_upkeeps_total counter",
+            f"{METRIC_PREFIX}_upkeeps_total{{{labels}}} {self.upkeeps}",
+        ]
+        for argument, name, description in COUNTERS:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_{name} {description}",
+                f"# TYPE {METRIC_PREFIX}_{name} counter",
+                f"{METRIC_PREFIX}_{name}{{{labels}}} {self.counters[argument]}",
+            ]
+        if self.last_price is not None:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_eth_price Price used by the last swap, with 8 decimals.",
+                f"# TYPE {METRIC_PREFIX}_eth_price gauge",
+                f"{METRIC_PREFIX}_eth_price{{{labels}}} {self.last_price}",
+            ]
+        if self.last_block is not None:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_last_upkeep_block Block of the last upkeep.",
+                f"# TYPE {METRIC_PREFIX}_last_upkeep_block gauge",
+                f"{METRIC_PREFIX}_last_upkeep_block{{{labels}}} {self.last_block}",
+            ]
+        for histogram, name, description in [
+            (self.swap_size, "swap_size_eth", "ETH swapped per upkeep with a swap."),
+            (
+                self.swap_participants,
+                "swap_participants",
+                "Participants per upkeep with a swap.",
+            ),
+            (self.users_scanned, "users_scanned", "Users scanned per upkeep."),
+        ]:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_{name} {description}",
+                f"# TYPE {METRIC_PREFIX}_{name} histogram",
+            ]
+            lines += histogram.render(f"{METRIC_PREFIX}_{name}", labels)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Updates the metrics and writes them to path, e.g. for the node_exporter textfile collector."""
+        self.update()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first, so that the collector never reads a partial file
+        with open(f"{path}.tmp", "w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(f"{path}.tmp", path)
+
+    def serve(self, port=DEFAULT_PORT):
+        """Serves the metrics over HTTP on /metrics, updating them on each scrape. Runs until interrupted."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                metrics.update()
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("", port), MetricsHandler)
+        print(f"Serving the metrics of {self.address} on port {port}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
@@ -1,15 +1,50 @@
 import pytest
 from brownie import (
     accounts,
+    chain,
     config,
     network,
+    StakingMonitor,
 )
 from scripts.helpful_scripts import (
+    get_account,
+    get_contract,
     LOCAL_BLOCKCHAIN_ENVIRONMENTS,
 )
 from web3 import Web3
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--gas-benchmark",
+        action="store_true",
+        default=False,
+        help="run the gas benchmark suite in tests/test_gas_benchmark.py",
+    )
+    parser.addoption(
+        "--gas-report",
+        default="reports/gas_benchmark.json",
+        help="where the gas benchmark suite writes its JSON report",
+    )
+    parser.addoption(
+        "--gas-baseline",
+        default="tests/gas_baseline.json",
+        help="stored gas report the benchmark results are compared with",
+    )
+    parser.addoption(
+        "--gas-tolerance",
+        type=float,
+        default=5.0,
+        help="allowed gas increase over the baseline, in percent",
+    )
+    parser.addoption(
+        "--update-gas-baseline",
+        action="store_true",
+        default=False,
+        help="overwrite the gas baseline with the results of this run",
+    )
+
+
 @pytest.fixture
 def get_keyhash():
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
@@ -58,3 +93,43 @@ def chainlink_fee():
 @pytest.fixture
 def expiry_time():
     return 300
+
+
+def deploy_staking_monitor():
+    interval = 3 * 60  # 3 minutes in seconds
+    staking_monitor = StakingMonitor.deploy(
+        get_contract("eth_usd_price_feed").address,
+        get_contract("dai_token").address,
+        get_contract("uniswap_v2").address,
+        interval,
+        {"from": get_account()},
+    )
+    block_confirmations = 6
+    if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        block_confirmations = 1
+    staking_monitor.tx.wait(block_confirmations)
+    return staking_monitor
+
+
+@pytest.fixture(scope="module")
+def module_staking_monitor():
+    # live networks can't be snapshotted, so each test deploys its own contract there
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        return None
+    return deploy_staking_monitor()
+
+
+@pytest.fixture
+def deploy_staking_monitor_contract(module_staking_monitor):
+    """On local chains, the StakingMonitor is deployed once per module, and the chain is
+    reverted to a snapshot taken right after the deployment at the end of each test."""
+    if module_staking_monitor is None:
+        staking_monitor = deploy_staking_monitor()
+        # Assert
+        assert staking_monitor is not None
+        yield staking_monitor
+        return
+
+    chain.snapshot()
+    yield module_staking_monitor
+    chain.revert()
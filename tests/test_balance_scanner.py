@@ -0,0 +1,62 @@
+from brownie import chain, web3
+from scripts import balance_scanner
+from scripts.balance_scanner import get_balances, scan_and_perform_upkeep, scan_balances
+from scripts.helpful_scripts import get_account
+from web3 import Web3
+
+
+def test_scanner_only_updates_users_whose_balance_changed(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    staking_monitor.performUpkeep(b"", {"from": get_account()}).wait(1)
+    get_account(1).transfer(users[1], Web3.toWei(0.01, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    scan = scan_balances(staking_monitor, batch_size=2)
+    tx = scan_and_perform_upkeep(staking_monitor, get_account())
+
+    # Assert
+    assert scan["changed_users"] == [users[1].address]
+    assert tx is not None
+    assert (
+        staking_monitor.s_users(users[1].address)["previousBalance"]
+        == users[1].balance()
+    )
+    # nothing changed since the upkeep
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    assert scan_balances(staking_monitor)["changed_users"] == []
+
+
+def test_get_balances_only_sends_batches_over_http(monkeypatch):
+    # Arrange
+    addresses = [get_account(idx).address for idx in range(3)]
+    block = web3.eth.block_number
+    batched_balances = get_balances(addresses, block, batch_size=2)
+
+    def post(*args, **kwargs):
+        raise AssertionError("batch request sent to a provider that isn't HTTP")
+
+    # a websocket or IPC provider isn't an HTTPProvider
+    monkeypatch.setattr(balance_scanner, "HTTPProvider", type("OtherProvider", (), {}))
+    monkeypatch.setattr(balance_scanner.requests, "post", post)
+
+    # Act
+    balances = get_balances(addresses, block)
+
+    # Assert
+    assert balances == batched_balances
+    assert balances == {
+        address: web3.eth.get_balance(address, block) for address in addresses
+    }
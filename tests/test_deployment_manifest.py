@@ -0,0 +1,76 @@
+from brownie import DAIToken, LinkToken, StakingMonitor, web3
+from scripts.deployment_manifest import DeploymentManifest, get_code_hash
+from scripts.helpful_scripts import get_account, get_contract, get_deployed
+
+
+def test_manifest_persists_deployments(tmp_path):
+    # Arrange
+    link_token = LinkToken.deploy({"from": get_account()})
+    manifest = DeploymentManifest("development", str(tmp_path))
+
+    # Act
+    manifest.record(
+        "link_token", LinkToken, link_token.address, get_code_hash(link_token.address)
+    )
+    reloaded_manifest = DeploymentManifest("development", str(tmp_path))
+
+    # Assert
+    assert (
+        reloaded_manifest.get_address("link_token", LinkToken, check_code=True)
+        == link_token.address
+    )
+    # the entry is stale for a contract type with another ABI
+    assert reloaded_manifest.get_address("link_token", DAIToken) is None
+    assert reloaded_manifest.get_address("dai_token", DAIToken) is None
+
+
+def test_manifest_entry_is_stale_without_its_code(tmp_path):
+    # Arrange
+    manifest = DeploymentManifest("development", str(tmp_path))
+    # an address without any code, like the mocks of a chain that has been restarted
+    manifest.record("link_token", LinkToken, get_account(3).address, "0x00")
+
+    # Act
+    address = manifest.get_address("link_token", LinkToken, check_code=True)
+
+    # Assert
+    assert address is None
+
+
+def test_get_contract_returns_the_same_handle():
+    # Act
+    first_handle = get_contract("dai_token")
+    second_handle = get_contract("dai_token")
+
+    # Assert
+    assert first_handle is second_handle
+
+
+def test_get_contract_checks_the_code_once_per_address(monkeypatch):
+    # Arrange
+    get_contract("dai_token")
+    checked_addresses = []
+    get_code = web3.eth.get_code
+
+    def record_checked_address(address, *args):
+        checked_addresses.append(address)
+        return get_code(address, *args)
+
+    monkeypatch.setattr(web3.eth, "get_code", record_checked_address)
+
+    # Act
+    get_contract("dai_token")
+    get_contract("dai_token")
+
+    # Assert
+    assert checked_addresses == []
+
+
+def test_get_deployed_returns_the_last_staking_monitor(
+    deploy_staking_monitor_contract,
+):
+    # Act
+    staking_monitor = get_deployed("staking_monitor")
+
+    # Assert
+    assert staking_monitor.address == StakingMonitor[-1].address
@@ -0,0 +1,36 @@
+from scripts.event_indexer import EventIndexer
+from scripts.helpful_scripts import get_account
+from web3 import Web3
+
+
+def test_indexer_backfills_and_resumes_from_checkpoint(
+    deploy_staking_monitor_contract, tmp_path
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(2)
+    value = Web3.toWei(0.01, "ether")
+    staking_monitor.deposit({"from": user, "value": value}).wait(1)
+    staking_monitor.setOrder(2000, 40, {"from": user}).wait(1)
+    database_path = str(tmp_path / "events.db")
+
+    # Act
+    stored = EventIndexer(staking_monitor, database_path).backfill()
+    staking_monitor.withdrawETH(value, {"from": user}).wait(1)
+    # a new indexer on the same database starts from the checkpoint
+    indexer = EventIndexer(staking_monitor, database_path)
+    stored_after_restart = indexer.backfill()
+
+    # Assert
+    assert stored == 2
+    # withdrawing the whole deposit also removes the user from the watchlist
+    assert stored_after_restart == 2
+    history = indexer.get_user_history(user.address)
+    assert [event["event"] for event in history] == [
+        "Deposited",
+        "OrderSet",
+        "WithdrawnETH",
+        "RemovedFromWatchList",
+    ]
+    assert history[0]["args"]["_amount"] == value
+    assert indexer.get_user_history(user.address, "OrderSet")[0]["event"] == "OrderSet"
@@ -0,0 +1,39 @@
+from brownie import StakingMonitor
+from scripts.event_subscriptions import EventSubscriptionManager
+from scripts.helpful_scripts import get_account
+from web3 import Web3
+import asyncio
+
+
+def test_manager_dispatches_events_of_several_contracts(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    first_staking_monitor = deploy_staking_monitor_contract
+    second_staking_monitor = StakingMonitor.deploy(
+        first_staking_monitor.priceFeed(),
+        first_staking_monitor.DAIToken(),
+        first_staking_monitor.uniswap(),
+        first_staking_monitor.interval(),
+        {"from": get_account()},
+    )
+    value = Web3.toWei(0.01, "ether")
+
+    async def collect_events():
+        manager = EventSubscriptionManager(poll_interval=0.1)
+        deposits = manager.subscribe(first_staking_monitor, ["Deposited"])
+        orders = manager.subscribe(second_staking_monitor, ["OrderSet"])
+        await manager.poll()
+        # Act
+        first_staking_monitor.deposit({"from": get_account(2), "value": value})
+        second_staking_monitor.deposit({"from": get_account(3), "value": value})
+        second_staking_monitor.setOrder(2000, 40, {"from": get_account(3)})
+        await manager.poll()
+        await manager.stop()
+        return [event async for event in deposits], [event async for event in orders]
+
+    deposits, orders = asyncio.run(collect_events())
+
+    # Assert
+    assert [event["args"]["user"] for event in deposits] == [get_account(2).address]
+    assert [event["args"]["user"] for event in orders] == [get_account(3).address]
@@ -0,0 +1,313 @@
+from brownie import chain, exceptions, web3
+from eth_abi import encode_abi
+import json
+import os
+import pytest
+import warnings
+
+from scripts.gas_profiler import get_memory_gas
+from scripts.helpful_scripts import (
+    create_funded_accounts,
+    get_account,
+    get_contract,
+)
+from web3 import Web3
+
+# run with:
+# brownie test tests/test_gas_benchmark.py --gas-benchmark
+# and add --update-gas-baseline to store the results as the new baseline
+USER_COUNTS = [1, 10, 100, 500, 1000]
+ENTRY_POINTS = [
+    "deposit",
+    "setOrder",
+    "withdrawETH",
+    "withdrawDAI",
+    "setBalancesToSwap",
+    "checkConditionsAndPerformSwap",
+    "performUpkeep",
+    "paginated performUpkeep",
+]
+# swap passes whose memory expansion gas is recorded, see test_memory_gas_of_swap_passes
+# and test_memory_gas_of_swap_across_price_buckets
+MEMORY_GAS_ENTRY_POINTS = [
+    "checkConditionsAndPerformSwap memory",
+    "paginated performUpkeep memory",
+]
+PRICE_BUCKETS_MEMORY_GAS_ENTRY_POINTS = [
+    "checkConditionsAndPerformSwap memory, one order per price limit",
+]
+PAGINATED_MODE = 0
+# users per slice of the paginated upkeeps, small enough for a slice to fit in a block of the local chain
+PAGINATED_SLICE_SIZE = 100
+# each synthetic user is funded with enough for their deposit and the gas of their transactions, so that
+# the largest case only needs about 50 ether from the funding account
+USER_FUNDING = Web3.toWei(0.05, "ether")
+USER_DEPOSIT = Web3.toWei(0.02, "ether")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def require_gas_benchmark_option(request):
+    if not request.config.getoption("--gas-benchmark"):
+        pytest.skip("gas benchmarks only run with --gas-benchmark")
+
+
+@pytest.fixture(scope="module")
+def gas_baseline(request):
+    baseline_path = request.config.getoption("--gas-baseline")
+    if not os.path.exists(baseline_path):
+        return {}
+    with open(baseline_path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def write_json(path, data):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as json_file:
+        json.dump(data, json_file, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope="module")
+def gas_report(request, gas_baseline):
+    # {user_count: {entry_point: gas_used}}
+    report = {}
+    yield report
+    if not report:
+        return
+    write_json(request.config.getoption("--gas-report"), report)
+    if request.config.getoption("--update-gas-baseline"):
+        # user counts that were not run keep their previous baseline
+        write_json(
+            request.config.getoption("--gas-baseline"), {**gas_baseline, **report}
+        )
+        return
+    # the entry points without a baseline are recorded, and the existing baseline is kept as it is
+    missing = {
+        user_count: {
+            entry_point: gas_used
+            for entry_point, gas_used in entry_points.items()
+            if entry_point not in gas_baseline.get(user_count, {})
+        }
+        for user_count, entry_points in report.items()
+    }
+    if any(missing.values()):
+        write_json(
+            request.config.getoption("--gas-baseline"),
+            {
+                user_count: {
+                    **gas_baseline.get(user_count, {}),
+                    **missing.get(user_count, {}),
+                }
+                for user_count in {*gas_baseline, *missing}
+            },
+        )
+
+
+def populate_staking_monitor(
+    staking_monitor, user_count, price_limit=None, price_limits=None
+):
+    users = create_funded_accounts(user_count, USER_FUNDING)
+    if price_limit is None:
+        # setOrder adds 8 decimals to the price limit, and getPrice already has them, so the price limits
+        # are far above the price: nothing is swapped, and the gas used doesn't depend on the uniswap mock.
+        # Their price bucket is above the bucket of the price, so the swap pass doesn't visit the users
+        price_limit = staking_monitor.getPrice()
+    if price_limits is None:
+        price_limits = [price_limit] * user_count
+    gas_used = {}
+    for user, user_price_limit in zip(users, price_limits):
+        deposit_tx = staking_monitor.deposit({"from": user, "value": USER_DEPOSIT})
+        set_order_tx = staking_monitor.setOrder(user_price_limit, 40, {"from": user})
+    # we keep the gas used by the last user, who joins a watchlist of user_count - 1 users
+    gas_used["deposit"] = deposit_tx.gas_used
+    gas_used["setOrder"] = set_order_tx.gas_used
+    return users, gas_used
+
+
+def distribute_rewards(users):
+    rewards_distributor = get_account(1)
+    for user in users:
+        rewards_distributor.transfer(user, Web3.toWei(0.001, "ether"))
+
+
+def fits_in_a_block(contract_function, *args):
+    """Returns True if a call to contract_function needs less gas than the block gas limit of the local chain.
+    The single transaction entry points go through the whole watchlist, so they don't fit with the largest ones.
+    """
+    gas_limit = web3.eth.get_block("latest")["gasLimit"]
+    try:
+        # brownie returns the block gas limit itself for a reverting transaction when
+        # reverting_tx_gas_limit is "max", so it doesn't fit either
+        return contract_function.estimate_gas(*args) < gas_limit
+    except (ValueError, exceptions.VirtualMachineError):
+        return False
+
+
+def perform_paginated_upkeep(staking_monitor):
+    """Performs a whole round of paginated upkeeps, in slices of PAGINATED_SLICE_SIZE users, and returns their transactions."""
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    check_data = encode_abi(
+        ["uint8", "uint256"], [PAGINATED_MODE, PAGINATED_SLICE_SIZE]
+    )
+    txs = []
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    while upkeep_needed:
+        txs.append(staking_monitor.performUpkeep(perform_data, {"from": get_account()}))
+        upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+            check_data, {"from": get_account()}
+        )
+    return txs
+
+
+def set_balances_to_swap_without_swapping(staking_monitor):
+    """Updates the balance to swap of every user with a paginated upkeep round, as setBalancesToSwap doesn't fit
+    in a block with the largest watchlists. The price is under every price limit during the round, so that its
+    last slice doesn't swap, and is set back afterwards."""
+    price_feed = get_contract("eth_usd_price_feed")
+    price = staking_monitor.getPrice()
+    price_feed.updateAnswer(1, {"from": get_account()})
+    perform_paginated_upkeep(staking_monitor)
+    price_feed.updateAnswer(price, {"from": get_account()})
+
+
+@pytest.mark.parametrize("user_count", USER_COUNTS)
+def test_gas_used_by_entry_points(
+    deploy_staking_monitor_contract, user_count, gas_report, gas_baseline, request
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users, gas_used = populate_staking_monitor(staking_monitor, user_count)
+
+    # Act
+    # the single transaction entry points are only measured when they fit in a block
+    distribute_rewards(users)
+    if fits_in_a_block(staking_monitor.setBalancesToSwap, {"from": get_account()}):
+        gas_used["setBalancesToSwap"] = staking_monitor.setBalancesToSwap(
+            {"from": get_account()}
+        ).gas_used
+    gas_used["checkConditionsAndPerformSwap"] = (
+        staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    ).gas_used
+
+    distribute_rewards(users)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    if fits_in_a_block(staking_monitor.performUpkeep, "", {"from": get_account()}):
+        gas_used["performUpkeep"] = staking_monitor.performUpkeep(
+            "", {"from": get_account()}
+        ).gas_used
+
+    # the largest slice of a paginated round, which is what a keeper has to fit in a block
+    distribute_rewards(users)
+    gas_used["paginated performUpkeep"] = max(
+        tx.gas_used for tx in perform_paginated_upkeep(staking_monitor)
+    )
+
+    gas_used["withdrawETH"] = staking_monitor.withdrawETH(
+        Web3.toWei(0.01, "ether"), {"from": users[-1]}
+    ).gas_used
+    gas_used["withdrawDAI"] = staking_monitor.withdrawDAI(
+        0, {"from": users[-1]}
+    ).gas_used
+    gas_report.setdefault(str(user_count), {}).update(gas_used)
+
+    # Assert
+    assert_no_regressions(gas_used, ENTRY_POINTS, user_count, gas_baseline, request)
+
+
+@pytest.mark.parametrize("user_count", USER_COUNTS)
+def test_memory_gas_of_swap_passes(
+    deploy_staking_monitor_contract, user_count, gas_report, gas_baseline, request
+):
+    """Records the memory expansion gas of the swap passes when every user takes part in the swap.
+    The users are all in the same price bucket, whose pool is swapped as a whole, so it doesn't grow
+    with the number of participants."""
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users, _ = populate_staking_monitor(staking_monitor, user_count, price_limit=1)
+    gas_used = {}
+
+    # Act
+    distribute_rewards(users)
+    set_balances_to_swap_without_swapping(staking_monitor)
+    tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    gas_used["checkConditionsAndPerformSwap memory"] = get_memory_gas(tx.txid)
+
+    # the last slice of the round performs the swap
+    distribute_rewards(users)
+    gas_used["paginated performUpkeep memory"] = max(
+        get_memory_gas(upkeep_tx.txid)
+        for upkeep_tx in perform_paginated_upkeep(staking_monitor)
+    )
+    gas_report.setdefault(str(user_count), {}).update(gas_used)
+
+    # Assert
+    assert tx.events["SwapBatch"]["_totalETHSwapped"] > 0
+    assert_no_regressions(
+        gas_used, MEMORY_GAS_ENTRY_POINTS, user_count, gas_baseline, request
+    )
+
+
+@pytest.mark.parametrize("user_count", USER_COUNTS)
+def test_memory_gas_of_swap_across_price_buckets(
+    deploy_staking_monitor_contract, user_count, gas_report, gas_baseline, request
+):
+    """Records the memory expansion gas of a swap when every user takes part in it with a different
+    price limit. The SwapBatch event has one word per price bucket swapped, so it grows linearly with
+    the number of buckets, which is at most PRICE_BUCKET_COUNT, not with the number of participants.
+    """
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    # the price limits from 1 to user_count are all under the price, and fill about
+    # 64 buckets per power of two
+    price_limits = range(1, user_count + 1)
+    users, _ = populate_staking_monitor(
+        staking_monitor, user_count, price_limits=price_limits
+    )
+    gas_used = {}
+
+    # Act
+    distribute_rewards(users)
+    set_balances_to_swap_without_swapping(staking_monitor)
+    tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    gas_used[PRICE_BUCKETS_MEMORY_GAS_ENTRY_POINTS[0]] = get_memory_gas(tx.txid)
+    gas_report.setdefault(str(user_count), {}).update(gas_used)
+
+    # Assert
+    assert len(tx.events["SwapBatch"]["_priceBuckets"]) == len(
+        {staking_monitor.getPriceBucket(limit * 10**8) for limit in price_limits}
+    )
+    assert_no_regressions(
+        gas_used,
+        PRICE_BUCKETS_MEMORY_GAS_ENTRY_POINTS,
+        user_count,
+        gas_baseline,
+        request,
+    )
+
+
+def assert_no_regressions(gas_used, entry_points, user_count, gas_baseline, request):
+    tolerance = request.config.getoption("--gas-tolerance")
+    baseline = gas_baseline.get(str(user_count), {})
+    if not request.config.getoption("--update-gas-baseline"):
+        # an entry point without a baseline isn't checked, its gas used is recorded as its baseline by gas_report
+        missing = [
+            entry_point
+            for entry_point in entry_points
+            if entry_point in gas_used and entry_point not in baseline
+        ]
+        if missing:
+            warnings.warn(
+                f"no gas baseline with {user_count} users for {missing}, their gas used is recorded as the baseline"
+            )
+    regressions = [
+        f"{entry_point}: {gas_used[entry_point]} > {baseline[entry_point]} (+{tolerance}%)"
+        for entry_point in entry_points
+        if entry_point in baseline
+        and entry_point in gas_used
+        and gas_used[entry_point] > baseline[entry_point] * (1 + tolerance / 100)
+    ]
+    assert not regressions, f"gas regressions with {user_count} users: {regressions}"
@@ -0,0 +1,30 @@
+from scripts.gas_comparison import compare_gas_reports, format_gas_comparison
+
+
+def test_compare_gas_reports_only_keeps_entry_points_of_both_reports():
+    # Arrange
+    before = {
+        "10": {"deposit": 100000, "setOrder": 50000, "performUpkeep": 400000},
+        "100": {"deposit": 100000},
+    }
+    after = {
+        "10": {"deposit": 80000, "setOrder": 50000},
+        "100": {"deposit": 90000},
+        "500": {"deposit": 90000},
+    }
+
+    # Act
+    rows = compare_gas_reports(before, after)
+
+    # Assert
+    assert rows == [
+        (10, "deposit", 100000, 80000, -20.0),
+        (10, "setOrder", 50000, 50000, 0.0),
+        (100, "deposit", 100000, 90000, -10.0),
+    ]
+    assert compare_gas_reports(before, after, [10], ["setOrder", "performUpkeep"]) == [
+        (10, "setOrder", 50000, 50000, 0.0)
+    ]
+    assert format_gas_comparison(rows[:1]).splitlines()[-1] == (
+        "| 10 | deposit | 100000 | 80000 | -20.0% |"
+    )
@@ -0,0 +1,65 @@
+from brownie import chain
+from scripts.gas_profiler import GasProfile, profile_transaction
+from scripts.helpful_scripts import get_account
+from web3 import Web3
+
+
+def test_call_gas_is_charged_to_the_callee():
+    # Arrange
+    callee = "0x" + "11" * 20
+    struct_logs = [
+        {"pc": 0, "op": "PUSH1", "gas": 1000, "gasCost": 3, "depth": 1, "stack": []},
+        {
+            "pc": 2,
+            "op": "CALL",
+            "gas": 997,
+            "gasCost": 900,
+            "depth": 1,
+            "stack": [callee, "0x64"],
+        },
+        {"pc": 0, "op": "SLOAD", "gas": 100, "gasCost": 2100, "depth": 2, "stack": []},
+        {"pc": 1, "op": "STOP", "gas": 50, "gasCost": 0, "depth": 2, "stack": []},
+        {"pc": 3, "op": "STOP", "gas": 297, "gasCost": 0, "depth": 1, "stack": []},
+    ]
+
+    # Act
+    profile = GasProfile(struct_logs, "Caller", contract_resolver=lambda address: None)
+
+    # Assert
+    assert profile.total_gas == 1000 - 297
+    # the CALL keeps the gas that was not used by the callee
+    assert profile.by_opcode["CALL"] == 997 - 297 - 50
+    assert profile.by_opcode["SLOAD"] == 50
+    assert profile.by_stack[f"Caller;{Web3.toChecksumAddress(callee)};SLOAD"] == 50
+
+
+def test_profile_upkeep(deploy_staking_monitor_contract, tmp_path):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(2)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    staking_monitor.setOrder(
+        staking_monitor.getPrice() / 10**8 - 1, 40, {"from": user}
+    ).wait(1)
+    get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    tx = staking_monitor.performUpkeep(b"", {"from": get_account()})
+    tx.wait(1)
+
+    # Act
+    profile = profile_transaction(tx, str(tmp_path))
+
+    # Assert
+    # the intrinsic gas of the transaction is not part of the trace
+    assert 0 < profile.total_gas < tx.gas_used
+    assert profile.by_function["StakingMonitor._setBalanceToSwap"] > 0
+    assert profile.by_opcode["SSTORE"] > 0
+    assert any(
+        line.startswith("contracts/StakingMonitor.sol:") for line in profile.by_line
+    )
+    with open(tmp_path / f"{tx.txid}.folded") as collapsed_file:
+        stacks = collapsed_file.read().splitlines()
+    assert all(stack.startswith("StakingMonitor") for stack in stacks)
+    assert sum(int(stack.rsplit(" ", 1)[1]) for stack in stacks) == profile.total_gas
+    assert (tmp_path / f"{tx.txid}.txt").read_text().startswith("Execution gas:")
@@ -0,0 +1,119 @@
+from brownie import chain, web3
+from scripts.gas_strategy import FeeHistoryGasStrategy
+from scripts.helpful_scripts import get_account
+import statistics
+
+GWEI = 10**9
+
+
+class SyntheticFeeHistory:
+    """A fee history where block b pays b gwei of priority fee over a base fee of 1 gwei + b wei,
+    and every fifth block is empty."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get_priority_fee(self, block):
+        return block * GWEI
+
+    def is_empty(self, block):
+        return block % 5 == 0
+
+    def __call__(self, block_count, newest_block, percentiles):
+        self.requests.append((block_count, newest_block))
+        blocks = range(newest_block - block_count + 1, newest_block + 1)
+        return {
+            "oldestBlock": blocks[0],
+            "baseFeePerGas": [GWEI + block for block in blocks]
+            + [GWEI + newest_block + 1],
+            "gasUsedRatio": [0 if self.is_empty(block) else 0.5 for block in blocks],
+            "reward": [
+                [0 if self.is_empty(block) else self.get_priority_fee(block)]
+                for block in blocks
+            ],
+        }
+
+    def get_expected_gas_price(self, window):
+        """Returns the gas price expected from the blocks requested so far."""
+        fetched_blocks = [
+            block
+            for block_count, newest_block in self.requests
+            for block in range(newest_block - block_count + 1, newest_block + 1)
+        ]
+        fees = [
+            self.get_priority_fee(block)
+            for block in fetched_blocks
+            if not self.is_empty(block)
+        ][-window:]
+        return GWEI + fetched_blocks[-1] + 1 + int(statistics.median(fees))
+
+
+def test_fee_history_strategy_keeps_a_rolling_window():
+    # Arrange
+    chain.mine(10)
+    fee_history = SyntheticFeeHistory()
+    strategy = FeeHistoryGasStrategy(window=4, fee_history=fee_history)
+    first_block = web3.eth.block_number
+
+    # Act
+    first_gas_price = strategy.get_gas_price()
+    # no block has been mined, the window is up to date
+    same_gas_price = strategy.get_gas_price()
+    chain.mine(3)
+    second_gas_price = strategy.get_gas_price()
+
+    # Assert
+    assert fee_history.requests == [(4, first_block), (3, first_block + 3)]
+    assert first_gas_price == same_gas_price
+    assert second_gas_price == fee_history.get_expected_gas_price(4)
+    fee_history.requests.pop()
+    assert first_gas_price == fee_history.get_expected_gas_price(4)
+
+
+def test_fee_history_strategy_is_a_brownie_gas_strategy():
+    # Arrange
+    chain.mine(10)
+    fee_history = SyntheticFeeHistory()
+    strategy = FeeHistoryGasStrategy(window=4, fee_history=fee_history)
+
+    # Act
+    tx = get_account().transfer(get_account(1), 1, gas_price=strategy)
+
+    # Assert
+    assert tx.gas_price == fee_history.get_expected_gas_price(4)
+
+
+def test_fee_history_strategy_falls_back_to_gas_price():
+    # Arrange
+    def unsupported_fee_history(block_count, newest_block, percentiles):
+        raise ValueError({"code": -32601, "message": "Method not found"})
+
+    strategy = FeeHistoryGasStrategy(fee_history=unsupported_fee_history)
+
+    # Act
+    gas_price = strategy.get_gas_price()
+
+    # Assert
+    assert gas_price == web3.eth.gas_price
+
+
+def test_fee_history_strategy_caps_the_max_fee():
+    # Arrange
+    chain.mine(10)
+    fee_history = SyntheticFeeHistory()
+    # under the base fee of the next block, which is over 1 gwei
+    max_gas_price = GWEI // 2
+    strategy = FeeHistoryGasStrategy(
+        window=4, fee_history=fee_history, max_gas_price=max_gas_price
+    )
+
+    # Act
+    max_fee = strategy.get_max_fee()
+    gas_price = strategy.get_gas_price()
+    priority_fee = strategy.get_priority_fee()
+
+    # Assert
+    assert strategy.next_base_fee > max_gas_price
+    assert max_fee == max_gas_price
+    assert gas_price == max_gas_price
+    assert priority_fee <= max_fee
@@ -0,0 +1,80 @@
+from brownie import (
+    DAIToken,
+    LinkToken,
+    MockV3Aggregator,
+    VRFCoordinatorMock,
+    chain,
+    history,
+)
+from brownie.network.transaction import TransactionReceipt
+import pytest
+from scripts.helpful_scripts import (
+    INITIAL_VALUE,
+    deploy_mocks,
+    forget_contract_handles,
+    get_account,
+    get_contract,
+    get_create_address,
+)
+
+
+@pytest.fixture(autouse=True)
+def isolation():
+    # the mocks deployed here must not replace the ones get_contract resolves in the next test modules
+    chain.snapshot()
+    yield
+    chain.revert()
+    forget_contract_handles()
+
+
+def test_get_create_address_matches_deployed_address():
+    # Arrange
+    account = get_account()
+    expected_address = get_create_address(account.address, account.nonce)
+    # Act
+    link_token = LinkToken.deploy({"from": account})
+    # Assert
+    assert link_token.address == expected_address
+
+
+def test_pipelined_deploy_mocks_honours_link_token_dependency():
+    # Act
+    deploy_mocks(pipelined=True)
+    # Assert
+    assert VRFCoordinatorMock[-1].LINK() == LinkToken[-1].address
+    assert MockV3Aggregator[-1].latestAnswer() == INITIAL_VALUE
+
+
+def test_deploy_mocks_forgets_the_memoized_handles():
+    # Arrange
+    previous_dai_token = get_contract("dai_token")
+    # Act
+    deploy_mocks(pipelined=True)
+    # Assert
+    assert get_contract("dai_token").address == DAIToken[-1].address
+    assert get_contract("dai_token").address != previous_dai_token.address
+
+
+def test_pipelined_deploy_mocks_submits_every_deployment_before_waiting(monkeypatch):
+    # Arrange
+    account = get_account()
+    first_nonce = account.nonce
+    # nonces of the deployments submitted when the first receipt is waited for
+    submitted_nonces = []
+    wait = TransactionReceipt.wait
+
+    def record_submitted_nonces(receipt, required_confs):
+        if not submitted_nonces:
+            submitted_nonces.extend(
+                tx.nonce
+                for tx in history.from_sender(account.address)
+                if tx.nonce >= first_nonce
+            )
+        return wait(receipt, required_confs)
+
+    monkeypatch.setattr(TransactionReceipt, "wait", record_submitted_nonces)
+    # Act
+    deploy_mocks(pipelined=True)
+    # Assert
+    # the six mocks, with consecutive nonces assigned up front
+    assert sorted(submitted_nonces) == list(range(first_nonce, first_nonce + 6))
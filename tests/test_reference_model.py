@@ -0,0 +1,87 @@
+from brownie import chain
+from scripts.helpful_scripts import get_account, get_contract
+from scripts.reference_model import (
+    StakingMonitorModel,
+    calculate_user_balance_to_swap,
+    calculate_users_balance_to_swap,
+)
+from scripts.snapshot import get_snapshot
+from web3 import Web3
+import numpy as np
+import random
+
+
+def test_balance_to_swap_matches_contract(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    rng = random.Random(0)
+    samples = [(10**18 + 99, 10**18, 37), (199, 0, 255), (0, 0, 0)] + [
+        (previous + rng.randrange(10**18), previous, rng.randrange(256))
+        for previous in [rng.randrange(10**18) for _ in range(10)]
+    ]
+
+    # Act
+    vectorized = calculate_users_balance_to_swap(
+        np.array([sample[0] for sample in samples], dtype=np.int64),
+        np.array([sample[1] for sample in samples], dtype=np.int64),
+        np.array([sample[2] for sample in samples], dtype=np.int64),
+    )
+
+    # Assert
+    for sample, amount in zip(samples, vectorized):
+        expected = staking_monitor.calculateUserBalanceToSwap(*sample)
+        assert calculate_user_balance_to_swap(*sample) == expected
+        assert amount == expected
+
+
+def test_model_matches_contract_over_upkeeps(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    price_feed = get_contract("eth_usd_price_feed")
+    rng = random.Random(0)
+    users = [get_account(index) for index in range(2, 10)]
+    # the local accounts hold more ether than an int64 can count in wei
+    model = StakingMonitorModel(dtype=object)
+    price = staking_monitor.getPrice()
+    for user in users:
+        value = Web3.toWei(rng.uniform(0.001, 0.01), "ether")
+        staking_monitor.deposit({"from": user, "value": value}).wait(1)
+        model.deposit(user.address, value, user.balance())
+        price_limit = int(price * rng.uniform(0.9, 1.1) / 10**8)
+        percentage_to_swap = rng.randint(0, 100)
+        staking_monitor.setOrder(price_limit, percentage_to_swap, {"from": user}).wait(
+            1
+        )
+        model.set_order(user.address, price_limit, percentage_to_swap)
+
+    for _ in range(4):
+        for user in users:
+            if rng.random() < 0.6:
+                get_account(1).transfer(user, Web3.toWei(rng.uniform(0, 0.02), "ether"))
+        price_feed.updateAnswer(
+            int(price * rng.uniform(0.9, 1.1)), {"from": get_account()}
+        ).wait(1)
+        chain.sleep(staking_monitor.interval() + 1)
+        chain.mine(1)
+
+        # Act
+        tx = staking_monitor.performUpkeep(b"", {"from": get_account()})
+        tx.wait(1)
+        swap = model.perform_upkeep(
+            [user.balance() for user in users], staking_monitor.getPrice()
+        )
+
+        # Assert
+        # the snapshot holds the settled data, so it includes the share of every participant of the swap
+        assert {
+            address: {
+                field: value
+                for field, value in data.items()
+                if field != "swapCheckpoint"
+            }
+            for address, data in get_snapshot(staking_monitor)["users"].items()
+        } == model.get_users()
+        event = tx.events["UpkeepPerformed"]
+        assert event["_swapParticipants"] == len(swap["participants"])
+        assert event["_totalETHSwapped"] == swap["total_amount_to_swap"]
+        assert event["_DAIReceived"] == swap["total_dai_from_swap"]
@@ -0,0 +1,36 @@
+from brownie import accounts
+from scripts.signer_session import SignerSession
+import time
+
+PRIVATE_KEY = "0x" + "42" * 32
+OTHER_PRIVATE_KEY = "0x" + "43" * 32
+
+
+def test_signer_is_only_unlocked_once():
+    # Arrange
+    session = SignerSession()
+    unlock = lambda: accounts.add(PRIVATE_KEY)
+
+    # Act
+    signers = [session.get(("from_key",), unlock) for _ in range(10)]
+
+    # Assert
+    assert session.unlock_count == 1
+    assert all(signer is signers[0] for signer in signers)
+
+
+def test_idle_signer_is_locked_again():
+    # Arrange
+    session = SignerSession(idle_timeout=0.05)
+    unlock = lambda: accounts.add(PRIVATE_KEY)
+    signer = session.get(("from_key",), unlock)
+
+    # Act
+    time.sleep(0.1)
+    session.get(("other",), lambda: accounts.add(OTHER_PRIVATE_KEY))
+
+    # Assert
+    # the idle signer is also dropped from brownie's accounts
+    assert signer.address not in accounts
+    assert session.get(("from_key",), unlock).address == signer.address
+    assert session.unlock_count == 3
@@ -1,4 +1,5 @@
-from brownie import exceptions, StakingMonitor, network
+from brownie import exceptions, StakingMonitor, network, chain
+from eth_abi import encode_abi, decode_abi
 import pytest
 import math
 
@@ -7,29 +8,10 @@ from scripts.helpful_scripts import (
     get_contract,
     LOCAL_BLOCKCHAIN_ENVIRONMENTS,
 )
+from scripts.swap_batches import expand_swap_batch, get_swapped_records_from_events
 from web3 import Web3
 
 
-@pytest.fixture
-def deploy_staking_monitor_contract():
-    # Arrange / Act
-    interval = 3 * 60  # 3 minutes in seconds
-    staking_monitor = StakingMonitor.deploy(
-        get_contract("eth_usd_price_feed").address,
-        get_contract("dai_token").address,
-        get_contract("uniswap_v2").address,
-        interval,
-        {"from": get_account()},
-    )
-    block_confirmations = 6
-    if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
-        block_confirmations = 1
-    staking_monitor.tx.wait(block_confirmations)
-    # Assert
-    assert staking_monitor is not None
-    return staking_monitor
-
-
 def test_can_get_latest_price(deploy_staking_monitor_contract):
     # Arrange
     staking_monitor = deploy_staking_monitor_contract
@@ -185,12 +167,13 @@ def test_get_user_data(deploy_staking_monitor_contract):
     # struct userData {
     #     bool created;
     #     bool enoughDepositForSwap;
-    #     uint256 depositBalance;
-    #     uint256 DAIBalance;
-    #     uint256 priceLimit;
-    #     uint256 percentageToSwap;
-    #     uint256 balanceToSwap;
-    #     uint256 previousBalance;
+    #     uint96 depositBalance;
+    #     uint128 DAIBalance;
+    #     uint128 priceLimit;
+    #     uint8 percentageToSwap;
+    #     uint96 balanceToSwap;
+    #     uint96 previousBalance;
+    #     uint32 swapCheckpoint;
     # }
 
     userData = staking_monitor.getUserData({"from": get_account()})
@@ -203,6 +186,7 @@ def test_get_user_data(deploy_staking_monitor_contract):
     assert userData[5] == 40
     assert userData[6] == 0
     assert userData[7] == get_account().balance()
+    assert userData[8] == 0
 
     # when user hasn't deposited yet
     userData = staking_monitor.getUserData({"from": get_account(8)})
@@ -210,6 +194,47 @@ def test_get_user_data(deploy_staking_monitor_contract):
     assert userData[0] == False
 
 
+def test_get_users_data(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+
+    # Act
+    first_addresses, first_users_data = staking_monitor.getUsersData(0, 2)
+    last_addresses, last_users_data = staking_monitor.getUsersData(2, 2)
+    empty_addresses, empty_users_data = staking_monitor.getUsersData(5, 2)
+
+    # Assert
+    assert staking_monitor.getWatchListLength() == 3
+    assert list(first_addresses) + list(last_addresses) == [
+        user.address for user in users
+    ]
+    for user, user_data in zip(users, list(first_users_data) + list(last_users_data)):
+        assert user_data == staking_monitor.s_users(user.address)
+    assert len(empty_addresses) == 0
+    assert len(empty_users_data) == 0
+
+
+def test_set_order_reverts_if_percentage_does_not_fit_in_user_data(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    deposit_tx = staking_monitor.deposit(
+        {"from": get_account(), "value": Web3.toWei(0.01, "ether")}
+    )
+    deposit_tx.wait(1)
+    # Act & Assert
+    # percentageToSwap is stored as a uint8
+    with pytest.raises(exceptions.VirtualMachineError):
+        set_order_tx = staking_monitor.setOrder(2000, 256, {"from": get_account()})
+        set_order_tx.wait(1)
+
+
 def test_set_order_if_user_has_not_deposited_reverts(
     deploy_staking_monitor_contract,
 ):
@@ -337,19 +362,21 @@ def test_set_balances_to_swap_accrues(deploy_staking_monitor_contract):
     ) + (second_reward_amount * percentage_to_swap / 100)
 
 
-# this test fails currently, because the uniswapv2 mock seems to have an issue with it - mocking what it returns in the contract however makes the whole test pass...
-# please see our stackexchange question here for more info: https://ethereum.stackexchange.com/questions/128720/mocking-and-testing-uniswapv2s-swapexactethfortokens-in-brownie-virtualmachine
 def test_swap_eth_for_dai(deploy_staking_monitor_contract):
+    # Arrange
     amount_to_swap = Web3.toWei(0.02, "ether")
     staking_monitor = deploy_staking_monitor_contract
-    dai_from_swap = staking_monitor.swapEthForDAI(
+    # the ETH swapped comes from the contract's balance
+    staking_monitor.deposit({"from": get_account(), "value": amount_to_swap}).wait(1)
+    # Act
+    dai_from_swap = staking_monitor.swapEthForDAI.call(
         amount_to_swap, {"from": get_account()}
     )
-    assert dai_from_swap == 230000000000000
+    # Assert
+    # the uniswap mock returns the same amount of DAI for any swap
+    assert dai_from_swap == Web3.toWei(2000000000, "ether")
 
 
-# this test fails currently, because the uniswapv2 mock seems to have an issue with it - mocking what it returns in the contract however makes the whole test pass...
-# please see our stackexchange question here for more info: https://ethereum.stackexchange.com/questions/128720/mocking-and-testing-uniswapv2s-swapexactethfortokens-in-brownie-virtualmachine
 def test_check_conditions_and_perform_swap(deploy_staking_monitor_contract):
     # Arrange
     staking_monitor = deploy_staking_monitor_contract
@@ -433,27 +460,170 @@ def test_check_conditions_and_perform_swap(deploy_staking_monitor_contract):
         < current_price
     )
 
-    first_user_dai_distributed = staking_monitor.s_users(first_user_account.address)[
-        "DAIBalance"
+    # the users of the bucket of the price are credited by the swap itself, the other ones when they are settled
+    first_user_dai_distributed = staking_monitor.getDAIBalance(
+        {"from": first_user_account}
+    )
+
+    second_user_dai_distributed = staking_monitor.getDAIBalance(
+        {"from": second_user_account}
+    )
+
+    dai_from_swap = staking_monitor.s_swapRounds(staking_monitor.s_swapRoundCount())[
+        "totalDAIFromSwap"
     ]
+    # the shares are computed from the DAI received per ETH swapped, at most 1 wei under the exact pro rata shares
+    precision = staking_monitor.DAI_PER_ETH_PRECISION()
+    dai_per_eth = dai_from_swap * precision // total_amount_to_swap
+    assert (
+        first_user_dai_distributed
+        == first_user_balance_to_swap * dai_per_eth // precision
+    )
+    assert (
+        second_user_dai_distributed
+        == second_user_balance_to_swap * dai_per_eth // precision
+    )
+    for user_dai_distributed, user_balance_to_swap in [
+        (first_user_dai_distributed, first_user_balance_to_swap),
+        (second_user_dai_distributed, second_user_balance_to_swap),
+    ]:
+        pro_rata_share = dai_from_swap * user_balance_to_swap // total_amount_to_swap
+        assert pro_rata_share - 1 <= user_dai_distributed <= pro_rata_share
+    # balanceToSwap
+    assert staking_monitor.getUserData({"from": first_user_account})[6] == 0
+    assert [
+        record["_DAIReceived"]
+        for record in get_swapped_records_from_events(tx.events["SwapSettled"])
+    ] == [
+        first_user_dai_distributed,
+        second_user_dai_distributed,
+    ]
+
 
-    second_user_dai_distributed = staking_monitor.s_users(second_user_account.address)[
-        "DAIBalance"
+def test_swap_of_a_price_bucket_pool_is_settled_when_user_withdraws_dai(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(5)
+    deposit_value = Web3.toWei(0.01, "ether")
+    staking_monitor.deposit({"from": user, "value": deposit_value}).wait(1)
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    # a price limit far under the price, so that the pool of the user's bucket is swapped without visiting them
+    staking_monitor.setOrder(current_price // 2 // 100000000, 40, {"from": user}).wait(
+        1
+    )
+    get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    user_data = staking_monitor.s_users(user.address)
+    balance_to_swap = user_data["balanceToSwap"]
+    price_bucket = staking_monitor.getPriceBucket(user_data["priceLimit"])
+
+    # Act
+    swap_tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    swap_tx.wait(1)
+
+    # Assert
+    precision = staking_monitor.DAI_PER_ETH_PRECISION()
+    dai_from_swap = staking_monitor.s_swapRounds(1)["totalDAIFromSwap"]
+    dai_received = (
+        balance_to_swap * (dai_from_swap * precision // balance_to_swap) // precision
+    )
+    assert "SwapSettled" not in swap_tx.events
+    assert expand_swap_batch(swap_tx.events["SwapBatch"]["_priceBuckets"]) == [
+        {"priceBucket": price_bucket, "ETHSwapped": balance_to_swap}
     ]
+    assert staking_monitor.s_priceBucketSwaps(price_bucket, 0)["swapRound"] == 1
+    # the swap didn't write to the user's data, only the settled view includes it
+    assert staking_monitor.s_users(user.address)["swapCheckpoint"] == 1
+    assert staking_monitor.s_users(user.address)["DAIBalance"] == 0
+    assert staking_monitor.getDAIBalance({"from": user}) == dai_received
+    settled_user_data = staking_monitor.getSettledUserData(user.address)
+    assert settled_user_data["DAIBalance"] == dai_received
+    assert settled_user_data["depositBalance"] == deposit_value - balance_to_swap
+    assert settled_user_data["balanceToSwap"] == 0
+    assert settled_user_data["swapCheckpoint"] == 0
+
+    # the user is credited as soon as they withdraw, the mock swap doesn't send any DAI to the contract
+    withdraw_tx = staking_monitor.withdrawDAI(0, {"from": user})
+    withdraw_tx.wait(1)
+    assert get_swapped_records_from_events(withdraw_tx.events["SwapSettled"]) == [
+        {
+            "_address": user.address,
+            "_totalReward": balance_to_swap,
+            "_setPriceLimit": user_data["priceLimit"],
+            "_DAIReceived": dai_received,
+            "swapRound": 1,
+        }
+    ]
+    assert staking_monitor.s_users(user.address) == settled_user_data
 
-    total_dai_distributed = first_user_dai_distributed + second_user_dai_distributed
 
-    what_first_user_dai_share_should_be = (
-        total_dai_distributed * first_user_balance_to_swap
-    ) / total_amount_to_swap
+def test_price_bucket_pool_shares_follow_the_cumulative_index(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(5), get_account(6)]
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.05, "ether")}
+        ).wait(1)
+        # both users are in the same pool, far under the price
+        staking_monitor.setOrder(
+            current_price // 2 // 100000000, 40, {"from": user}
+        ).wait(1)
+    rewards_distributor = get_account(1)
+    # only the first user takes part in the first swap
+    rewards_distributor.transfer(users[0], Web3.toWei(0.003, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    first_balance_to_swap = staking_monitor.s_users(users[0].address)["balanceToSwap"]
+    staking_monitor.checkConditionsAndPerformSwap({"from": get_account()}).wait(1)
+    # both users take part in the second one, the first user's first swap is settled when they get the reward
+    for user in users:
+        rewards_distributor.transfer(user, Web3.toWei(0.006, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    balances_to_swap = [
+        staking_monitor.s_users(user.address)["balanceToSwap"] for user in users
+    ]
 
-    what_second_user_dai_share_should_be = (
-        total_dai_distributed * second_user_balance_to_swap
-    ) / total_amount_to_swap
+    # Act
+    tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    tx.wait(1)
 
-    assert first_user_dai_distributed == round(what_first_user_dai_share_should_be)
-    assert second_user_dai_distributed == round(what_second_user_dai_share_should_be)
-    assert staking_monitor.s_users(first_user_account.address)["balanceToSwap"] == 0
+    # Assert
+    precision = staking_monitor.DAI_PER_ETH_PRECISION()
+    first_dai_per_eth = (
+        staking_monitor.s_swapRounds(1)["totalDAIFromSwap"]
+        * precision
+        // first_balance_to_swap
+    )
+    second_dai_per_eth = (
+        staking_monitor.s_swapRounds(2)["totalDAIFromSwap"]
+        * precision
+        // sum(balances_to_swap)
+    )
+    assert staking_monitor.getDAIBalance({"from": users[0]}) == (
+        first_balance_to_swap * first_dai_per_eth // precision
+        + balances_to_swap[0] * second_dai_per_eth // precision
+    )
+    assert (
+        staking_monitor.getDAIBalance({"from": users[1]})
+        == balances_to_swap[1] * second_dai_per_eth // precision
+    )
+    # both balances joined the pool after its first swap, so they were swapped in the second one
+    assert [
+        staking_monitor.s_users(user.address)["swapCheckpoint"] for user in users
+    ] == [2, 2]
+    assert (
+        staking_monitor.s_pendingETHPerPriceBucket(
+            staking_monitor.getPriceBucket(
+                staking_monitor.s_users(users[0].address)["priceLimit"]
+            )
+        )
+        == 0
+    )
 
 
 def test_can_call_check_upkeep(deploy_staking_monitor_contract):
@@ -519,3 +689,534 @@ def test_upkeep_not_needed(deploy_staking_monitor_contract):
     )
     assert upkeepNeeded == False
     assert isinstance(performData, bytes)
+
+
+def test_upkeep_needed_only_when_a_pending_swap_is_under_price(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(5)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    staking_monitor.setOrder(
+        (current_price - 200000) / 100000000, 40, {"from": user}
+    ).wait(1)
+    get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    # the reward is turned into a pending swap, so no balance changes are left to process
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    upkeep_needed, _ = staking_monitor.checkUpkeep.call("", {"from": get_account()})
+
+    # Assert
+    assert staking_monitor.s_pendingSwapCount() == 1
+    assert (
+        staking_monitor.getLowestPendingPriceLimit()
+        == staking_monitor.s_users(user.address)["priceLimit"]
+    )
+    assert staking_monitor.checkLowestLimitUnderCurrentPrice() == True
+    assert upkeep_needed == True
+
+    # once the swap is done, there is nothing left to do
+    staking_monitor.checkConditionsAndPerformSwap({"from": get_account()}).wait(1)
+    upkeep_needed, _ = staking_monitor.checkUpkeep.call("", {"from": get_account()})
+    assert staking_monitor.s_pendingSwapCount() == 0
+    assert staking_monitor.checkLowestLimitUnderCurrentPrice() == False
+    assert upkeep_needed == False
+
+
+def test_upkeep_needed_when_a_balance_decreases(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(5)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    # price limit above the current price, so that no swap takes place
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    staking_monitor.setOrder(current_price, 40, {"from": user}).wait(1)
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    user.transfer(get_account(1), Web3.toWei(0.005, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        "", {"from": get_account()}
+    )
+    staking_monitor.performUpkeep(perform_data, {"from": get_account()}).wait(1)
+    # a reward smaller than the decrease
+    reward_amount = Web3.toWei(0.002, "ether")
+    get_account(1).transfer(user, reward_amount)
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+
+    # Assert
+    assert upkeep_needed == True
+    # the reward is counted from the balance recorded after the decrease
+    assert staking_monitor.s_users(user.address)["balanceToSwap"] == reward_amount * (
+        40 / 100
+    )
+
+
+def test_paginated_upkeep_processes_watchlist_in_slices(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    percentage_to_swap = 40
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        # price limit above the current price, so that no swap takes place
+        staking_monitor.setOrder(
+            current_price, percentage_to_swap, {"from": user}
+        ).wait(1)
+    rewards_distributor = get_account(1)
+    reward_amount = Web3.toWei(0.01, "ether")
+    for user in users:
+        rewards_distributor.transfer(user, reward_amount)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # Paginated mode, slices of 2 users
+    check_data = encode_abi(["uint8", "uint256"], [0, 2])
+
+    # Act
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    assert upkeep_needed == True
+    mode, payload = decode_abi(["uint8", "bytes"], perform_data)
+    assert mode == 0
+    assert decode_abi(["uint256", "uint256"], payload) == (0, 2)
+    staking_monitor.performUpkeep(perform_data, {"from": get_account()}).wait(1)
+
+    # Assert
+    assert staking_monitor.s_watchListCursor() == 2
+    assert staking_monitor.s_users(users[1].address)[
+        "balanceToSwap"
+    ] == reward_amount * (percentage_to_swap / 100)
+    assert staking_monitor.s_users(users[2].address)["balanceToSwap"] == 0
+
+    # the round is still in progress, so the upkeep is needed even though the interval was reset
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    assert upkeep_needed == True
+    _, payload = decode_abi(["uint8", "bytes"], perform_data)
+    assert decode_abi(["uint256", "uint256"], payload) == (2, 3)
+    staking_monitor.performUpkeep(perform_data, {"from": get_account()}).wait(1)
+
+    assert staking_monitor.s_watchListCursor() == 0
+    assert staking_monitor.s_users(users[2].address)[
+        "balanceToSwap"
+    ] == reward_amount * (percentage_to_swap / 100)
+    upkeep_needed, _ = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    assert upkeep_needed == False
+
+
+def test_paginated_upkeep_reverts_if_range_does_not_start_at_cursor(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    for user in [get_account(2), get_account(3)]:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act & Assert
+    with pytest.raises(exceptions.VirtualMachineError):
+        staking_monitor.performUpkeep(
+            encode_abi(
+                ["uint8", "bytes"], [0, encode_abi(["uint256", "uint256"], [1, 2])]
+            ),
+            {"from": get_account()},
+        ).wait(1)
+
+
+def test_paginated_upkeep_reverts_if_slice_is_empty(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    staking_monitor.deposit(
+        {"from": get_account(2), "value": Web3.toWei(0.01, "ether")}
+    ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    last_time_stamp = staking_monitor.lastTimeStamp()
+
+    # Act & Assert
+    with pytest.raises(exceptions.VirtualMachineError):
+        staking_monitor.performUpkeep(
+            encode_abi(
+                ["uint8", "bytes"], [0, encode_abi(["uint256", "uint256"], [0, 0])]
+            ),
+            {"from": get_account()},
+        ).wait(1)
+    assert staking_monitor.lastTimeStamp() == last_time_stamp
+
+
+def test_paginated_upkeep_swaps_once_with_the_last_slice(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3)]
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        # price limit under the current price, so that the rewards are swapped
+        staking_monitor.setOrder(
+            (current_price - 200000) / 100000000, 40, {"from": user}
+        ).wait(1)
+        get_account(1).transfer(user, Web3.toWei(0.01, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # Paginated mode, slices of 1 user
+    check_data = encode_abi(["uint8", "uint256"], [0, 1])
+
+    # Act
+    _, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    first_tx = staking_monitor.performUpkeep(perform_data, {"from": get_account()})
+    first_tx.wait(1)
+    _, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    last_tx = staking_monitor.performUpkeep(perform_data, {"from": get_account()})
+    last_tx.wait(1)
+
+    # Assert
+    # the first slice only adds its user's balance to the swap pool of their price bucket
+    assert "SwapBatch" not in first_tx.events
+    assert first_tx.events["UpkeepPerformed"]["_swapParticipants"] == 0
+    # the last slice swaps the balances of the whole round at once
+    assert last_tx.events["SwapBatch"]["_swapRound"] == 1
+    assert last_tx.events["UpkeepPerformed"]["_swapParticipants"] == 2
+    assert staking_monitor.s_swapRoundCount() == 1
+    assert staking_monitor.s_pendingSwapCount() == 0
+
+
+def test_users_to_update_upkeep_only_touches_users_with_changes(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    percentage_to_swap = 40
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        # price limit above the current price, so that no swap takes place
+        staking_monitor.setOrder(
+            current_price, percentage_to_swap, {"from": user}
+        ).wait(1)
+    # only the second user receives a reward
+    reward_amount = Web3.toWei(0.01, "ether")
+    get_account(1).transfer(users[1], reward_amount)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # UsersToUpdate mode
+    check_data = encode_abi(["uint8", "uint256"], [1, 0])
+
+    # Act
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    assert upkeep_needed == True
+    mode, payload = decode_abi(["uint8", "bytes"], perform_data)
+    assert mode == 1
+    assert decode_abi(["uint256[]"], payload) == ((0b010,),)
+    staking_monitor.performUpkeep(perform_data, {"from": get_account()}).wait(1)
+
+    # Assert
+    assert staking_monitor.s_users(users[1].address)[
+        "balanceToSwap"
+    ] == reward_amount * (percentage_to_swap / 100)
+    assert (
+        staking_monitor.s_users(users[1].address)["previousBalance"]
+        == users[1].balance()
+    )
+
+    # nothing changed since the last upkeep, so no upkeep is needed
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    upkeep_needed, _ = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    assert upkeep_needed == False
+
+
+def test_users_to_update_upkeep_skips_users_removed_since_check_upkeep(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3)]
+    deposit_value = Web3.toWei(0.01, "ether")
+    for user in users:
+        staking_monitor.deposit({"from": user, "value": deposit_value}).wait(1)
+        get_account(1).transfer(user, Web3.toWei(0.01, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # UsersToUpdate mode
+    _, perform_data = staking_monitor.checkUpkeep.call(
+        encode_abi(["uint8", "uint256"], [1, 0]), {"from": get_account()}
+    )
+    _, payload = decode_abi(["uint8", "bytes"], perform_data)
+    assert decode_abi(["uint256[]"], payload) == ((0b11,),)
+    # the last user empties their account, and is removed from the watchlist,
+    # so the second bit of the bitmap now points past the end of the watchlist
+    staking_monitor.withdrawETH(deposit_value, {"from": users[1]}).wait(1)
+    assert staking_monitor.getWatchListLength() == 1
+
+    # Act
+    tx = staking_monitor.performUpkeep(perform_data, {"from": get_account()})
+    tx.wait(1)
+
+    # Assert
+    assert tx.events["UpkeepPerformed"]["_usersScanned"] == 1
+    assert (
+        staking_monitor.s_users(users[0].address)["previousBalance"]
+        == users[0].balance()
+    )
+
+
+def test_users_to_update_upkeep_swaps_pending_swaps_without_listing_their_users(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = get_account(2)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    # price limit above the current price, so that the reward waits in the swap pool of its price bucket
+    current_price = staking_monitor.getPrice({"from": get_account()})
+    staking_monitor.setOrder(current_price, 40, {"from": user}).wait(1)
+    get_account(1).transfer(user, Web3.toWei(0.01, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    get_contract("eth_usd_price_feed").updateAnswer(
+        current_price * 100000000 * 2, {"from": get_account()}
+    ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        encode_abi(["uint8", "uint256"], [1, 0]), {"from": get_account()}
+    )
+    _, payload = decode_abi(["uint8", "bytes"], perform_data)
+    tx = staking_monitor.performUpkeep(perform_data, {"from": get_account()})
+    tx.wait(1)
+
+    # Assert
+    # the user's address balance didn't change, so the bitmap is empty, but their pending swap makes the upkeep needed
+    assert decode_abi(["uint256[]"], payload) == ((0,),)
+    assert upkeep_needed == True
+    assert tx.events["UpkeepPerformed"]["_usersScanned"] == 0
+    assert tx.events["UpkeepPerformed"]["_swapParticipants"] == 1
+    assert staking_monitor.s_pendingSwapCount() == 0
+
+
+def test_changed_users_upkeep_only_touches_listed_users(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+    reward_amount = Web3.toWei(0.01, "ether")
+    get_account(1).transfer(users[1], reward_amount)
+    get_account(1).transfer(users[2], reward_amount)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # ChangedUsers mode
+    check_data = encode_abi(["uint8", "uint256"], [2, 0])
+
+    # Act
+    upkeep_needed, perform_data = staking_monitor.checkUpkeep.call(
+        check_data, {"from": get_account()}
+    )
+    mode, payload = decode_abi(["uint8", "bytes"], perform_data)
+    (changed_users,) = decode_abi(["address[]"], payload)
+    staking_monitor.performUpkeep(perform_data, {"from": get_account()}).wait(1)
+
+    # Assert
+    assert upkeep_needed == True
+    assert mode == 2
+    assert list(changed_users) == sorted(
+        [users[1].address.lower(), users[2].address.lower()],
+        key=lambda address: int(address, 16),
+    )
+    assert (
+        staking_monitor.s_users(users[0].address)["previousBalance"]
+        != users[0].balance()
+    )
+    for user in users[1:]:
+        assert (
+            staking_monitor.s_users(user.address)["previousBalance"] == user.balance()
+        )
+
+
+def test_changed_users_upkeep_reverts_if_addresses_are_not_sorted(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = sorted(
+        [get_account(2), get_account(3)], key=lambda user: int(user.address, 16)
+    )
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act & Assert
+    for addresses in [
+        [users[1].address, users[0].address],
+        [users[0].address, users[0].address],
+    ]:
+        with pytest.raises(exceptions.VirtualMachineError):
+            staking_monitor.performUpkeep(
+                encode_abi(
+                    ["uint8", "bytes"], [2, encode_abi(["address[]"], [addresses])]
+                ),
+                {"from": get_account()},
+            ).wait(1)
+
+
+def test_changed_users_upkeep_skips_users_removed_since_check_upkeep(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3)]
+    deposit_value = Web3.toWei(0.01, "ether")
+    for user in users:
+        staking_monitor.deposit({"from": user, "value": deposit_value}).wait(1)
+        get_account(1).transfer(user, Web3.toWei(0.01, "ether"))
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+    # ChangedUsers mode
+    _, perform_data = staking_monitor.checkUpkeep.call(
+        encode_abi(["uint8", "uint256"], [2, 0]), {"from": get_account()}
+    )
+    # the first user empties their account, and is removed from the watchlist
+    staking_monitor.withdrawETH(deposit_value, {"from": users[0]}).wait(1)
+
+    # Act
+    tx = staking_monitor.performUpkeep(perform_data, {"from": get_account()})
+    tx.wait(1)
+
+    # Assert
+    assert tx.events["UpkeepPerformed"]["_usersScanned"] == 1
+    assert staking_monitor.s_users(users[0].address)["created"] == False
+    assert (
+        staking_monitor.s_users(users[1].address)["previousBalance"]
+        == users[1].balance()
+    )
+
+
+def test_empty_account_is_removed_from_watchlist(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3), get_account(4)]
+    deposit_value = Web3.toWei(0.01, "ether")
+    for user in users:
+        staking_monitor.deposit({"from": user, "value": deposit_value}).wait(1)
+
+    # Act
+    tx = staking_monitor.withdrawETH(deposit_value, {"from": users[0]})
+    tx.wait(1)
+
+    # Assert
+    assert tx.events["RemovedFromWatchList"]["user"] == users[0].address
+    assert staking_monitor.getWatchListLength() == 2
+    # the last user is moved to the index of the removed one
+    assert staking_monitor.s_watchList(0) == users[2].address
+    assert staking_monitor.s_watchListIndex(users[2].address) == 0
+    assert staking_monitor.s_users(users[0].address)["created"] == False
+
+    # a new deposit adds the user back
+    staking_monitor.deposit({"from": users[0], "value": deposit_value}).wait(1)
+    assert staking_monitor.s_watchList(2) == users[0].address
+    assert staking_monitor.s_watchListIndex(users[0].address) == 2
+
+
+def test_upkeep_compacts_watchlist(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    # accounts without any deposit are only removed by the compaction pass
+    for user in [get_account(2), get_account(3)]:
+        staking_monitor.deposit({"from": user, "value": 0}).wait(1)
+    active_user = get_account(4)
+    staking_monitor.deposit(
+        {"from": active_user, "value": Web3.toWei(0.01, "ether")}
+    ).wait(1)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    tx = staking_monitor.performUpkeep(b"", {"from": get_account()})
+    tx.wait(1)
+
+    # Assert
+    assert len(tx.events["RemovedFromWatchList"]) == 2
+    assert staking_monitor.getWatchListLength() == 1
+    assert staking_monitor.s_watchList(0) == active_user.address
+    assert staking_monitor.s_compactionCursor() == 0
+
+
+def test_get_price_bucket(deploy_staking_monitor_contract):
+    staking_monitor = deploy_staking_monitor_contract
+    prices = [0, 1, 127, 128, 129, 255, 256, 10**8, 2000 * 10**26, 2**128 - 1]
+    buckets = [staking_monitor.getPriceBucket(price) for price in prices]
+    assert buckets[:5] == [0, 1, 127, 128, 128]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == staking_monitor.PRICE_BUCKET_COUNT() - 1
+
+
+def test_set_order_moves_user_between_price_buckets(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(2), get_account(3)]
+    for user in users:
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        staking_monitor.setOrder(1000, 40, {"from": user}).wait(1)
+    low_bucket = staking_monitor.getPriceBucket(1000 * 10**8)
+    high_bucket = staking_monitor.getPriceBucket(5000 * 10**8)
+
+    # Act
+    staking_monitor.setOrder(5000, 40, {"from": users[0]}).wait(1)
+
+    # Assert
+    # the last user of the bucket takes the place of the user who moved
+    assert staking_monitor.s_priceBuckets(low_bucket, 0) == users[1].address
+    assert staking_monitor.s_priceBucketIndex(users[1].address) == 1
+    assert staking_monitor.s_priceBuckets(high_bucket, 0) == users[0].address
+    assert staking_monitor.s_priceBucketIndex(users[0].address) == 1
+
+    # the last user of the bucket leaves it empty
+    staking_monitor.setOrder(5000, 40, {"from": users[1]}).wait(1)
+    assert staking_monitor.s_priceBuckets(high_bucket, 1) == users[1].address
+    assert staking_monitor.s_priceBucketIndex(users[1].address) == 2
@@ -0,0 +1,83 @@
+from scripts.helpful_scripts import get_account
+from scripts.staking_monitor_client import StakingMonitorClient
+from web3 import Web3
+
+
+def test_client_serves_repeated_calls_from_cache(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    client = StakingMonitorClient(staking_monitor, refresh_interval=0)
+
+    # Act
+    first_price = client.get_price()
+    second_price = client.get_price()
+
+    # Assert
+    assert first_price == second_price == staking_monitor.getPrice()
+    assert client.get_stats()["hits"] == 1
+    assert client.get_stats()["misses"] == 1
+
+
+def test_client_invalidates_cache_on_deposit(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    client = StakingMonitorClient(staking_monitor, refresh_interval=0)
+    user = get_account(2)
+    assert client.get_deposit_balance(user.address) == 0
+    value = Web3.toWei(0.01, "ether")
+
+    # Act
+    staking_monitor.deposit({"from": user, "value": value}).wait(1)
+
+    # Assert
+    assert client.get_deposit_balance(user.address) == value
+    assert client.get_stats()["misses"] == 2
+
+
+def test_client_evicts_least_recently_used_results(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    client = StakingMonitorClient(staking_monitor, max_size=2, refresh_interval=60)
+
+    # Act
+    client.get_user(get_account(2).address)
+    client.get_user(get_account(3).address)
+    client.get_user(get_account(2).address)
+    client.get_user(get_account(4).address)
+    client.get_user(get_account(2).address)
+    client.get_user(get_account(3).address)
+
+    # Assert
+    assert client.get_stats() == {
+        "hits": 2,
+        "misses": 4,
+        "hit_rate": 2 / 6,
+        "size": 2,
+        "max_size": 2,
+    }
+
+
+def test_client_get_user_includes_the_share_of_a_pool_swap(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    client = StakingMonitorClient(staking_monitor, refresh_interval=0)
+    user = get_account(2)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    # a price limit far under the price, so that the pool of the user's bucket is swapped without crediting them
+    current_price = staking_monitor.getPrice()
+    staking_monitor.setOrder(current_price // 2 // 100000000, 40, {"from": user}).wait(
+        1
+    )
+    get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+
+    # Act
+    staking_monitor.checkConditionsAndPerformSwap({"from": get_account()}).wait(1)
+    user_data = client.get_user(user.address)
+
+    # Assert
+    assert staking_monitor.s_users(user.address)["DAIBalance"] == 0
+    assert user_data["DAIBalance"] == staking_monitor.getDAIBalance({"from": user}) > 0
+    assert user_data["balanceToSwap"] == 0
@@ -0,0 +1,136 @@
+from brownie import web3
+from scripts.helpful_scripts import get_account
+from scripts.swap_batches import (
+    expand_swap_batch,
+    get_price_bucket,
+    get_swap_batches,
+    get_swap_round_participants,
+    get_swapped_records,
+    get_swapped_records_from_events,
+)
+from web3 import Web3
+
+
+def test_swap_settled_events_decode_into_swapped_records(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(5), get_account(6)]
+    current_price = staking_monitor.getPrice()
+    for user, percentage_to_swap in zip(users, [40, 55]):
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        # a price limit in the bucket of the price, so that the users are credited by the swap itself
+        staking_monitor.setOrder(
+            (current_price - 200000) / 100000000,
+            percentage_to_swap,
+            {"from": user},
+        ).wait(1)
+        get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    balances_to_swap = [
+        staking_monitor.s_users(user.address)["balanceToSwap"] for user in users
+    ]
+
+    # Act
+    tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    tx.wait(1)
+    records_from_events = get_swapped_records_from_events(tx.events["SwapSettled"])
+    records_from_logs = get_swapped_records(staking_monitor, tx.block_number)
+    swap_batches = get_swap_batches(staking_monitor, tx.block_number)
+
+    # Assert
+    assert len(tx.events["SwapBatch"]) == 1
+    assert tx.events["SwapBatch"]["_swapRound"] == 1
+    assert expand_swap_batch(tx.events["SwapBatch"]["_priceBuckets"]) == [
+        {
+            "priceBucket": staking_monitor.getPriceBucket(current_price),
+            "ETHSwapped": sum(balances_to_swap),
+        }
+    ]
+    # the timestamp and price of the swap are only in its SwapBatch event
+    assert [
+        {key: value for key, value in swap_batch.items() if key.startswith("_")}
+        for swap_batch in swap_batches
+    ] == [
+        {
+            "_timestamp": web3.eth.get_block(tx.block_number)["timestamp"],
+            "_ETHPrice": current_price,
+            "_totalETHSwapped": sum(balances_to_swap),
+            "_DAIReceived": tx.events["SwapBatch"]["_DAIReceived"],
+            "_priceBuckets": tuple(tx.events["SwapBatch"]["_priceBuckets"]),
+        }
+    ]
+    assert swap_batches[0]["swapRound"] == 1
+    assert records_from_events == [
+        {
+            "_address": user.address,
+            "_totalReward": balance_to_swap,
+            "_setPriceLimit": staking_monitor.s_users(user.address)["priceLimit"],
+            "_DAIReceived": staking_monitor.getDAIBalance({"from": user}),
+            "swapRound": 1,
+        }
+        for user, balance_to_swap in zip(users, balances_to_swap)
+    ]
+    assert [
+        {
+            key: value
+            for key, value in record.items()
+            if key.startswith("_") or key == "swapRound"
+        }
+        for record in records_from_logs
+    ] == records_from_events
+    assert {record["transactionHash"] for record in records_from_logs} == {tx.txid}
+
+
+def test_swap_round_participants_include_the_users_not_credited_yet(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = [get_account(5), get_account(6)]
+    current_price = staking_monitor.getPrice()
+    # the first user is in the bucket of the price, and is credited by the swap itself. The second one is
+    # in a pool far under the price, which is swapped without visiting them
+    for user, price_limit in zip(
+        users, [(current_price - 200000) / 100000000, current_price // 2 // 100000000]
+    ):
+        staking_monitor.deposit(
+            {"from": user, "value": Web3.toWei(0.01, "ether")}
+        ).wait(1)
+        staking_monitor.setOrder(price_limit, 40, {"from": user}).wait(1)
+        get_account(1).transfer(user, Web3.toWei(0.003, "ether"))
+    staking_monitor.setBalancesToSwap({"from": get_account()}).wait(1)
+    users_data = [staking_monitor.s_users(user.address) for user in users]
+
+    # Act
+    tx = staking_monitor.checkConditionsAndPerformSwap({"from": get_account()})
+    tx.wait(1)
+    (swap_batch,) = get_swap_batches(staking_monitor, tx.block_number)
+    participants = get_swap_round_participants(staking_monitor, swap_batch)
+
+    # Assert
+    assert [record["_address"] for record in tx.events["SwapSettled"]] == [
+        users[0].address
+    ]
+    assert participants == [
+        {
+            "_address": user.address,
+            "_totalReward": user_data["balanceToSwap"],
+            "_setPriceLimit": user_data["priceLimit"],
+            "_DAIReceived": staking_monitor.getDAIBalance({"from": user}),
+            "swapRound": 1,
+        }
+        for user, user_data in zip(users, users_data)
+    ]
+
+
+def test_get_price_bucket_matches_the_contract(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+
+    # Act & Assert
+    for price in [0, 127, 128, 200000000000, 2**128 - 1]:
+        assert get_price_bucket(price) == staking_monitor.getPriceBucket(price)
@@ -0,0 +1,50 @@
+from scripts.helpful_scripts import create_funded_accounts
+from scripts.tx_pipeline import TransactionPipeline
+from web3 import Web3
+
+
+def test_pipeline_sends_dependent_calls_in_order(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    users = create_funded_accounts(5, Web3.toWei(1, "ether"))
+    deposit_value = Web3.toWei(0.01, "ether")
+    calls = []
+    for user in users:
+        calls.append(
+            (staking_monitor.deposit, [], {"from": user, "value": deposit_value})
+        )
+        # setOrder reverts for users who haven't deposited yet
+        calls.append((staking_monitor.setOrder, [2000, 40], {"from": user}))
+
+    # Act
+    result = TransactionPipeline(max_in_flight=4, workers=2).send(calls)
+
+    # Assert
+    assert result.errors == [None] * len(calls)
+    assert result.confirmed == len(calls)
+    assert result.tx_per_second > 0
+    for user in users:
+        assert staking_monitor.s_users(user.address)["depositBalance"] == deposit_value
+        assert staking_monitor.s_users(user.address)["percentageToSwap"] == 40
+
+
+def test_pipeline_required_funds_cover_the_upfront_gas(
+    deploy_staking_monitor_contract,
+):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    user = create_funded_accounts(1, Web3.toWei(1, "ether"))[0]
+    pipeline = TransactionPipeline(gas_limit=300000, gas_price=Web3.toWei(10, "gwei"))
+    deposit_value = Web3.toWei(0.01, "ether")
+    calls = [
+        (staking_monitor.deposit, [], {"from": user, "value": deposit_value}),
+        (staking_monitor.setOrder, [2000, 40], {"from": user, "gas_limit": 100000}),
+    ]
+
+    # Act
+    required_funds = pipeline.get_required_funds(calls)
+
+    # Assert
+    assert required_funds == {
+        user.address: deposit_value + (300000 + 100000) * Web3.toWei(10, "gwei")
+    }
@@ -0,0 +1,49 @@
+from brownie import chain
+from scripts.helpful_scripts import get_account
+from scripts.upkeep_metrics import UpkeepMetrics
+from web3 import Web3
+
+
+def test_upkeep_performed_is_exported_as_metrics(deploy_staking_monitor_contract):
+    # Arrange
+    staking_monitor = deploy_staking_monitor_contract
+    metrics = UpkeepMetrics(staking_monitor)
+    user = get_account(2)
+    staking_monitor.deposit({"from": user, "value": Web3.toWei(0.01, "ether")}).wait(1)
+    current_price = staking_monitor.getPrice()
+    staking_monitor.setOrder(
+        (current_price - 200000) / 100000000, 40, {"from": user}
+    ).wait(1)
+    reward = Web3.toWei(0.003, "ether")
+    get_account(1).transfer(user, reward)
+    chain.sleep(staking_monitor.interval() + 1)
+    chain.mine(1)
+
+    # Act
+    tx = staking_monitor.performUpkeep(b"", {"from": get_account()})
+    tx.wait(1)
+    read = metrics.update()
+    rendered = metrics.render()
+
+    # Assert
+    event = tx.events["UpkeepPerformed"]
+    assert event["_usersScanned"] == 1
+    assert event["_usersRewarded"] == 1
+    assert event["_swapParticipants"] == 1
+    assert event["_totalETHSwapped"] == reward * 40 // 100
+    assert event["_ETHPrice"] == current_price
+    assert read == 1
+    # the events already read are not counted twice
+    assert metrics.update() == 0
+    labels = f'{{contract="{staking_monitor.address}"}}'
+    assert f"staking_monitor_upkeeps_total{labels} 1" in rendered
+    assert f"staking_monitor_users_rewarded_total{labels} 1" in rendered
+    assert f"staking_monitor_eth_price{labels} {current_price}" in rendered
+    assert (
+        f'staking_monitor_swap_size_eth_bucket{{contract="{staking_monitor.address}",le="0.01"}} 1'
+        in rendered
+    )
+    assert (
+        f'staking_monitor_swap_size_eth_bucket{{contract="{staking_monitor.address}",le="0.001"}} 0'
+        in rendered
+    )